@@ -1,3 +1,7 @@
+import multiprocessing
+
 from hyo2.ssm2.app.gui.ssm_sis import gui
 
-gui.gui()
+if __name__ == '__main__':
+    multiprocessing.freeze_support()  # required by the process pools (e.g., the batch DQA) of the frozen app
+    gui.gui()
@@ -122,6 +122,11 @@ class Database(AbstractWidget):
         self.import_data_act.triggered.connect(self.import_data)
         self.main_win.database_menu.addAction(self.import_data_act)
 
+        # ---- compress project (menu only, since not reversible by the older versions)
+        self.compress_project_act = QtGui.QAction('Compress Current Project DB', self)
+        self.compress_project_act.triggered.connect(self.compress_project)
+        self.main_win.database_menu.addAction(self.compress_project_act)
+
         # ---- project folder
         self.btn_project_folder = QtWidgets.QPushButton("Open folder")
         self.btn_project_folder.clicked.connect(self.project_folder)
@@ -686,6 +691,38 @@ class Database(AbstractWidget):
 
         self.update_table()
 
+    def compress_project(self):
+        logger.debug("user want to compress the current project")
+
+        self.main_win.switch_to_database_tab()
+
+        if self.lib.db_has_columnar_samples():
+            QtWidgets.QMessageBox.information(self, "Database", "The current project is already compressed.")
+            return
+
+        ret = QtWidgets.QMessageBox.question(self, "Compress project",
+                                             "The samples of the current project will be stored as\n"
+                                             "compressed columns: the DB will be smaller and faster to read,\n"
+                                             "but the older versions of Sound Speed Manager will show\n"
+                                             "its profiles without samples (deleting them, or saving\n"
+                                             "them again, still works in the older versions).\n\n"
+                                             "A backup copy of the DB is saved before the conversion.\n\n"
+                                             "Do you want to continue?",
+                                             QtWidgets.QMessageBox.StandardButton.Yes |
+                                             QtWidgets.QMessageBox.StandardButton.No)
+        if ret != QtWidgets.QMessageBox.StandardButton.Yes:
+            return
+
+        backup_path = self.lib.db_convert_to_columnar_samples()
+        if backup_path is None:
+            QtWidgets.QMessageBox.warning(self, "Database", "Unable to compress the current project!",
+                                          QtWidgets.QMessageBox.StandardButton.Ok)
+            return
+
+        QtWidgets.QMessageBox.information(self, "Database",
+                                          "The current project has been compressed.\n\nBackup: %s" % backup_path)
+        self.update_table()
+
     def project_folder(self):
         logger.debug("user want to open the project folder")
 
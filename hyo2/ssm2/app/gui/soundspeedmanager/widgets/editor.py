@@ -17,6 +17,7 @@ from hyo2.ssm2.app.gui.soundspeedmanager.dialogs.spreadsheet_dialog import Sprea
 from hyo2.ssm2.app.gui.soundspeedmanager.widgets.dataplots import DataPlots
 from hyo2.ssm2.app.gui.soundspeedmanager.widgets.widget import AbstractWidget
 from hyo2.ssm2.lib.profile.dicts import Dicts
+from hyo2.ssm2.lib.profile.profile import Profile
 
 if TYPE_CHECKING:
     from hyo2.ssm2.app.gui.soundspeedmanager.mainwin import MainWin
@@ -419,22 +420,13 @@ class Editor(AbstractWidget):
 
         self.main_win.switch_to_editor_tab()
 
-        tolerances = [0.01, 0.1, 0.5]
-        for tolerance in tolerances:
-
-            if not self.lib.prepare_sis(thin_tolerance=tolerance):
-                msg = "Issue in preview the thinning"
-                QtWidgets.QMessageBox.warning(self, "Thinning preview", msg, QtWidgets.QMessageBox.StandardButton.Ok)
-                return
-
-            # checking for number of samples
-            si = self.lib.cur.sis_thinned
-            thin_profile_length = self.lib.cur.sis.flag[si].size
-            logger.debug("thin profile size: %d (with tolerance: %.3f)" % (thin_profile_length, tolerance))
-            if thin_profile_length < 1000:
-                break
+        if not self.lib.prepare_sis(thin_max_samples=Profile.MAX_SIS_SAMPLES):
+            msg = "Issue in preview the thinning"
+            QtWidgets.QMessageBox.warning(self, "Thinning preview", msg, QtWidgets.QMessageBox.StandardButton.Ok)
+            return
 
-            logger.info("too many samples, attempting with a lower tolerance")
+        si = self.lib.cur.sis_thinned
+        logger.debug("thin profile size: %d" % self.lib.cur.sis.flag[si].size)
 
         self.dataplots.update_data()
 
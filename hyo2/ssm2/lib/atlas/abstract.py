@@ -34,6 +34,39 @@ class AbstractAtlas(metaclass=ABCMeta):
               server_mode: bool = False) -> ProfileList | None:
         pass
 
+    def query_many(self, lats: list[float], lons: list[float], datestamps: list[datetime | None],
+                   server_mode: bool = False) -> list[ProfileList | None]:
+        """Query the atlas for many locations and timestamps, returning a profile list (or None) for each of them
+
+        The atlases override this method to read the data for nearby queries at once."""
+        self.check_batch(lats=lats, lons=lons, datestamps=datestamps)
+        return [self.query(lat=lat, lon=lon, datestamp=datestamp, server_mode=server_mode)
+                for lat, lon, datestamp in zip(lats, lons, datestamps)]
+
+    @classmethod
+    def check_batch(cls, lats: list[float], lons: list[float], datestamps: list[datetime | None]) -> None:
+        if (len(lats) != len(lons)) or (len(lats) != len(datestamps)):
+            raise RuntimeError("invalid batch query: %d latitudes, %d longitudes, %d timestamps"
+                               % (len(lats), len(lons), len(datestamps)))
+
+    @classmethod
+    def batch_clusters(cls, boxes: list[tuple[int, int, int, int]], max_nodes: int) -> list[list[int]]:
+        """Group the passed (lat_min, lat_max, lon_min, lon_max) boxes of grid indices, so that the bounding box of
+        each group has at most max_nodes nodes (or a single box), and it can be read at once"""
+        clusters = list()
+        bbox = None
+        for i in sorted(range(len(boxes)), key=lambda j: (boxes[j][0], boxes[j][2])):
+            box = boxes[i]
+            if bbox is not None:
+                merged = (min(bbox[0], box[0]), max(bbox[1], box[1]), min(bbox[2], box[2]), max(bbox[3], box[3]))
+                if (merged[1] - merged[0] + 1) * (merged[3] - merged[2] + 1) <= max_nodes:
+                    clusters[-1].append(i)
+                    bbox = merged
+                    continue
+            clusters.append([i])
+            bbox = box
+        return clusters
+
     @abstractmethod
     def download_db(self) -> bool:
         pass
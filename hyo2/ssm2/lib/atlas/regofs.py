@@ -3,7 +3,7 @@ from datetime import datetime, timezone
 from typing import TYPE_CHECKING
 
 from netCDF4 import Dataset, num2date
-from numpy import full_like, isnan, nan, ma, zeros, nanargmin, unravel_index
+from numpy import arange, argmin, float64, full_like, inf, isfinite, isnan, nan, ma, newaxis, where, zeros
 from numpy import typing
 
 # noinspection PyUnresolvedReferences
@@ -57,6 +57,8 @@ class RegOfs(AbstractAtlas):
         self._lon_min: float | None = None
         self._lon_max: float | None = None
 
+        self.batch_max_nodes: int = 4096  # The max number of nodes (for each level) in a single read of a batch query
+
     @property
     def lat_step(self) -> float:
         if self._lat_step is None:
@@ -124,31 +126,96 @@ class RegOfs(AbstractAtlas):
         logger.debug(("Query datetime: %s" % datestamp.isoformat()))
         logger.debug("Retrieved datetime: %s" % datetime_retrieved.isoformat())
 
+        lat_s_idx, lat_n_idx, lon_w_idx, lon_e_idx = self._window(lat_idx=lat_idx, lon_idx=lon_idx)
+        t, s = self._read_box(lat_s_idx=lat_s_idx, lat_n_idx=lat_n_idx, lon_w_idx=lon_w_idx, lon_e_idx=lon_e_idx)
+        return self._profiles(lat=lat, lon=lon, datestamp=datestamp, lat_s_idx=lat_s_idx, lon_w_idx=lon_w_idx,
+                              t=t, s=s)
+
+    def query_many(self, lats: list[float | None], lons: list[float | None], datestamps: list[datetime | None],
+                   server_mode: bool = False) -> list[ProfileList | None]:
+        """Query OFS for many locations and timestamps, with a single read for the nearby queries of each day"""
+        self.check_batch(lats=lats, lons=lons, datestamps=datestamps)
+        profiles = [None] * len(lats)
+
+        datestamps = [datetime.now(tz=timezone.utc) if datestamp is None else datestamp for datestamp in datestamps]
+        days = dict()
+        for i, (lat, lon, datestamp) in enumerate(zip(lats, lons, datestamps)):
+            if (lat is None) or (lon is None):
+                logger.error("invalid query: %s @ (%s, %s)" % (datestamp, lon, lat))
+                continue
+            days.setdefault(datestamp.date(), list()).append(i)
+
+        for indices in days.values():
+            # a failing day (e.g., an unavailable remote file) does not discard the profiles of the other days
+            # noinspection PyBroadException
+            try:
+                self._query_day(indices=indices, lats=lats, lons=lons, datestamps=datestamps, profiles=profiles,
+                                server_mode=server_mode)
+            except Exception as e:
+                logger.warning("unable to retrieve %s data for timestamp: %s, %s"
+                               % (self.name, datestamps[indices[0]].strftime("%Y/%m/%d %H:%M:%S"), e))
+
+        return profiles
+
+    def _query_day(self, indices: list[int], lats: list[float], lons: list[float], datestamps: list[datetime],
+                   profiles: list[ProfileList | None], server_mode: bool) -> None:
+        """Populate the profiles of the passed queries of the same day"""
+        # the data set of the day is opened only once (the remote file only depends on the date)
+        if not self.download_db(datestamps[indices[0]], server_mode=server_mode):
+            logger.error("troubles in updating data set for timestamp: %s"
+                         % datestamps[indices[0]].strftime("%Y/%m/%d %H:%M:%S"))
+            return
+
+        windows = dict()
+        for i in indices:
+            try:
+                lat_idx, lon_idx = self._grid_idx(lat=lats[i], lon=lons[i])
+                if lat_idx is None or lon_idx is None:
+                    logger.info("troubles with data source or location outside of %s coverage" % self.name)
+                    continue
+
+            except TypeError as e:
+                logger.critical("while converting location to grid coords, %s" % e)
+                continue
+
+            windows[i] = self._window(lat_idx=lat_idx, lon_idx=lon_idx)
+
+        indices = list(windows)
+        for cluster in self.batch_clusters(boxes=[windows[i] for i in indices], max_nodes=self.batch_max_nodes):
+            cluster = [indices[j] for j in cluster]
+            lat_0 = min(windows[i][0] for i in cluster)
+            lon_0 = min(windows[i][2] for i in cluster)
+            t, s = self._read_box(lat_s_idx=lat_0, lat_n_idx=max(windows[i][1] for i in cluster),
+                                  lon_w_idx=lon_0, lon_e_idx=max(windows[i][3] for i in cluster))
+            for i in cluster:
+                lat_s_idx, lat_n_idx, lon_w_idx, lon_e_idx = windows[i]
+                box = (slice(None), slice(lat_s_idx - lat_0, lat_n_idx - lat_0 + 1),
+                       slice(lon_w_idx - lon_0, lon_e_idx - lon_0 + 1))
+                profiles[i] = self._profiles(lat=lats[i], lon=lons[i], datestamp=datestamps[i],
+                                             lat_s_idx=lat_s_idx, lon_w_idx=lon_w_idx, t=t[box], s=s[box])
+
+    def _window(self, lat_idx: int, lon_idx: int) -> tuple[int, int, int, int]:
+        """The (south, north, west, east) indices of the search window around the passed node, clipped to the grid"""
         if self._lon is None:
             raise RuntimeError("_lon is unset")
         if self._lat is None:
             raise RuntimeError("_lat is unset")
 
         logger.debug("idx > lat: %s, lon: %s" % (lat_idx, lon_idx))
-        lat_s_idx = lat_idx - self._search_half_window
-        if lat_s_idx < 0:
-            lat_s_idx = 0
-        lat_n_idx = lat_idx + self._search_half_window
-        if lat_n_idx >= self._lat.shape[0]:
-            lat_n_idx = self._lat.shape[0] - 1
-        lon_w_idx = lon_idx - self._search_half_window
-        if lon_w_idx < 0:
-            lon_w_idx = 0
-        lon_e_idx = lon_idx + self._search_half_window
-        if lon_e_idx >= self._lon.shape[1]:
-            lon_e_idx = self._lon.shape[1] - 1
+        lat_s_idx = max(lat_idx - self._search_half_window, 0)
+        lat_n_idx = min(lat_idx + self._search_half_window, self._lat.shape[0] - 1)
+        lon_w_idx = max(lon_idx - self._search_half_window, 0)
+        lon_e_idx = min(lon_idx + self._search_half_window, self._lon.shape[1] - 1)
         # logger.info("indices -> %s %s %s %s" % (lat_s_idx, lat_n_idx, lon_w_idx, lon_e_idx))
-        lat_search_window = lat_n_idx - lat_s_idx + 1
-        lon_search_window = lon_e_idx - lon_w_idx + 1
-        logger.info("updated search window: (%s, %s)" % (lat_search_window, lon_search_window))
 
+        return lat_s_idx, lat_n_idx, lon_w_idx, lon_e_idx
+
+    def _read_box(self, lat_s_idx: int, lat_n_idx: int, lon_w_idx: int,
+                  lon_e_idx: int) -> tuple[typing.NDArray, typing.NDArray]:
+        """Read the (depth, lat, lon) potential temperatures and salinities in the passed box, NaN if missing"""
         # Need +1 on the north and east indices since it is the "stop" value in these slices
-        t = self._file.variables['temp'][self._day_idx, :][..., lat_s_idx:lat_n_idx + 1, lon_w_idx:lon_e_idx + 1]
+        box = (self._day_idx, slice(None), slice(lat_s_idx, lat_n_idx + 1), slice(lon_w_idx, lon_e_idx + 1))
+        t = self._file.variables['temp'][box]
         # logger.debug('t shape: %s' % (t.shape, ))
         # https://ponce.sdsu.edu/lakesalinityworld.html#:~:text=The%20salinity%20of%20Lake%20Superior,between%200.05%20and%200.60%20ppt.
         if self.model == RegOfsModel.LMHOFS:
@@ -156,82 +223,53 @@ class RegOfs(AbstractAtlas):
         elif self.model == RegOfsModel.LOOFS:
             s = full_like(t, 0.5)
         else:
-            s = self._file.variables['salt'][self._day_idx, :][..., lat_s_idx:lat_n_idx + 1, lon_w_idx:lon_e_idx + 1]
+            s = self._file.variables['salt'][box]
+
         # Set 'unfilled' elements to NANs (BUT when the entire array has valid data, it returns numpy.ndarray)
-        if isinstance(t, ma.core.MaskedArray):
-            t_mask = t.mask
-            t._sharedmask = False
-            t[t_mask] = nan
-        if isinstance(s, ma.core.MaskedArray):
-            s_mask = s.mask
-            s._sharedmask = False
-            s[s_mask] = nan
+        return ma.filled(ma.asarray(t, dtype=float64), nan), ma.filled(ma.asarray(s, dtype=float64), nan)
+
+    def _profiles(self, lat: float, lon: float, datestamp: datetime, lat_s_idx: int, lon_w_idx: int,
+                  t: typing.NDArray, s: typing.NDArray) -> ProfileList | None:
+        """Populate the output profile with the closest valid values in the search window at each depth level"""
+        lat_search_window = t.shape[1]
+        lon_search_window = t.shape[2]
+        logger.info("updated search window: (%s, %s)" % (lat_search_window, lon_search_window))
 
         # Calculate distances from requested position to each of the grid node locations
-        distances = zeros((self._d.size, lon_search_window, lat_search_window))
-        # logger.debug('distances shape: %s' % (distances.shape,))
-        longitudes = self._lon[lat_s_idx:lat_n_idx + 1, lon_w_idx:lon_e_idx + 1]
-        latitudes = self._lat[lat_s_idx:lat_n_idx + 1, lon_w_idx:lon_e_idx + 1]
+        distances = zeros((lat_search_window, lon_search_window))
+        longitudes = self._lon[lat_s_idx:lat_s_idx + lat_search_window, lon_w_idx:lon_w_idx + lon_search_window]
+        latitudes = self._lat[lat_s_idx:lat_s_idx + lat_search_window, lon_w_idx:lon_w_idx + lon_search_window]
 
         for i in range(lat_search_window):
 
             for j in range(lon_search_window):
-                dist = self.g.distance(longitudes[i, j], latitudes[i, j], lon, lat)
-                distances[:, i, j] = dist
+                distances[i, j] = self.g.distance(longitudes[i, j], latitudes[i, j], lon, lat)
                 # logger.info("node (%s %s), pos: %3.2f, %3.2f, dist: %3.1f"
-                #             % (i, j, latitudes[i, j], longitudes[i, j], distances[0, i, j]))
+                #             % (i, j, latitudes[i, j], longitudes[i, j], distances[i, j]))
 
-        # Get mask of "no data" elements and replace these with NaNs in distance array
-        t_mask = isnan(t)
-        distances[t_mask] = nan
-        s_mask = isnan(s)
-        distances[s_mask] = nan
-        # logger.info("distance array:\n%s" % distances[0])
+        # For each depth level, the closest node with both temperature and salinity ("no data" nodes are skipped)
+        t = t.reshape((t.shape[0], -1))
+        s = s.reshape((s.shape[0], -1))
+        masked_distances = where(isnan(t) | isnan(s), inf, distances.ravel()[newaxis, :])
+        node_idx = argmin(masked_distances, axis=1)
+        levels = arange(t.shape[0])
+        has_value = isfinite(masked_distances[levels, node_idx])
 
-        # Spin through all the depth levels
-        temp_pot = zeros(self._d.size)
+        temp_pot = where(has_value, t[levels, node_idx], 0.0)
         temp_in_situ = zeros(self._d.size)
         d = zeros(self._d.size)
-        sal = zeros(self._d.size)
-        num_values = 0
-        for i in range(self._d.size):
-
-            t_level = t[i]
-            s_level = s[i]
-            d_level = distances[i]
-
-            try:
-                ind = nanargmin(d_level)
-            except ValueError:
-                # logger.info("%s: all-NaN slices" % i)
-                continue
-
-            if isnan(ind):
-                logger.info("%s: bottom of valid data" % i)
-                break
-
-            ind2 = unravel_index(ind, t_level.shape)
-
-            t_closest = t_level[ind2]
-            s_closest = s_level[ind2]
-            # d_closest = d_level[ind2]
-
-            temp_pot[i] = t_closest
-            sal[i] = s_closest
-            d[i] = self._d[i]
-
-            # Calculate in-situ temperature
-            p = Oc.d2p(d[i], lat)
-            temp_in_situ[i] = Oc.in_situ_temp(s=sal[i], t=t_closest, p=p, pr=self._ref_p)
-            # logger.info("%02d: %6.1f %6.1f > T/S/Dist: %3.1f %3.1f %3.1f [pot.temp. %3.1f]"
-            #             % (i, d[i], p, temp_in_situ[i], s_closest, d_closest, t_closest))
-
-            num_values += 1
+        d[has_value] = self._d[has_value]
+        sal = where(has_value, s[levels, node_idx], 0.0)
+        num_values = int(has_value.sum())
 
         if num_values == 0:
             logger.info("no data from lookup!")
             return None
 
+        # Calculate in-situ temperature for all the retrieved levels
+        p = Oc.d2p(d[has_value], lat)
+        temp_in_situ[has_value] = Oc.in_situ_temp(s=sal[has_value], t=temp_pot[has_value], p=p, pr=self._ref_p)
+
         # Make a new SV object to return our query in
         ssp = Profile()
         ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
@@ -265,6 +303,10 @@ class RegOfs(AbstractAtlas):
             logger.error("troubles in updating data set for timestamp: %s" % datestamp.strftime("%Y/%m/%d %H:%M:%S"))
             return None, None
 
+        return self._grid_idx(lat=lat, lon=lon)
+
+    def _grid_idx(self, lat: float, lon: float) -> tuple[int | None, int | None]:
+        """Nearest node of the loaded regular grid to the passed position"""
         # check validity of longitude and latitude
         if lon < (self.lon_min - self.lon_step / 2.0):
             return None, None
@@ -49,6 +49,8 @@ class Rtofs(AbstractAtlas):
         self._lat = None
         self._lon = None
 
+        self.batch_max_nodes = 4096  # The max number of nodes (for each level) in a single read of a batch query
+
     def clear_data(self) -> None:
         """Delete the data and reset the last loaded day"""
         logger.debug("clearing data")
@@ -237,6 +239,10 @@ class Rtofs(AbstractAtlas):
             logger.error("troubles in downloading RTOFS data for timestamp: %s" % datestamp.strftime("%Y%m%d"))
             return None, None
 
+        return self._grid_idx(lat=lat, lon=lon)
+
+    def _grid_idx(self, lat: float, lon: float) -> tuple:
+        """Nearest node of the loaded grid to the passed position"""
         # make longitude "safe" since RTOFS grid starts at east longitude 70-ish degrees
         if lon < self._lon.min():
             lon += 360.0
@@ -283,39 +289,96 @@ class Rtofs(AbstractAtlas):
 
         # logger.debug("RTOFS idx: (%s, %s)" % (lat_idx, lon_idx))
 
-        # Spin through all the depth levels
-        temp_pot = np.zeros(self._d.size)
+        temp_pot, sal = self._read_box(lat_0=lat_idx, lat_1=lat_idx, lon_0=lon_idx, lon_1=lon_idx)
+        return self._profiles(lat=lat, lon=lon, datestamp=datestamp, temp_pot=temp_pot[:, 0, 0], sal=sal[:, 0, 0])
+
+    def query_many(self, lats: list[float | None], lons: list[float | None], datestamps: list[dt | None],
+                   server_mode: bool = False) -> list[ProfileList | None]:
+        """Query RTOFS for many locations and timestamps, with a single read for the nearby queries of each day"""
+        self.check_batch(lats=lats, lons=lons, datestamps=datestamps)
+        profiles = [None] * len(lats)
+
+        datestamps = [dt.now(UTC) if datestamp is None else datestamp for datestamp in datestamps]
+        days = dict()
+        for i, (lat, lon, datestamp) in enumerate(zip(lats, lons, datestamps)):
+            if (lat is None) or (lon is None):
+                logger.error("invalid query: %s @ (%s, %s)" % (datestamp.strftime("%Y/%m/%d %H:%M:%S"), lon, lat))
+                continue
+            days.setdefault(datestamp.date(), list()).append(i)
+
+        for indices in days.values():
+            # a failing day (e.g., a download or read error) does not discard the profiles of the other days
+            # noinspection PyBroadException
+            try:
+                self._query_day(indices=indices, lats=lats, lons=lons, datestamps=datestamps, profiles=profiles,
+                                server_mode=server_mode)
+            except Exception as e:
+                logger.warning("unable to retrieve RTOFS data for timestamp: %s, %s"
+                               % (datestamps[indices[0]].strftime("%Y%m%d"), e))
+
+        return profiles
+
+    def _query_day(self, indices: list[int], lats: list[float], lons: list[float], datestamps: list[dt],
+                   profiles: list[ProfileList | None], server_mode: bool) -> None:
+        """Populate the profiles of the passed queries of the same day"""
+        # the data set of the day is checked (and downloaded, if needed) only once
+        if not self.download_db(datestamps[indices[0]], server_mode=server_mode):
+            logger.error("troubles in downloading RTOFS data for timestamp: %s"
+                         % datestamps[indices[0]].strftime("%Y%m%d"))
+            return
+
+        nodes = dict()
+        for i in indices:
+            try:
+                lat_idx, lon_idx = self._grid_idx(lat=lats[i], lon=lons[i])
+                if lat_idx is None:
+                    logger.info("troubles with data source or location outside of %s coverage" % self.name)
+                    continue
+
+            except TypeError as e:
+                logger.critical("while converting location to grid coords, %s" % e, exc_info=True)
+                continue
+
+            nodes[i] = (lat_idx, lon_idx)
+
+        indices = list(nodes)
+        boxes = [(nodes[i][0], nodes[i][0], nodes[i][1], nodes[i][1]) for i in indices]
+        for cluster in self.batch_clusters(boxes=boxes, max_nodes=self.batch_max_nodes):
+            cluster = [indices[j] for j in cluster]
+            lat_0 = min(nodes[i][0] for i in cluster)
+            lon_0 = min(nodes[i][1] for i in cluster)
+            temp_pot, sal = self._read_box(lat_0=lat_0, lat_1=max(nodes[i][0] for i in cluster),
+                                           lon_0=lon_0, lon_1=max(nodes[i][1] for i in cluster))
+            for i in cluster:
+                lat_idx = nodes[i][0] - lat_0
+                lon_idx = nodes[i][1] - lon_0
+                profiles[i] = self._profiles(lat=lats[i], lon=lons[i], datestamp=datestamps[i],
+                                             temp_pot=temp_pot[:, lat_idx, lon_idx], sal=sal[:, lat_idx, lon_idx])
+
+    def _read_box(self, lat_0: int, lat_1: int, lon_0: int, lon_1: int) -> tuple[np.ndarray, np.ndarray]:
+        """Read the (depth, lat, lon) potential temperatures and salinities in the passed box, NaN if missing"""
+        box = (self._day_idx, slice(None), slice(lat_0, lat_1 + 1), slice(lon_0, lon_1 + 1))
+        temp_pot = np.ma.filled(np.ma.asarray(self._file_temp.variables['temperature'][box], dtype=np.float64), np.nan)
+        sal = np.ma.filled(np.ma.asarray(self._file_sal.variables['salinity'][box], dtype=np.float64), np.nan)
+        return temp_pot, sal
+
+    def _profiles(self, lat: float, lon: float, datestamp: dt, temp_pot: np.ndarray,
+                  sal: np.ndarray) -> ProfileList | None:
+        """Populate the output profile with the values down to the first missing one"""
         temp_in_situ = np.zeros(self._d.size)
-        d = np.zeros(self._d.size)
-        sal = np.zeros(self._d.size)
-        num_values = 0
-        for i in range(self._d.size):
-
-            t_p = self._file_temp.variables['temperature'][self._day_idx, i, lat_idx, lon_idx]
-            if isinstance(t_p, np.ma.core.MaskedArray):
-                t_p = t_p.filled(np.nan)
-            temp_pot[i] = t_p
-            s = self._file_sal.variables['salinity'][self._day_idx, i, lat_idx, lon_idx]
-            if isinstance(s, np.ma.core.MaskedArray):
-                s = s.filled(np.nan)
-            sal[i] = s
-            d[i] = self._d[i]
-
-            if np.isnan(temp_pot[i]) or np.isnan(sal[i]):
-                break
-
-            # Calculate in-situ temperature
-            p = Oc.d2p(d[i], lat)
-            temp_in_situ[i] = Oc.in_situ_temp(s=sal[i], t=temp_pot[i], p=p, pr=self._ref_p)
-            # logger.info("%02d: %6.1f (%6.1f) > Tp/Ts/Sal: %3.2f %3.2f %3.2f"
-            #             % (i, d[i], p, temp_pot[i], temp_in_situ[i], sal[i]))
-
-            num_values += 1
+        d = np.asarray(self._d, dtype=np.float64)
+        missing = np.isnan(temp_pot) | np.isnan(sal)
+        num_values = int(np.argmax(missing)) if np.any(missing) else self._d.size
 
         if num_values == 0:
             logger.info("no data from lookup!")
             return None
 
+        # Calculate in-situ temperature for the whole column
+        p = Oc.d2p(d[0:num_values], lat)
+        temp_in_situ[0:num_values] = Oc.in_situ_temp(s=sal[0:num_values], t=temp_pot[0:num_values], p=p,
+                                                     pr=self._ref_p)
+
         # Make a new SV object to return our query in
         ssp = Profile()
         ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
@@ -0,0 +1,225 @@
+import logging
+from abc import abstractmethod
+from datetime import datetime as dt, UTC
+
+import numpy as np
+
+from hyo2.ssm2.lib.atlas.abstract import AbstractAtlas
+from hyo2.ssm2.lib.atlas.woa_search import WoaSearch
+from hyo2.ssm2.lib.profile.dicts import Dicts
+from hyo2.ssm2.lib.profile.profile import Profile
+from hyo2.ssm2.lib.profile.profilelist import ProfileList
+
+logger = logging.getLogger(__name__)
+
+
+class WoaAtlas(AbstractAtlas):
+    """Common WOA atlas: the single and the batch queries of the closest valid values around a position
+
+    The derived atlases load the grids and the datasets, and select the monthly and seasonal data."""
+
+    probe_type = "WOA"  # the label of the probe type (and of the original path) of the output profiles
+
+    def preload(self, datestamp: dt | None = None) -> None:
+        """Open the datasets for the passed timestamp (by default, they are opened on demand)"""
+        pass
+
+    @abstractmethod
+    def load_grids(self) -> bool:
+        pass
+
+    @abstractmethod
+    def grid_coords(self, lat: float, lon: float) -> tuple:
+        pass
+
+    @abstractmethod
+    def calc_datestamp_indices(self, datestamp: dt) -> None:
+        """Set the month and season indices for the passed timestamp"""
+        pass
+
+    @abstractmethod
+    def month_season_vars(self, var_name: str) -> tuple:
+        """Return the monthly variable, its time index, the seasonal variable, and its time index"""
+        pass
+
+    @classmethod
+    def query_lon(cls, lon: float) -> float:
+        """Convert the passed longitude to the convention of the grid"""
+        return lon
+
+    def query(self, lat: float, lon: float, datestamp: dt | None = None, server_mode: bool = False):
+        """Query the atlas for passed location and timestamp"""
+        if datestamp is None:
+            datestamp = dt.now(UTC)
+        if not isinstance(datestamp, dt):
+            raise RuntimeError("invalid datetime passed: %s" % type(datestamp))
+
+        # check the inputs
+        if (lat is None) or (lon is None):
+            logger.error("invalid query: %s @ (%s, %s)" % (datestamp.strftime("%Y/%m/%d %H:%M:%S"), lon, lat))
+            return None
+        logger.debug("query: %s @ (%.6f, %.6f)" % (datestamp, lon, lat))
+        lon = self.query_lon(lon)
+
+        if not self.has_data_loaded:
+            if not self.load_grids():
+                logger.error("No data")
+                return None
+
+        self.calc_datestamp_indices(datestamp=datestamp)
+        if server_mode:  # the server will likely move to the next month, so its datasets are kept open
+            self.preload(datestamp=datestamp)
+
+        # Search the sea nodes surrounding the requested position, then keep the closest valid value at each level
+        window = self._window(lat=lat, lon=lon)
+        if window is None:
+            return None
+        lat_idx, lon_idx, dist = window
+        t, s, t_sd, s_sd = self._read_merged(lat_idx=lat_idx, lon_idx=lon_idx)
+        values = WoaSearch.closest_merged_values(dist=dist, t=t, s=s, t_sd=t_sd, s_sd=s_sd)
+
+        return self._profiles(lat=lat, lon=lon, datestamp=datestamp, values=values)
+
+    def query_many(self, lats: list[float], lons: list[float], datestamps: list[dt | None],
+                   server_mode: bool = False) -> list[ProfileList | None]:
+        """Query the atlas for many locations and timestamps, reading at once the nodes of nearby queries"""
+        self.check_batch(lats=lats, lons=lons, datestamps=datestamps)
+        profiles = [None] * len(lats)
+
+        if not self.has_data_loaded:
+            if not self.load_grids():
+                logger.error("No data")
+                return profiles
+
+        datestamps = [dt.now(UTC) if datestamp is None else datestamp for datestamp in datestamps]
+        lons = [None if lon is None else self.query_lon(lon) for lon in lons]
+        windows = dict()
+        pairs = dict()  # the queries for each pair of month and season indices
+        for i, (lat, lon, datestamp) in enumerate(zip(lats, lons, datestamps)):
+            if not isinstance(datestamp, dt):
+                raise RuntimeError("invalid datetime passed: %s" % type(datestamp))
+            if (lat is None) or (lon is None):
+                logger.error("invalid query: %s @ (%s, %s)" % (datestamp.strftime("%Y/%m/%d %H:%M:%S"), lon, lat))
+                continue
+            window = self._window(lat=lat, lon=lon)
+            if window is None:
+                continue
+            windows[i] = window
+
+            self.calc_datestamp_indices(datestamp=datestamp)
+            pairs.setdefault((self.month_idx, self.season_idx), list()).append(i)
+
+        # a pass for each pair of indices, with a single read for each cluster of nearby queries
+        for (month_idx, season_idx), indices in pairs.items():
+            self.month_idx = month_idx
+            self.season_idx = season_idx
+            boxes = [(windows[i][0].min(), windows[i][0].max(), windows[i][1].min(), windows[i][1].max())
+                     for i in indices]
+            for cluster in self.batch_clusters(boxes=boxes, max_nodes=self.batch_max_nodes):
+                cluster = [indices[j] for j in cluster]
+                lat_idx, lon_idx, positions = WoaSearch.union_nodes(windows=[windows[i][:2] for i in cluster],
+                                                                    n_lon=self.lon.size)
+                t, s, t_sd, s_sd = self._read_merged(lat_idx=lat_idx, lon_idx=lon_idx)
+                for i, pos in zip(cluster, positions):
+                    values = WoaSearch.closest_merged_values(dist=windows[i][2], t=t[:, pos], s=s[:, pos],
+                                                             t_sd=t_sd[:, pos], s_sd=s_sd[:, pos])
+                    profiles[i] = self._profiles(lat=lats[i], lon=lons[i], datestamp=datestamps[i], values=values)
+
+        return profiles
+
+    def _window(self, lat: float, lon: float) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """Return the (lat, lon) indices of the sea nodes around the passed position, and their distances"""
+        # Find the nearest grid node
+        lat_base_idx, lon_base_idx = self.grid_coords(lat=lat, lon=lon)
+
+        # Search nodes surrounding the requested position to find the closest non-land
+        lat_idx, lon_idx = WoaSearch.window_nodes(landsea=self.landsea, lat_base_idx=lat_base_idx,
+                                                  lon_base_idx=lon_base_idx, radius=self.search_radius)
+        if lat_idx.size == 0:
+            logger.info("possible request on land")
+            return None
+
+        # calculate the distance to the grid nodes
+        dist = np.asarray(self.g.distance(np.full(lat_idx.size, lon), np.full(lat_idx.size, lat),
+                                          np.asarray(self.lon, dtype=np.float64)[lon_idx],
+                                          np.asarray(self.lat, dtype=np.float64)[lat_idx]))
+
+        return lat_idx, lon_idx, dist
+
+    def _read_merged(self, lat_idx: np.ndarray,
+                     lon_idx: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Read the temperature and salinity profiles (and standard deviations) at the passed nodes
+
+        The returned (depth, node) arrays have the monthly values overwriting the top of the seasonal ones."""
+        if self.columns is not None:
+            nodes = self.columns.read_nodes(self.month_idx, self.season_idx, lat_idx, lon_idx)
+            if nodes is not None:
+                return nodes
+
+        merged = list()
+        for var_name in ('t_an', 's_an', 't_sd', 's_sd'):
+            month_var, month_time_idx, season_var, season_time_idx = self.month_season_vars(var_name)
+            merged.append(WoaSearch.merge(
+                month=WoaSearch.read_nodes(month_var, month_time_idx, lat_idx, lon_idx),
+                season=WoaSearch.read_nodes(season_var, season_time_idx, lat_idx, lon_idx)))
+        return merged[0], merged[1], merged[2], merged[3]
+
+    def _profile(self, lat: float, lon: float, datestamp: dt) -> Profile:
+        ssp = Profile()
+        ssp.meta.sensor_type = Dicts.sensor_types['Synthetic']
+        ssp.meta.probe_type = Dicts.probe_types[self.probe_type]
+        ssp.meta.latitude = lat
+        ssp.meta.longitude = lon
+        ssp.meta.utc_time = dt(year=datestamp.year, month=datestamp.month, day=datestamp.day,
+                               hour=datestamp.hour, minute=datestamp.minute, second=datestamp.second)
+        return ssp
+
+    def _profiles(self, lat: float, lon: float, datestamp: dt, values: dict) -> ProfileList:
+        """Populate the output profiles (and the min/max ones) with the selected values"""
+        valid = values['valid']
+        t = values['t']
+        s = values['s']
+        t_min = values['t_min']
+        t_max = values['t_max']
+        s_min = values['s_min']
+        s_max = values['s_max']
+        num_values = t[valid].size
+        logger.debug("valid: %s" % num_values)
+
+        if lon > 180.0:  # Go back to negative longitude
+            lon -= 360.0
+
+        # populate output profiles
+        ssp = self._profile(lat=lat, lon=lon, datestamp=datestamp)
+        ssp.meta.original_path = "%s_%s" % (self.probe_type, datestamp.strftime("%Y%m%d_%H%M%S"))
+        ssp.init_data(num_values)
+        ssp.data.depth = self.depth[0:num_values].copy()
+        ssp.data.temp = t[valid]
+        ssp.data.sal = s[valid]
+        ssp.calc_data_speed()
+        ssp.clone_data_to_proc()
+        ssp.init_sis()
+
+        # - min/max
+        # Isolate realistic values
+        missing_sd = ~(values['valid_t_sd'] & values['valid_s_sd'])
+        if np.any(missing_sd):
+            num_values = int(np.argmax(missing_sd))
+
+        profiles = ProfileList()
+        profiles.append_profile(ssp)
+        if num_values > 0:
+            # -- min, then max
+            for t_bound, s_bound in ((t_min, s_min), (t_max, s_max)):
+                ssp_bound = self._profile(lat=lat, lon=lon, datestamp=datestamp)
+                ssp_bound.init_data(num_values)
+                ssp_bound.data.depth = self.depth[0:num_values].astype(np.float64)
+                ssp_bound.data.temp = t_bound[valid][0:num_values]
+                ssp_bound.data.sal = s_bound[valid][0:num_values]
+                ssp_bound.calc_data_speed()
+                ssp_bound.clone_data_to_proc()
+                ssp_bound.init_sis()
+                profiles.append_profile(ssp_bound)
+        profiles.current_index = 0
+
+        return profiles
@@ -0,0 +1,133 @@
+import logging
+import os
+from typing import Callable
+
+import numpy as np
+
+from hyo2.ssm2.lib.atlas.woa_grids import WoaGrids
+from hyo2.ssm2.lib.atlas.woa_search import WoaSearch
+
+logger = logging.getLogger(__name__)
+
+
+class WoaColumns:
+    """Optional column store of a WOA atlas, for fast point queries
+
+    For each (month, season) pair, the merged monthly/seasonal t_an, s_an, t_sd and s_sd profiles of the sea nodes
+    are stored as float32 rows (one for each depth level, NaN for the missing values) in a memory-mapped file,
+    trimmed after the last level with any value. The columns of a node are contiguous, so that a query reads a single
+    slice for each node in the search window. The store is valid as long as the source files are unchanged."""
+
+    var_names = ['t_an', 's_an', 't_sd', 's_sd']
+
+    def __init__(self, values: np.ndarray, keys: np.ndarray, counts: np.ndarray, offsets: np.ndarray,
+                 num_levels: int) -> None:
+        self.values = values  # (row, variable)
+        self.keys = {(int(month_idx), int(season_idx)): i for i, (month_idx, season_idx) in enumerate(keys)}
+        self.counts = counts  # number of rows for each (key, lat, lon)
+        self.offsets = offsets  # first row of each (lat, lon) node
+        self.num_levels = num_levels
+
+    @classmethod
+    def load(cls, path: str, sources: list[str]) -> 'WoaColumns | None':
+        """Return the store (with the memory-mapped values), or None if missing or outdated"""
+        try:
+            with np.load(path + ".npz") as meta:
+                if not np.array_equal(meta['signature'], WoaGrids.signature(sources)):
+                    logger.info("outdated column store: %s" % path)
+                    return None
+                keys = meta['keys']
+                counts = meta['counts']
+                offsets = meta['offsets']
+                num_levels = int(meta['num_levels'])
+                nr_rows = int(meta['nr_rows'])
+            values = np.memmap(path + ".f32", dtype=np.float32, mode='r', shape=(nr_rows, len(cls.var_names)))
+
+        except (OSError, KeyError, ValueError) as e:
+            logger.debug("unable to load the column store %s: %s" % (path, e))
+            return None
+
+        logger.debug("loaded column store: %s" % path)
+        return cls(values=values, keys=keys, counts=counts, offsets=offsets, num_levels=num_levels)
+
+    def read_nodes(self, month_idx: int, season_idx: int, lat_idx: np.ndarray,
+                   lon_idx: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] | None:
+        """Read the merged t_an, s_an, t_sd and s_sd profiles at the passed nodes as (depth, node) arrays
+
+        None is returned if the (month, season) pair is not in the store."""
+        key = self.keys.get((month_idx, season_idx))
+        if key is None:
+            return None
+
+        counts = self.counts[:, lat_idx, lon_idx].astype(np.int64)
+        starts = self.offsets[lat_idx, lon_idx] + counts[:key].sum(axis=0)
+        ends = starts + counts[key]
+
+        nodes = np.full((self.num_levels, lat_idx.size, len(self.var_names)), np.nan)
+        for i in range(lat_idx.size):
+            nodes[:ends[i] - starts[i], i] = self.values[starts[i]:ends[i]]
+        return nodes[:, :, 0], nodes[:, :, 1], nodes[:, :, 2], nodes[:, :, 3]
+
+    @classmethod
+    def read_slab(cls, var, time_idx: int, lat_0: int, lat_1: int) -> np.ndarray:
+        """Read a band of latitudes of a (time, depth, lat, lon) variable as (depth, lat, lon), NaN if missing"""
+        return np.ma.filled(np.ma.asarray(var[time_idx, :, lat_0:lat_1, :], dtype=np.float32), np.nan)
+
+    @classmethod
+    def build(cls, path: str, sources: list[str], keys: list[tuple[int, int]], landsea: np.ndarray, num_levels: int,
+              read_slab: Callable[[str, int, bool, int, int], np.ndarray], band_size: int = 2 ** 19) -> bool:
+        """Build the store for the passed (month, season) pairs, one band of latitudes at a time
+
+        read_slab(var_name, time_idx, seasonal, lat_0, lat_1) returns the values of a monthly (or seasonal) variable
+        as by the read_slab class method."""
+        n_lat, n_lon = landsea.shape
+        nr_vars = len(cls.var_names)
+        counts = np.zeros((len(keys), n_lat, n_lon), dtype=np.int16)
+        offsets = np.zeros((n_lat, n_lon), dtype=np.int64)
+        nr_rows = 0
+        band = max(1, band_size // (num_levels * n_lon))
+
+        try:
+            with open(path + ".f32.tmp", "wb") as fod:
+                for lat_0 in range(0, n_lat, band):
+                    lat_1 = min(lat_0 + band, n_lat)
+                    logger.debug("building %s: %d/%d" % (path, lat_0, n_lat))
+
+                    # (lat, lon, key, depth, var) merged columns of the band
+                    slabs = dict()  # a seasonal slab is shared by three months
+                    columns = np.full((lat_1 - lat_0, n_lon, len(keys), num_levels, nr_vars), np.nan, dtype=np.float32)
+                    for k, (month_idx, season_idx) in enumerate(keys):
+                        for v, var_name in enumerate(cls.var_names):
+                            for slab_key in ((var_name, month_idx, False), (var_name, season_idx, True)):
+                                if slab_key not in slabs:
+                                    slabs[slab_key] = read_slab(*slab_key, lat_0, lat_1)
+                            merged = WoaSearch.merge(month=slabs[(var_name, month_idx, False)],
+                                                     season=slabs[(var_name, season_idx, True)])
+                            columns[:, :, k, :merged.shape[0], v] = np.moveaxis(merged, 0, -1)
+
+                    # trim each column after the last level with any value, and skip the land nodes
+                    has_values = ~np.all(np.isnan(columns), axis=-1)
+                    band_counts = np.where(np.any(has_values, axis=-1),
+                                           num_levels - np.argmax(has_values[..., ::-1], axis=-1), 0)
+                    band_counts[landsea[lat_0:lat_1] == 1] = 0
+                    counts[:, lat_0:lat_1] = np.moveaxis(band_counts, -1, 0)
+
+                    node_rows = band_counts.sum(axis=-1).ravel()
+                    offsets[lat_0:lat_1] = (nr_rows + np.cumsum(node_rows) - node_rows).reshape((lat_1 - lat_0, n_lon))
+                    rows = columns[np.arange(num_levels) < band_counts[..., np.newaxis]]
+                    rows.tofile(fod)
+                    nr_rows += rows.shape[0]
+
+            # the values first, since the metadata validate the store
+            os.replace(path + ".f32.tmp", path + ".f32")
+            with open(path + ".npz.tmp", "wb") as fod:
+                np.savez_compressed(fod, signature=WoaGrids.signature(sources), keys=np.array(keys, dtype=np.int64),
+                                    counts=counts, offsets=offsets, num_levels=num_levels, nr_rows=nr_rows)
+            os.replace(path + ".npz.tmp", path + ".npz")
+
+        except OSError as e:
+            logger.error("unable to store the column store %s: %s" % (path, e))
+            return False
+
+        logger.info("built column store: %s (%.1f MB)" % (path, nr_rows * nr_vars * 4 / (1024 * 1024)))
+        return True
@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from netCDF4 import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+class WoaDatasets:
+    """Lazy registry of the netCDF datasets of a WOA atlas, indexed as the list of the passed paths
+
+    A dataset is opened at the first access, and the least-recently-used ones are closed to keep at most
+    max_open datasets open at the same time."""
+
+    def __init__(self, paths: list[str], max_open: int = 6) -> None:
+        if max_open < 1:
+            raise RuntimeError("invalid max number of open datasets: %s" % max_open)
+        self.paths = list(paths)
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.RLock()
+
+    def missing(self) -> list[str]:
+        """Return the paths of the datasets that are not present"""
+        return [path for path in self.paths if not os.path.exists(path)]
+
+    def __getitem__(self, idx: int) -> Dataset:
+        with self._lock:
+            ds = self._open.get(idx)
+            if ds is not None:
+                self._open.move_to_end(idx)
+                return ds
+
+            ds = Dataset(self.paths[idx])
+            self._open[idx] = ds
+            logger.debug("opened: %s" % self.paths[idx])
+
+            while len(self._open) > self.max_open:
+                evicted_idx, evicted = self._open.popitem(last=False)
+                evicted.close()
+                logger.debug("closed: %s" % self.paths[evicted_idx])
+
+            return ds
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def preload(self, indices: list[int]) -> None:
+        """Open the datasets at the passed indices (the last index is the most recently used)"""
+        for idx in indices[-self.max_open:]:
+            self[idx]
+
+    def is_open(self, idx: int) -> bool:
+        with self._lock:
+            return idx in self._open
+
+    @property
+    def nr_open(self) -> int:
+        with self._lock:
+            return len(self._open)
+
+    def close(self) -> None:
+        with self._lock:
+            while self._open:
+                self._open.popitem(last=False)[1].close()
+
+    def __repr__(self) -> str:
+        msg = "<%s>\n" % self.__class__.__name__
+
+        msg += "  <datasets: %d>\n" % len(self)
+        msg += "  <open: %d/%d>\n" % (self.nr_open, self.max_open)
+
+        return msg
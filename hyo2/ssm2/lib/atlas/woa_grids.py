@@ -0,0 +1,60 @@
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class WoaGrids:
+    """Binary cache of a WOA land/sea mask and of the grid vectors, stored next to the mask file
+
+    The mask is saved as a memory-mappable .npy, the grid vectors (and the signature of the source files) as a .npz.
+    The cache is valid as long as the source files keep their modification time and size."""
+
+    @classmethod
+    def signature(cls, sources: list[str]) -> np.ndarray:
+        """The (modification time, size) of each source file"""
+        signature = list()
+        for source in sources:
+            st = os.stat(source)
+            signature.append((st.st_mtime_ns, st.st_size))
+        return np.array(signature, dtype=np.int64)
+
+    @classmethod
+    def load(cls, msk_path: str, sources: list[str]) -> dict | None:
+        """Return the cached grids (with the memory-mapped 'landsea' mask), or None if missing or outdated"""
+        try:
+            with np.load(msk_path + ".npz") as meta:
+                if not np.array_equal(meta['signature'], cls.signature(sources)):
+                    logger.debug("outdated grid cache: %s" % msk_path)
+                    return None
+                grids = {name: meta[name] for name in meta.files if name != 'signature'}
+            grids['landsea'] = np.load(msk_path + ".npy", mmap_mode='r')
+
+        except (OSError, KeyError, ValueError) as e:
+            logger.debug("unable to load the grid cache for %s: %s" % (msk_path, e))
+            return None
+
+        return grids
+
+    @classmethod
+    def save(cls, msk_path: str, sources: list[str], landsea: np.ndarray, **grids: np.ndarray) -> bool:
+        """Store the mask and the grid vectors, if the atlas folder is writable"""
+        try:
+            signature = cls.signature(sources)
+
+            # written to temporary files, then renamed (the mask first, since the .npz validates the cache)
+            with open(msk_path + ".npy.tmp", "wb") as fod:
+                np.save(fod, np.ascontiguousarray(landsea, dtype=np.float32))
+            os.replace(msk_path + ".npy.tmp", msk_path + ".npy")
+            with open(msk_path + ".npz.tmp", "wb") as fod:
+                np.savez(fod, signature=signature, **{name: np.asarray(value) for name, value in grids.items()})
+            os.replace(msk_path + ".npz.tmp", msk_path + ".npz")
+
+        except OSError as e:
+            logger.info("unable to store the grid cache for %s: %s" % (msk_path, e))
+            return False
+
+        logger.debug("stored grid cache: %s" % msk_path)
+        return True
@@ -0,0 +1,120 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class WoaSearch:
+    """Vectorized search of the closest valid WOA values around a position
+
+    The sea nodes of the search window are read with a single hyperslab read per variable, then the closest valid
+    value at each depth level is selected with a masked argmin along the node axis."""
+
+    @classmethod
+    def window_nodes(cls, landsea: np.ndarray, lat_base_idx: int, lon_base_idx: int,
+                     radius: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (lat, lon) indices of the sea nodes in the search window, sorted by latitude then longitude
+
+        The longitudes wrap around the antimeridian, the latitudes outside the grid are skipped."""
+        n_lat, n_lon = landsea.shape
+        lat_idx = np.arange(lat_base_idx - radius, lat_base_idx + radius + 1)
+        lat_idx = lat_idx[(lat_idx >= 0) & (lat_idx < n_lat)]
+        lon_idx = np.arange(lon_base_idx - radius, lon_base_idx + radius + 1) % n_lon
+
+        lat_idx, lon_idx = np.meshgrid(lat_idx, lon_idx, indexing='ij')
+        lat_idx = lat_idx.ravel()
+        lon_idx = lon_idx.ravel()
+        at_sea = landsea[lat_idx, lon_idx] != 1
+        return lat_idx[at_sea], lon_idx[at_sea]
+
+    @classmethod
+    def read_nodes(cls, var, time_idx: int, lat_idx: np.ndarray, lon_idx: np.ndarray) -> np.ndarray:
+        """Read a (time, depth, lat, lon) variable at the passed nodes as a (depth, node) array, NaN if missing"""
+        lat_0 = int(lat_idx.min())
+        lat_1 = int(lat_idx.max()) + 1
+
+        # one read for each contiguous run of longitudes (two, if the window crosses the antimeridian)
+        lons = np.unique(lon_idx)
+        runs = np.split(lons, np.flatnonzero(np.diff(lons) > 1) + 1)
+        slabs = [np.ma.filled(np.ma.asarray(var[time_idx, :, lat_0:lat_1, int(run[0]):int(run[-1]) + 1],
+                                            dtype=np.float64), np.nan) for run in runs]
+        slab = np.concatenate(slabs, axis=2) if len(slabs) > 1 else slabs[0]
+
+        return slab[:, lat_idx - lat_0, np.searchsorted(lons, lon_idx)]
+
+    @classmethod
+    def union_nodes(cls, windows: list[tuple[np.ndarray, np.ndarray]],
+                    n_lon: int) -> tuple[np.ndarray, np.ndarray, list[np.ndarray]]:
+        """Merge the (lat, lon) node indices of many search windows, to read them at once
+
+        Return the indices of the unique nodes, and for each window the positions of its nodes among them."""
+        keys = np.concatenate([lat_idx * n_lon + lon_idx for lat_idx, lon_idx in windows])
+        nodes, inverse = np.unique(keys, return_inverse=True)
+        splits = np.cumsum([lat_idx.size for lat_idx, _ in windows])[:-1]
+        return nodes // n_lon, nodes % n_lon, np.split(inverse.ravel(), splits)
+
+    @classmethod
+    def _closest(cls, dist: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """For each level, the index of the closest node with a valid value, and whether such a node exists"""
+        masked_dist = np.where(valid, dist[np.newaxis, :], np.inf)
+        node_idx = np.argmin(masked_dist, axis=1)
+        found = np.isfinite(masked_dist[np.arange(masked_dist.shape[0]), node_idx])
+        return node_idx, found
+
+    @classmethod
+    def merge(cls, month: np.ndarray, season: np.ndarray) -> np.ndarray:
+        """Overwrite the top of the seasonal profiles with the (shorter) monthly profiles, along the first axis"""
+        merged = season.copy()
+        merged[:month.shape[0]] = month
+        return merged
+
+    @classmethod
+    def closest_values(cls, dist: np.ndarray,
+                       t_month: np.ndarray, s_month: np.ndarray, t_sd_month: np.ndarray, s_sd_month: np.ndarray,
+                       t_season: np.ndarray, s_season: np.ndarray, t_sd_season: np.ndarray,
+                       s_sd_season: np.ndarray) -> dict:
+        """Select the closest valid temperature/salinity values (and min/max bounds) at each level
+
+        The passed (depth, node) arrays are as returned by read_nodes, with the distances of the nodes."""
+        return cls.closest_merged_values(dist=dist,
+                                         t=cls.merge(month=t_month, season=t_season),
+                                         s=cls.merge(month=s_month, season=s_season),
+                                         t_sd=cls.merge(month=t_sd_month, season=t_sd_season),
+                                         s_sd=cls.merge(month=s_sd_month, season=s_sd_season))
+
+    @classmethod
+    def closest_merged_values(cls, dist: np.ndarray, t: np.ndarray, s: np.ndarray, t_sd: np.ndarray,
+                              s_sd: np.ndarray) -> dict:
+        """Select the closest valid values at each level from the (depth, node) arrays of the merged profiles"""
+        levels = np.arange(t.shape[0])
+
+        with np.errstate(invalid='ignore'):
+            valid = (t < 50.0) & (s < 500.0) & (s >= 0)
+            valid_t_sd = (t_sd < 50.0) & (t_sd > -2)
+            valid_s_sd = (s_sd < 500.0) & (s_sd >= 0)
+
+        values = dict()
+
+        node_idx, found = cls._closest(dist=dist, valid=valid)
+        values['valid'] = found
+        values['t'] = np.where(found, t[levels, node_idx], 0.0)
+        values['s'] = np.where(found, s[levels, node_idx], 0.0)
+
+        # Now do the same thing for the temperature standard deviations
+        node_idx, found = cls._closest(dist=dist, valid=valid_t_sd)
+        values['valid_t_sd'] = found
+        t_nodes = t[levels, node_idx]
+        t_sd_nodes = t_sd[levels, node_idx]
+        values['t_min'] = np.where(found, np.maximum(t_nodes - t_sd_nodes, -2.0), 0.0)  # can't have overly cold water
+        values['t_max'] = np.where(found, t_nodes + t_sd_nodes, 0.0)
+
+        # Now do the same thing for the salinity standard deviations
+        node_idx, found = cls._closest(dist=dist, valid=valid_s_sd)
+        values['valid_s_sd'] = found
+        s_nodes = s[levels, node_idx]
+        s_sd_nodes = s_sd[levels, node_idx]
+        values['s_min'] = np.where(found, np.maximum(s_nodes - s_sd_nodes, 0.0), 0.0)  # can't have a negative salinity
+        values['s_max'] = np.where(found, s_nodes + s_sd_nodes, 0.0)
+
+        return values
@@ -5,6 +5,7 @@ import logging
 from typing import TYPE_CHECKING, Union
 
 from hyo2.ssm2.lib.profile.dicts import Dicts
+from hyo2.ssm2.lib.profile.profile import Profile
 from hyo2.ssm2.lib.formats.writers.asvp import Asvp
 from hyo2.ssm2.lib.formats.writers.calc import Calc
 
@@ -60,33 +61,38 @@ class Client:
         apply_12k = True
         if self.protocol in ["EA440", "PDS2000", "QINSY"]:
             apply_12k = False
-        tolerances = [0.01, 0.03, 0.06, 0.1, 0.5]
+        thin_tolerance = 0.01
         if self.protocol == "QINSY":
-            tolerances = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5]
+            thin_tolerance = 0.001
 
+        # a single thinning is usually enough: the samples are capped to what SIS accepts, and the cap is
+        # only lowered (proportionally to the exceeding size) if the resulting datagram is too large
+        thin_max_samples = Profile.MAX_SIS_SAMPLES
         tx_data = None
-        for tolerance in tolerances:
+        while thin_max_samples > 2:
 
-            if not prj.prepare_sis(apply_thin=apply_thin, apply_12k=apply_12k, thin_tolerance=tolerance):
+            if not prj.prepare_sis(apply_thin=apply_thin, apply_12k=apply_12k, thin_tolerance=thin_tolerance,
+                                   thin_max_samples=thin_max_samples):
                 logger.info("issue in preparing the data")
                 return False
 
             si = prj.cur.sis_thinned
             thin_profile_length = prj.cur.sis.flag[si].size
-            logger.debug("thin profile size: %d (with tolerance: %.3f)" % (thin_profile_length, tolerance))
-            if thin_profile_length >= 1000:
-                logger.info("too many samples, attempting with a lower tolerance")
-                continue
+            logger.debug("thin profile size: %d (with max samples: %d)" % (thin_profile_length, thin_max_samples))
 
             asvp = Asvp()
             tx_data = asvp.convert(prj.ssp, fmt=kng_fmt)
             # print(tx_data)
             tx_data_size = len(tx_data)
-            logger.debug("tx data size: %d (with tolerance: %.3f)" % (tx_data_size, tolerance))
+            logger.debug("tx data size: %d (with max samples: %d)" % (tx_data_size, thin_max_samples))
             if tx_data_size < self.UDP_DATA_LIMIT:
                 break
             tx_data = None
 
+            logger.info("too large data size, attempting with fewer samples")
+            thin_max_samples = min(int(thin_max_samples * 0.95 * self.UDP_DATA_LIMIT / tx_data_size),
+                                   thin_max_samples - 1)
+
         if tx_data is None:
             logger.info("issue in thinning the data")
             return False
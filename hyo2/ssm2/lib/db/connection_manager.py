@@ -0,0 +1,131 @@
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """Per-thread connections to the project databases, kept open across the ProjectDb instances
+
+    Each thread gets its own read-write (and, on request, read-only) connection to a project db, so that the GUI and
+    the server thread can work on the same project concurrently (the databases use WAL journaling).
+    A connection is reopened when the db file is removed or replaced (e.g., by renaming or removing a project), or
+    after a close request. A connection is only closed by its own thread (or once its thread has ended)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (db path, thread id, read-only flag) -> (connection, db file id)
+        self._conns = dict()
+        # (db path, db file id) of the databases with already built (and upgraded) tables
+        self._built = set()
+        # keys of the connections to be closed by their own threads, at the next connect
+        self._stale = set()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_all)
+
+    def _forget_all(self) -> None:
+        """Drop (without closing) the connections inherited by a forked process, since they cannot be used there"""
+        self._lock = threading.Lock()
+        self._conns = dict()
+        self._built = set()
+        self._stale = set()
+
+    @classmethod
+    def _file_id(cls, db_path: str) -> tuple[int, int] | None:
+        try:
+            st = os.stat(db_path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def connect(self, db_path: str, read_only: bool = False) -> tuple[sqlite3.Connection, bool]:
+        """Return the connection to the db for the calling thread, and whether it has just been opened"""
+        db_path = os.path.abspath(db_path)
+        key = (db_path, threading.get_ident(), read_only)
+
+        with self._lock:
+            self._prune_dead_threads()
+
+            entry = self._conns.get(key)
+            if (entry is not None) and (key not in self._stale):
+                file_id = self._file_id(db_path)
+                if entry[1] is None:  # the db file is created by sqlite at the first write
+                    self._conns[key] = (entry[0], file_id)
+                    return entry[0], False
+                if entry[1] == file_id:
+                    return entry[0], False
+                logger.debug("db file changed: %s" % db_path)
+            if entry is not None:
+                self._close_key_no_lock(key)
+
+            if read_only:
+                conn = sqlite3.connect("%s?mode=ro" % pathlib.Path(db_path).as_uri(), uri=True,
+                                       detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                                       check_same_thread=False)
+            else:
+                conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                                       check_same_thread=False)
+            self._conns[key] = (conn, self._file_id(db_path))
+            return conn, True
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Discard any uncommitted change, as closing the connection would do"""
+        if conn.in_transaction:
+            conn.rollback()
+
+    def is_built(self, db_path: str) -> bool:
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            return (db_path, self._file_id(db_path)) in self._built
+
+    def set_built(self, db_path: str) -> None:
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            self._built.add((db_path, self._file_id(db_path)))
+
+    def close(self, db_path: str | None = None) -> None:
+        """Close the connections of the calling thread to a db (or to all the dbs, if no path is passed)
+
+        The connections of the other threads are closed by their own threads, at their next connect."""
+        if db_path is not None:
+            db_path = os.path.abspath(db_path)
+        thread_id = threading.get_ident()
+        with self._lock:
+            # the read-only connections first, so that the last read-write one can checkpoint and remove the WAL file
+            keys = [key for key in self._conns if (db_path is None) or (key[0] == db_path)]
+            for key in sorted(keys, key=lambda k: not k[2]):
+                if key[1] == thread_id:
+                    self._close_key_no_lock(key)
+                else:
+                    self._stale.add(key)
+            self._built = {built for built in self._built if (db_path is not None) and (built[0] != db_path)}
+
+    def _close_key_no_lock(self, key: tuple[str, int, bool]) -> None:
+        self._stale.discard(key)
+        try:
+            self._conns.pop(key)[0].close()
+        except sqlite3.Error as e:
+            logger.warning("unable to close connection to %s, %s: %s" % (key[0], type(e), e))
+
+    def _prune_dead_threads(self) -> None:
+        alive = {thread.ident for thread in threading.enumerate()}
+        for key in [key for key in self._conns if key[1] not in alive]:
+            self._close_key_no_lock(key)
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def __repr__(self) -> str:
+        msg = "<%s>\n" % self.__class__.__name__
+
+        msg += "  <connections: %d>\n" % len(self)
+        msg += "  <databases: %d>\n" % len({key[0] for key in self._conns})
+
+        return msg
+
+
+connection_manager = ConnectionManager()
@@ -1,16 +1,25 @@
 import datetime
+import itertools
 import logging
+import math
 import os
+import pathlib
 import sqlite3
+import zlib
 
+import numpy as np
 from numpy import float32
 
 # noinspection PyUnresolvedReferences
 from hyo2.ssm2 import pkg_info
 # noinspection PyUnresolvedReferences
+from hyo2.ssm2.lib.base.geodesy import Geodesy
+from hyo2.ssm2.lib.db.connection_manager import connection_manager
+# noinspection PyUnresolvedReferences
 from hyo2.ssm2.lib.db.export import ExportDb
 # noinspection PyUnresolvedReferences
 from hyo2.ssm2.lib.db.plot import PlotDb
+from hyo2.ssm2.lib.db.profile_cache import profile_cache
 # noinspection PyUnresolvedReferences
 from hyo2.ssm2.lib.db.point import Point, convert_point, adapt_point
 # noinspection PyUnresolvedReferences
@@ -24,6 +33,21 @@ logger = logging.getLogger(__name__)
 class ProjectDb:
     """Class that provides an interface to a SQLite db with Sound Speed data"""
 
+    # db column -> Samples attribute (the same order of the per-sample tables)
+    sample_columns = (
+        ('pressure', 'pressure'),
+        ('depth', 'depth'),
+        ('speed', 'speed'),
+        ('temperature', 'temp'),
+        ('conductivity', 'conductivity'),
+        ('salinity', 'sal'),
+        ('source', 'source'),
+        ('flag', 'flag'),
+    )
+    sample_stages = ('data', 'proc', 'sis')
+    # keep the connections open (one per thread) through the connection manager
+    keep_connections = True
+
     def __init__(self, projects_folder: str | None = None, project_name: str | None = None,
                  info_loc: bool = True) -> None:
 
@@ -50,8 +74,15 @@ class ProjectDb:
 
         self.tmp_data = None
         self.tmp_ssp_pk = None
+        # store the samples of each profile stage as compressed columns (otherwise, one row per sample):
+        # set on connection only for the dbs explicitly converted by 'convert_to_columnar_samples'
+        self.columnar_samples = False
+        # insert the samples of a cast with a single statement (per-row insert only if a sample is rejected)
+        self.bulk_insert = True
+        # keep the decoded profiles in memory (as copies), for the next retrievals
+        self.use_profile_cache = True
 
-        self.cur_version = 3
+        self.cur_version = 6
 
         self.reconnect_or_create()
 
@@ -73,9 +104,13 @@ class ProjectDb:
             if not os.path.exists(os.path.dirname(self.db_path)):
                 os.makedirs(os.path.dirname(self.db_path))
 
+        is_new = True
         try:
-            self.conn = sqlite3.connect(self.db_path,
-                                        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+            if self.keep_connections:
+                self.conn, is_new = connection_manager.connect(self.db_path)
+            else:
+                self.conn = sqlite3.connect(self.db_path,
+                                            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
             # logger.info("Connected")
 
         except sqlite3.Error as e:
@@ -84,12 +119,66 @@ class ProjectDb:
         if self.conn is None:
             raise RuntimeError("conn is None")
 
+        if is_new:
+            self._setup_connection()
+
+        if self.keep_connections and connection_manager.is_built(self.db_path):
+            self.columnar_samples = self._has_columnar_samples()
+            return
+
+        # the db file may have been replaced
+        profile_cache.invalidate(db_path=self.db_path)
+
+        built = self._build_tables_no_commit()
+        if not isinstance(built, bool):
+            raise RuntimeError("invalid return from 'build_tables' method, must be boolean")
+        if not built:
+            raise RuntimeError("Unable to build tables: the DB is encrypted or is not a database")
+
+        self.conn.commit()
+        self.columnar_samples = self._has_columnar_samples()
+
+        if self.keep_connections:
+            connection_manager.set_built(self.db_path)
+
+    @staticmethod
+    def copy_db_file(db_path: str, copy_path: str) -> None:
+        """Copy a db file (with its pending WAL content) without modifying it, through a read-only connection"""
+        try:
+            src_conn = sqlite3.connect("%s?mode=ro" % pathlib.Path(os.path.abspath(db_path)).as_uri(), uri=True)
+            try:
+                dst_conn = sqlite3.connect(copy_path)
+                try:
+                    src_conn.backup(dst_conn)
+                finally:
+                    dst_conn.close()
+            finally:
+                src_conn.close()
+
+        except sqlite3.Error as e:
+            raise RuntimeError("Unable to copy %s: %s" % (db_path, e))
+
+    def _has_columnar_samples(self) -> bool:
+        """Check whether the db has been converted to the compressed columns layout"""
+        # noinspection SqlResolve
+        return bool(self.conn.execute("SELECT EXISTS (SELECT 1 FROM samples)").fetchone()[0])
+
+    def _setup_connection(self) -> None:
         try:
             self.conn.execute('PRAGMA foreign_keys=ON')
 
         except sqlite3.Error as e:
             raise RuntimeError("Unable to activate foreign keys: %s" % e)
 
+        try:
+            # concurrent readers and writer (e.g., GUI and server thread), if supported by the file system
+            journal_mode = self.conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if journal_mode != 'wal':
+                logger.debug("WAL journaling not available: %s" % journal_mode)
+
+        except sqlite3.Error as e:
+            logger.debug("Unable to activate WAL journaling: %s" % e)
+
         try:
             # Set the row factory
             self.conn.row_factory = sqlite3.Row
@@ -108,13 +197,22 @@ class ProjectDb:
         except sqlite3.Error as e:
             raise RuntimeError("Unable to register numpy float adapter: %s - %s" % (type(e), e))
 
-        built = self._build_tables_no_commit()
-        if not isinstance(built, bool):
-            raise RuntimeError("invalid return from 'build_tables' method, must be boolean")
-        if not built:
-            raise RuntimeError("Unable to build tables: the DB is encrypted or is not a database")
+    def read_only_cursor(self) -> sqlite3.Cursor:
+        """Return a cursor on a read-only connection to the project db, owned by the calling thread"""
+        return self._read_only_connection().cursor()
 
-        self.conn.commit()
+    def _read_only_connection(self) -> sqlite3.Connection:
+        conn, is_new = connection_manager.connect(self.db_path, read_only=True)
+        if is_new:
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Return the connection for the queries: the read-only one, so that the readers (e.g., the server thread)
+        do not share the writing connection, unless there are uncommitted changes to be seen (e.g., during upgrades)"""
+        if (not self.keep_connections) or self.conn.in_transaction:
+            return self.conn
+        return self._read_only_connection()
 
     def disconnect(self) -> bool:
         """ Disconnect from the current database """
@@ -123,7 +221,11 @@ class ProjectDb:
             return True
 
         try:
-            self.conn.close()
+            if self.keep_connections:
+                # the connection is kept open for the next ProjectDb instances
+                connection_manager.release(self.conn)
+            else:
+                self.conn.close()
             # logger.info("Disconnected")
             return True
 
@@ -166,9 +268,10 @@ class ProjectDb:
             # noinspection SqlResolve
             ret = self.conn.execute("""SELECT version
                                        FROM library""").fetchone()
-            if ret[0] < 3:
-                logger.debug("updated old library version from %s to %s" % (ret[0], self.cur_version))
-                self._updates_to_version_3_no_commit(old_version=ret[0])
+            old_version = ret[0]
+            if old_version < 3:
+                logger.debug("updated old library version from %s to %s" % (old_version, self.cur_version))
+                self._updates_to_version_3_no_commit(old_version=old_version)
 
             self.conn.execute("""
                               CREATE TABLE IF NOT EXISTS ssp_pk
@@ -439,6 +542,46 @@ class ProjectDb:
                               ))
                               """)
 
+            self._create_samples_table_no_commit()
+
+            self._create_profile_stats_table_no_commit()
+
+            # numeric position and time of the casts, with indexes for the temporal and spatial queries
+            # (a separate table, since the older versions insert into 'ssp_pk' by position)
+            # noinspection SqlResolve
+            self.conn.execute("""
+                              CREATE TABLE IF NOT EXISTS ssp_index(
+                                 ssp_pk integer PRIMARY KEY NOT NULL,
+                                 latitude real NOT NULL,
+                                 longitude real NOT NULL,
+                                 cast_epoch real NOT NULL,
+                                 FOREIGN KEY (ssp_pk) REFERENCES ssp_pk (id) ON DELETE CASCADE)
+                              """)
+            # noinspection SqlResolve
+            self.conn.execute("""CREATE INDEX IF NOT EXISTS ssp_index_cast_epoch ON ssp_index (cast_epoch)""")
+            # noinspection SqlResolve
+            self.conn.execute("""CREATE INDEX IF NOT EXISTS ssp_index_position ON ssp_index (latitude, longitude)""")
+
+            if old_version < 4:
+                logger.debug("updated old library version from %s to %s" % (old_version, self.cur_version))
+                self._updates_to_version_4_no_commit(old_version=old_version)
+
+            # the older versions only know the per-sample tables, and delete the 'ssp' rows after them
+            self._cascade_ssp_deletes_no_commit(table='samples', create_table=self._create_samples_table_no_commit)
+
+            if old_version < 5:
+                logger.debug("updated old library version from %s to %s" % (old_version, self.cur_version))
+                self._updates_to_version_5_no_commit(old_version=old_version)
+            self._cascade_ssp_deletes_no_commit(table='profile_stats',
+                                                create_table=self._create_profile_stats_table_no_commit)
+
+            if old_version < 6:
+                logger.debug("updated old library version from %s to %s" % (old_version, self.cur_version))
+                self._updates_to_version_6_no_commit(old_version=old_version)
+
+            # the casts added by the older versions (that do not know about the index table) are indexed on opening
+            self._index_casts_no_commit()
+
             # noinspection SqlResolve
             self.conn.execute("""
                               CREATE VIEW IF NOT EXISTS ssp_view AS
@@ -472,12 +615,72 @@ class ProjectDb:
             logger.error("during building tables, %s: %s" % (type(e), e))
             return False
 
+    def _create_samples_table_no_commit(self, table: str = 'samples') -> None:
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          CREATE TABLE IF NOT EXISTS %s(
+                             ssp_pk integer NOT NULL,
+                             stage text NOT NULL,
+                             num_samples int NOT NULL,
+                             pressure blob NOT NULL,
+                             depth blob NOT NULL,
+                             speed blob NOT NULL,
+                             temperature blob NOT NULL,
+                             conductivity blob NOT NULL,
+                             salinity blob NOT NULL,
+                             source blob NOT NULL,
+                             flag blob NOT NULL,
+                             PRIMARY KEY (ssp_pk, stage),
+                             FOREIGN KEY (ssp_pk) REFERENCES ssp (pk) ON DELETE CASCADE)
+                          """ % table)
+
+    def _create_profile_stats_table_no_commit(self, table: str = 'profile_stats') -> None:
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          CREATE TABLE IF NOT EXISTS %s(
+                             ssp_pk integer PRIMARY KEY NOT NULL,
+                             ss_at_min_depth real,
+                             min_depth real,
+                             mean_ss real,
+                             max_depth real,
+                             max_raw_depth real,
+                             FOREIGN KEY (ssp_pk) REFERENCES ssp (pk) ON DELETE CASCADE)
+                          """ % table)
+
+    def _cascade_ssp_deletes_no_commit(self, table: str, create_table) -> None:
+        """Rebuild a table referencing 'ssp' so that its rows are deleted with the profile
+
+        The tables created without 'ON DELETE CASCADE' would block the deletion of the profiles by the older
+        versions of the library, which do not know about them."""
+        # noinspection SqlResolve
+        sql = self.conn.execute("""SELECT sql
+                                   FROM sqlite_master
+                                   WHERE type = 'table' AND name = ?""", (table,)).fetchone()[0]
+        if "ON DELETE CASCADE" in sql.upper():
+            return
+
+        tmp_table = "%s_cascade" % table
+        columns = ", ".join(row[1] for row in self.conn.execute("""PRAGMA table_info(%s)""" % table))
+        # noinspection SqlResolve
+        self.conn.execute("""DROP TABLE IF EXISTS %s""" % tmp_table)
+        create_table(table=tmp_table)
+        # noinspection SqlResolve
+        self.conn.execute("""INSERT INTO %s (%s)
+                             SELECT %s
+                             FROM %s""" % (tmp_table, columns, columns, table))
+        # noinspection SqlResolve
+        self.conn.execute("""DROP TABLE %s""" % table)
+        # noinspection SqlResolve
+        self.conn.execute("""ALTER TABLE %s RENAME TO %s""" % (tmp_table, table))
+        logger.debug("rebuilt '%s' with cascade deletions" % table)
+
     def remove_casts(self, ssp: ProfileList) -> bool:
 
         if not self.conn:
             logger.error("missing db connection")
             return False
 
+        pks = list()
         try:
             for i, self.tmp_data in enumerate(ssp.l):
 
@@ -485,6 +688,7 @@ class ProjectDb:
 
                 if not self._get_ssp_pk():
                     raise sqlite3.Error("unable to get ssp pk: %s" % self.tmp_ssp_pk)
+                pks.append(self.tmp_ssp_pk)
 
                 if not self._delete_old_ssp_no_commit():
                     raise sqlite3.Error("unable to clean ssp")
@@ -500,12 +704,18 @@ class ProjectDb:
             logger.error("during removing casts, %s: %s" % (type(e), e))
             return False
 
+        finally:
+            # a profile may have been cached by another thread before the commit
+            for pk in pks:
+                profile_cache.invalidate(db_path=self.db_path, pk=pk)
+
     def add_casts(self, ssp: ProfileList) -> bool:
 
         if not self.conn:
             logger.error("missing db connection")
             return False
 
+        pks = list()
         try:
             for i, self.tmp_data in enumerate(ssp.l):
 
@@ -513,6 +723,7 @@ class ProjectDb:
 
                 if not self._get_ssp_pk():
                     raise sqlite3.Error("unable to get ssp pk: %s" % self.tmp_ssp_pk)
+                pks.append(self.tmp_ssp_pk)
 
                 if not self._delete_old_ssp_no_commit():
                     raise sqlite3.Error("unable to clean ssp")
@@ -520,6 +731,9 @@ class ProjectDb:
                 if not self._add_ssp_no_commit():
                     raise sqlite3.Error("unable to add ssp")
 
+                if not self._add_index_no_commit():
+                    raise sqlite3.Error("unable to add ssp index")
+
                 if not self._add_data_no_commit():
                     raise sqlite3.Error("unable to add ssp raw data samples")
 
@@ -530,6 +744,9 @@ class ProjectDb:
                     if not self._add_sis_no_commit():
                         raise sqlite3.Error("unable to add ssp sis data samples")
 
+                if not self._add_stats_no_commit():
+                    raise sqlite3.Error("unable to add ssp statistics")
+
                 logger.debug("Added profile #%s" % self.tmp_ssp_pk)
 
             # commit all the casts
@@ -541,6 +758,11 @@ class ProjectDb:
             logger.error("during adding casts, %s: %s" % (type(e), e))
             return False
 
+        finally:
+            # a profile may have been cached by another thread before the commit
+            for pk in pks:
+                profile_cache.invalidate(db_path=self.db_path, pk=pk)
+
     def get_db_version(self) -> int | None:
         """Get the project db version"""
         if not self.conn:
@@ -612,6 +834,8 @@ class ProjectDb:
         if self.conn is None:
             raise RuntimeError("missing db connection")
 
+        profile_cache.invalidate(db_path=self.db_path, pk=self.tmp_ssp_pk)
+
         try:
             # noinspection SqlResolve
             self.conn.execute("""DELETE
@@ -645,6 +869,28 @@ class ProjectDb:
             logger.error("during deletion from sis, %s: %s" % (type(e), e))
             return False
 
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""DELETE
+                                 FROM profile_stats
+                                 WHERE ssp_pk = ?""", (self.tmp_ssp_pk,))
+            # logger.info("deleted %s pk entry from profile_stats" % self.tmp_ssp_pk)
+
+        except sqlite3.Error as e:
+            logger.error("during deletion from profile_stats, %s: %s" % (type(e), e))
+            return False
+
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""DELETE
+                                 FROM samples
+                                 WHERE ssp_pk = ?""", (self.tmp_ssp_pk,))
+            # logger.info("deleted %s pk entries from samples" % self.tmp_ssp_pk)
+
+        except sqlite3.Error as e:
+            logger.error("during deletion from samples, %s: %s" % (type(e), e))
+            return False
+
         try:
             # noinspection SqlResolve
             self.conn.execute("""DELETE
@@ -672,6 +918,42 @@ class ProjectDb:
 
         return True
 
+    def _add_index_no_commit(self) -> bool:
+
+        if self.conn is None:
+            raise RuntimeError("missing db connection")
+
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""
+                              INSERT OR REPLACE INTO ssp_index
+                              VALUES (?, ?, ?, ?)
+                              """, (self.tmp_ssp_pk, self.tmp_data.meta.latitude, self.tmp_data.meta.longitude,
+                                    self._epoch(self.tmp_data.meta.utc_time)))
+            # logger.info("insert new %s pk in ssp_index" % self.tmp_ssp_pk)
+
+        except sqlite3.Error as e:
+            logger.error("during ssp index addition, %s: %s" % (type(e), e))
+            return False
+
+        return True
+
+    def _index_casts_no_commit(self) -> None:
+        """Add to the index table the casts that are missing (e.g., added by the older versions)"""
+        # noinspection SqlResolve
+        rows = self.conn.execute("""SELECT id, cast_datetime, cast_position
+                                    FROM ssp_pk
+                                    WHERE id NOT IN (SELECT ssp_pk FROM ssp_index)""").fetchall()
+        if len(rows) == 0:
+            return
+
+        # noinspection SqlResolve
+        self.conn.executemany("""INSERT INTO ssp_index
+                                 VALUES (?, ?, ?, ?)""",
+                              [(row['id'], row['cast_position'].y, row['cast_position'].x,
+                                self._epoch(row['cast_datetime'])) for row in rows])
+        logger.debug("indexed %d casts" % len(rows))
+
     def _add_ssp_no_commit(self) -> bool:
 
         if self.conn is None:
@@ -713,113 +995,160 @@ class ProjectDb:
         return True
 
     def _add_data_no_commit(self) -> bool:
+        return self._add_samples_no_commit(table="data", samples=self.tmp_data.data, label="raw")
+
+    def _add_proc_no_commit(self) -> bool:
+        return self._add_samples_no_commit(table="proc", samples=self.tmp_data.proc, label="processed")
+
+    def _add_sis_no_commit(self) -> bool:
+        return self._add_samples_no_commit(table="sis", samples=self.tmp_data.sis, label="sis")
+
+    @classmethod
+    def _profile_stats(cls, profile) -> tuple | None:
+        """Surface sound speed, min depth, mean sound speed, max depth and max raw depth of a profile"""
+        try:
+            return (float(profile.proc_speed_at_min_depth),
+                    float(profile.proc_depth_min),
+                    float(profile.proc_speed_mean),
+                    float(profile.proc_depth_max),
+                    float(profile.data_depth_max))
+
+        except Exception as e:
+            logger.info("unable to calculate the statistics: %s" % e)
+            return None
+
+    def _add_stats_no_commit(self, profile=None) -> bool:
 
         if self.conn is None:
             raise RuntimeError("missing db connection")
 
-        sz = self.tmp_data.data.num_samples
-        # logger.info("num samples to add: %s" % sz)
+        if profile is None:
+            profile = self.tmp_data
 
-        added_samples = 0
-        for i in range(sz):
+        # the statistics are left empty for profiles where they cannot be calculated
+        stats = self._profile_stats(profile)
+        if stats is None:
+            stats = (None, ) * 5
 
-            try:
-                # first check if the sample is already present with exactly the same values
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  INSERT INTO data
-                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """, (self.tmp_ssp_pk,
-                                        self.tmp_data.data.pressure[i],
-                                        self.tmp_data.data.depth[i],
-                                        self.tmp_data.data.speed[i],
-                                        self.tmp_data.data.temp[i],
-                                        self.tmp_data.data.conductivity[i],
-                                        self.tmp_data.data.sal[i],
-                                        self.tmp_data.data.source[i],
-                                        self.tmp_data.data.flag[i],
-                                        ))
+        try:
+            # noinspection SqlResolve
+            self.conn.execute("""
+                              INSERT OR REPLACE INTO profile_stats
+                              VALUES (?, ?, ?, ?, ?, ?)
+                              """, (self.tmp_ssp_pk, ) + stats)
 
-                added_samples += 1
-            except sqlite3.IntegrityError as e:
-                logger.info("skipping row #%s due to %s: %s" % (i, type(e), e))
-                continue
-            except sqlite3.Error as e:
-                print(self.tmp_data.data.depth[i], type(self.tmp_data.data.depth[i]))
-                # traceback.print_stack()
-                logger.error("during adding ssp raw samples, %s: %s" % (type(e), e))
-                return False
+        except sqlite3.Error as e:
+            logger.error("during adding ssp statistics, %s: %s" % (type(e), e))
+            return False
 
-        # logger.info("added %s raw samples" % added_samples)
         return True
 
-    def _add_proc_no_commit(self) -> bool:
+    @classmethod
+    def _pack_column(cls, values: np.ndarray) -> bytes:
+        return zlib.compress(np.ascontiguousarray(values, dtype='<f8').tobytes())
+
+    @classmethod
+    def _unpack_column(cls, blob: bytes, num_samples: int) -> np.ndarray:
+        # read-only view on the decompressed bytes: the callers editing the values have to copy them
+        values = np.frombuffer(zlib.decompress(blob), dtype='<f8')
+        if values.size != num_samples:
+            raise sqlite3.DataError("invalid number of samples: %d (expected: %d)" % (values.size, num_samples))
+        return values
+
+    def _add_columnar_samples_no_commit(self, stage: str, samples, sz: int) -> None:
+        """Add the samples of a profile stage as a single row of compressed columns"""
+        columns = [getattr(samples, attribute)[:sz] for _, attribute in self.sample_columns]
+
+        # as for the per-sample tables, the samples without depth, source or flag are not stored
+        valid = ~(np.isnan(samples.depth[:sz]) | np.isnan(samples.source[:sz]) | np.isnan(samples.flag[:sz]))
+        if not np.all(valid):
+            logger.info("skipping %d invalid %s samples" % (np.count_nonzero(~valid), stage))
+            columns = [column[valid] for column in columns]
+
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          INSERT OR REPLACE INTO samples
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                          """, [self.tmp_ssp_pk, stage, int(np.count_nonzero(valid))] +
+                          [self._pack_column(column) for column in columns])
+
+    def _read_samples(self, conn: sqlite3.Connection, pk: int, stage: str) -> dict:
+        """Read the samples of a profile stage as arrays, from the compressed columns or from the per-sample table"""
+        # noinspection SqlResolve
+        row = conn.execute("SELECT * FROM samples WHERE ssp_pk=? AND stage=?", (pk, stage)).fetchone()
+        if row is not None:
+            return {attribute: self._unpack_column(row[column], row['num_samples'])
+                    for column, attribute in self.sample_columns}
+
+        # noinspection SqlResolve
+        rows = conn.execute("SELECT * FROM %s WHERE ssp_pk=?" % stage, (pk,)).fetchall()
+        return {attribute: np.array([r[column] for r in rows], dtype=np.float64).reshape(-1)
+                for column, attribute in self.sample_columns}
+
+    def _sample_rows(self, samples, sz: int):
+        """Generate the rows to be inserted for the passed samples (as Python values)"""
+        return zip([self.tmp_ssp_pk] * sz,
+                   samples.pressure[:sz].tolist(),
+                   samples.depth[:sz].tolist(),
+                   samples.speed[:sz].tolist(),
+                   samples.temp[:sz].tolist(),
+                   samples.conductivity[:sz].tolist(),
+                   samples.sal[:sz].tolist(),
+                   samples.source[:sz].tolist(),
+                   samples.flag[:sz].tolist())
+
+    def _add_samples_no_commit(self, table: str, samples, label: str) -> bool:
+        """Add the samples in a single bulk insert, falling back to a per-row insert on integrity errors"""
 
         if self.conn is None:
             raise RuntimeError("missing db connection")
 
-        sz = self.tmp_data.proc.num_samples
-        # logger.info("max processed samples to add: %s" % sz)
-
-        added_samples = 0
-        for i in range(sz):
+        sz = samples.num_samples
+        # logger.info("num %s samples to add: %s" % (label, sz))
+        if sz == 0:  # the sample arrays may be not initialized
+            return True
 
+        if self.columnar_samples:
             try:
-                # first check if the sample is already present with exactly the same values
-                # noinspection SqlResolve
-                self.conn.execute("""
-                                  INSERT INTO proc
-                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """, (self.tmp_ssp_pk,
-                                        self.tmp_data.proc.pressure[i],
-                                        self.tmp_data.proc.depth[i],
-                                        self.tmp_data.proc.speed[i],
-                                        self.tmp_data.proc.temp[i],
-                                        self.tmp_data.proc.conductivity[i],
-                                        self.tmp_data.proc.sal[i],
-                                        self.tmp_data.proc.source[i],
-                                        self.tmp_data.proc.flag[i],
-                                        ))
+                self._add_columnar_samples_no_commit(stage=table, samples=samples, sz=sz)
+                return True
 
-                added_samples += 1
-
-            except sqlite3.IntegrityError as e:
-                logger.info("skipping row #%s due to %s: %s" % (i, type(e), e))
-                continue
             except sqlite3.Error as e:
-                logger.error("during adding ssp processed samples, %s: %s" % (type(e), e))
+                logger.error("during adding ssp %s samples, %s: %s" % (label, type(e), e))
                 return False
 
-        # logger.info("added %s processed samples" % added_samples)
-        return True
-
-    def _add_sis_no_commit(self) -> bool:
-
-        if self.conn is None:
-            raise RuntimeError("missing db connection")
+        if self.bulk_insert:
+            try:
+                self.conn.execute("SAVEPOINT add_samples")
+                try:
+                    # noinspection SqlResolve
+                    self.conn.executemany("""
+                                          INSERT INTO %s
+                                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                          """ % table, self._sample_rows(samples=samples, sz=sz))
+                    self.conn.execute("RELEASE SAVEPOINT add_samples")
+                    # logger.info("added %s %s samples" % (sz, label))
+                    return True
+
+                except sqlite3.IntegrityError as e:
+                    logger.info("bulk insert of %s samples failed due to %s: %s -> per-row insert"
+                                % (label, type(e), e))
+                    self.conn.execute("ROLLBACK TO SAVEPOINT add_samples")
+                    self.conn.execute("RELEASE SAVEPOINT add_samples")
 
-        sz = self.tmp_data.sis.num_samples
-        # logger.info("max sis samples to add: %s" % sz)
+            except sqlite3.Error as e:
+                logger.error("during adding ssp %s samples, %s: %s" % (label, type(e), e))
+                return False
 
         added_samples = 0
-        for i in range(sz):
+        for i, row in enumerate(self._sample_rows(samples=samples, sz=sz)):
 
             try:
-                # first check if the sample is already present with exactly the same values
                 # noinspection SqlResolve
                 self.conn.execute("""
-                                  INSERT INTO sis
+                                  INSERT INTO %s
                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """, (self.tmp_ssp_pk,
-                                        self.tmp_data.sis.pressure[i],
-                                        self.tmp_data.sis.depth[i],
-                                        self.tmp_data.sis.speed[i],
-                                        self.tmp_data.sis.temp[i],
-                                        self.tmp_data.sis.conductivity[i],
-                                        self.tmp_data.sis.sal[i],
-                                        self.tmp_data.sis.source[i],
-                                        self.tmp_data.sis.flag[i],
-                                        ))
+                                  """ % table, row)
 
                 added_samples += 1
 
@@ -828,10 +1157,10 @@ class ProjectDb:
                 continue
 
             except sqlite3.Error as e:
-                logger.error("during adding ssp sis samples, %s: %s" % (type(e), e))
+                logger.error("during adding ssp %s samples, %s: %s" % (label, type(e), e))
                 return False
 
-        # logger.info("added %s sis samples" % added_samples)
+        # logger.info("added %s %s samples" % (added_samples, label))
         return True
 
     def timestamp_list(self) -> list[datetime.datetime | int] | None:
@@ -840,15 +1169,18 @@ class ProjectDb:
         if not self.conn:
             logger.error("missing db connection")
             return None
+        conn = self._reader()
 
         try:
             # ssp spatial timestamp
             # noinspection SqlResolve
-            ts_list = self.conn.execute("""
-                                        SELECT cast_datetime, pk
-                                        FROM ssp_view
-                                        ORDER BY cast_datetime
-                                        """).fetchall()
+            ts_list = conn.execute("""
+                                   SELECT c.cast_datetime, a.ssp_pk AS pk
+                                   FROM ssp_index a
+                                            JOIN ssp b ON a.ssp_pk = b.pk
+                                            JOIN ssp_pk c ON a.ssp_pk = c.id
+                                   ORDER BY a.cast_epoch
+                                   """).fetchall()
             # logger.info("retrieved %s timestamps from ssp view" % len(ts_list))
             return ts_list
 
@@ -856,12 +1188,48 @@ class ProjectDb:
             logger.error("retrieving the time stamp list, %s: %s" % (type(e), e))
             return None
 
+    def profile_keys_between(self, start: datetime.datetime | None = None,
+                             end: datetime.datetime | None = None) -> list[int] | None:
+        """Return the pks of the profiles cast in the [start, end] time range, sorted by time
+
+        Naive datetimes are assumed in UTC."""
+
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
+        conn = self._reader()
+
+        conditions = ["1"]
+        params = list()
+        if start is not None:
+            conditions.append("a.cast_epoch >= ?")
+            params.append(self._epoch(start))
+        if end is not None:
+            conditions.append("a.cast_epoch <= ?")
+            params.append(self._epoch(end))
+
+        try:
+            # noinspection SqlResolve
+            rows = conn.execute("""
+                                SELECT a.ssp_pk
+                                FROM ssp_index a
+                                         JOIN ssp b ON a.ssp_pk = b.pk
+                                WHERE %s
+                                ORDER BY a.cast_epoch
+                                """ % " AND ".join(conditions), params).fetchall()
+            return [row[0] for row in rows]
+
+        except sqlite3.Error as e:
+            logger.error("retrieving the profile keys, %s: %s" % (type(e), e))
+            return None
+
     def previous_profile_key(self, dt: datetime.datetime = None,
                          max_age: datetime.timedelta = datetime.timedelta(hours=12)) -> int | None:
 
         if not self.conn:
             logger.error("missing db connection")
             return None
+        conn = self._reader()
 
         if dt is None:
             dt = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -869,13 +1237,15 @@ class ProjectDb:
         try:
             oldest_allowed = dt - max_age
 
-            row = self.conn.execute("""
-                                    SELECT pk
-                                    FROM ssp_view
-                                    WHERE cast_datetime < ?
-                                      AND cast_datetime >= ?
-                                    ORDER BY cast_datetime DESC LIMIT 1
-                                    """, (dt, oldest_allowed)).fetchone()
+            # noinspection SqlResolve
+            row = conn.execute("""
+                               SELECT a.ssp_pk
+                               FROM ssp_index a
+                                        JOIN ssp b ON a.ssp_pk = b.pk
+                               WHERE a.cast_epoch < ?
+                                 AND a.cast_epoch >= ?
+                               ORDER BY a.cast_epoch DESC LIMIT 1
+                               """, (self._epoch(dt), self._epoch(oldest_allowed))).fetchone()
 
             if row is None:
                 return None
@@ -886,13 +1256,149 @@ class ProjectDb:
             logger.error("retrieving previous profile, %s: %s" % (type(e), e))
             return None
 
+    @classmethod
+    def _epoch(cls, dt: datetime.datetime) -> float:
+        """POSIX timestamp of a datetime (assumed in UTC, if naive)"""
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return dt.timestamp()
+
+    def profiles_within(self, lat: float, lon: float, radius_km: float, start: datetime.datetime | None = None,
+                        end: datetime.datetime | None = None) -> list[tuple[int, datetime.datetime, float]] | None:
+        """Return the profiles within the passed distance from a position, optionally between two datetimes
+
+        The profiles are returned as (pk, cast datetime, distance in km), sorted by distance."""
+
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
+        conn = self._reader()
+
+        # bounding box on the indexed columns, then the actual distance on the few selected profiles
+        d_lat = radius_km / 111.195  # km per degree of latitude on the haversine sphere
+        conditions = ["a.latitude BETWEEN ? AND ?"]
+        params = [lat - d_lat, lat + d_lat]
+        cos_lat = math.cos(math.radians(min(abs(lat) + d_lat, 90.0)))
+        if (cos_lat > 1e-6) and (d_lat / cos_lat < 180.0):
+            d_lon = d_lat / cos_lat
+            lon_min = (lon - d_lon + 180.0) % 360.0 - 180.0
+            lon_max = (lon + d_lon + 180.0) % 360.0 - 180.0
+            if lon_min <= lon_max:
+                conditions.append("a.longitude BETWEEN ? AND ?")
+            else:  # crossing the antimeridian
+                conditions.append("(a.longitude >= ? OR a.longitude <= ?)")
+            params += [lon_min, lon_max]
+        if start is not None:
+            conditions.append("a.cast_epoch >= ?")
+            params.append(self._epoch(start))
+        if end is not None:
+            conditions.append("a.cast_epoch <= ?")
+            params.append(self._epoch(end))
+
+        try:
+            # noinspection SqlResolve
+            rows = conn.execute("""
+                                SELECT a.ssp_pk AS id, c.cast_datetime, a.latitude, a.longitude
+                                FROM ssp_index a
+                                         JOIN ssp b ON a.ssp_pk = b.pk
+                                         JOIN ssp_pk c ON a.ssp_pk = c.id
+                                WHERE %s
+                                """ % " AND ".join(conditions), params).fetchall()
+
+        except sqlite3.Error as e:
+            logger.error("retrieving profiles within %.1f km, %s: %s" % (radius_km, type(e), e))
+            return None
+
+        profiles = list()
+        for row in rows:
+            distance = Geodesy.haversine(long_1=lon, lat_1=lat, long_2=row['longitude'], lat_2=row['latitude']) / 1000.0
+            if distance <= radius_km:
+                profiles.append((row['id'], row['cast_datetime'], distance))
+        profiles.sort(key=lambda p: p[2])
+        return profiles
+
+    def nearest_profile_key(self, dt: datetime.datetime | None = None, lat: float | None = None,
+                            lon: float | None = None, max_age: datetime.timedelta | None = None,
+                            max_distance_km: float | None = None) -> int | None:
+        """Return the nearest profile in space (if a position is passed) or in time (otherwise)
+
+        The max age limits the search around the passed datetime, in both the directions."""
+
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
+        conn = self._reader()
+
+        start = None
+        end = None
+        if (dt is not None) and (max_age is not None):
+            start = dt - max_age
+            end = dt + max_age
+
+        if (lat is not None) and (lon is not None):
+            # widen the search up to the max distance (or to the whole Earth)
+            radii = [10.0, 100.0, 1000.0, 20040.0]
+            if max_distance_km is not None:
+                radii = [r for r in radii if r < max_distance_km] + [max_distance_km]
+            for radius_km in radii:
+                profiles = self.profiles_within(lat=lat, lon=lon, radius_km=radius_km, start=start, end=end)
+                if profiles is None:
+                    return None
+                if len(profiles) > 0:
+                    return profiles[0][0]
+            return None
+
+        if dt is None:
+            raise RuntimeError("missing datetime or position to search the nearest profile")
+
+        epoch = self._epoch(dt)
+        candidates = list()
+        try:
+            # the closest profiles before and after the datetime, both using the index
+            for condition, order in (("a.cast_epoch <= ?", "DESC"), ("a.cast_epoch > ?", "ASC")):
+                # noinspection SqlResolve
+                row = conn.execute("""
+                                   SELECT a.ssp_pk AS id, a.cast_epoch
+                                   FROM ssp_index a
+                                            JOIN ssp b ON a.ssp_pk = b.pk
+                                   WHERE %s
+                                   ORDER BY a.cast_epoch %s LIMIT 1
+                                   """ % (condition, order), (epoch, )).fetchone()
+                if row is not None:
+                    candidates.append((abs(row['cast_epoch'] - epoch), row['id']))
+
+        except sqlite3.Error as e:
+            logger.error("retrieving nearest profile, %s: %s" % (type(e), e))
+            return None
+
+        if len(candidates) == 0:
+            return None
+        age, pk = min(candidates)
+        if (max_age is not None) and (age > max_age.total_seconds()):
+            return None
+        return pk
+
     def list_profiles(self, with_stats: bool = False) -> list:
         if self.conn is None:
             raise RuntimeError("missing db connection")
+        conn = self._reader()
 
         ssp_list = list()
-        # noinspection SqlResolve
-        sql = self.conn.execute("SELECT * FROM ssp_view")
+        if with_stats:
+            # noinspection SqlResolve
+            sql = conn.execute("""
+                               SELECT a.*,
+                                      b.ss_at_min_depth,
+                                      b.min_depth,
+                                      b.mean_ss,
+                                      b.max_depth,
+                                      b.max_raw_depth
+                               FROM ssp_view a
+                                        LEFT OUTER JOIN profile_stats b ON a.pk = b.ssp_pk
+                               """)
+        else:
+            # noinspection SqlResolve
+            sql = conn.execute("SELECT * FROM ssp_view")
 
         try:
             for row in sql:
@@ -932,19 +1438,12 @@ class ProjectDb:
 
                 if with_stats:
                     # special handling for surface sound speed, mean sound speed, min depth, max depth
-                    try:
-                        ssp = self.profile_by_pk(row['pk'])
-                        if ssp is None or ssp.cur is None:
-                            raise RuntimeError("missing cur profile")
-                        min_depth = '%0.2f' % ssp.cur.proc_depth_min
-                        ss_at_min_depth = '%0.2f' % ssp.cur.proc_speed_at_min_depth
-                        mean_ss = '%0.2f' % ssp.cur.proc_speed_mean
-                        max_depth = '%0.2f' % ssp.cur.proc_depth_max
-                        max_raw_depth = '%0.2f' % ssp.cur.data_depth_max
-
-                    except Exception as e:
-                        logger.warning("profile %s: %s -> skipping" % (e, row['pk']), exc_info=True)
+                    stats = (row['ss_at_min_depth'], row['min_depth'], row['mean_ss'], row['max_depth'],
+                             row['max_raw_depth'])
+                    if None in stats:
+                        logger.warning("profile %s: missing statistics -> skipping" % row['pk'])
                         continue
+                    ss_at_min_depth, min_depth, mean_ss, max_depth, max_raw_depth = ['%0.2f' % v for v in stats]
 
                     values += [
                         ss_at_min_depth,  # 20
@@ -962,20 +1461,78 @@ class ProjectDb:
             logger.error("%s: %s" % (type(e), e))
             return ssp_list
 
+    def proc_samples_between(self, start: datetime.datetime | None = None, end: datetime.datetime | None = None):
+        """Generate the valid proc samples of the profiles cast in the [start, end) time range, sorted by time
+
+        Each profile is yielded as (pk, cast datetime, depths, speeds), without building a ProfileList."""
+
+        if not self.conn:
+            logger.error("missing db connection")
+            return
+        conn = self._reader()
+
+        conditions = ["1"]
+        params = list()
+        if start is not None:
+            conditions.append("a.cast_epoch >= ?")
+            params.append(self._epoch(start))
+        if end is not None:
+            conditions.append("a.cast_epoch < ?")
+            params.append(self._epoch(end))
+
+        try:
+            # noinspection SqlResolve
+            rows = conn.execute("""
+                                SELECT a.ssp_pk AS id, c.cast_datetime, s.num_samples, s.depth, s.speed, s.flag
+                                FROM ssp_index a
+                                         JOIN ssp b ON a.ssp_pk = b.pk
+                                         JOIN ssp_pk c ON a.ssp_pk = c.id
+                                         LEFT JOIN samples s ON s.ssp_pk = a.ssp_pk AND s.stage = ?
+                                WHERE %s
+                                ORDER BY a.cast_epoch
+                                """ % " AND ".join(conditions), [self.sample_stages[1]] + params)
+
+            for row in rows:
+                if row['num_samples'] is None:  # per-sample rows
+                    # noinspection SqlResolve
+                    samples = np.array(conn.execute("""
+                                                    SELECT depth, speed
+                                                    FROM proc
+                                                    WHERE ssp_pk = ? AND flag = ?
+                                                    """, (row['id'], Dicts.flags['valid'])).fetchall(),
+                                       dtype=np.float64).reshape(-1, 2)
+                    yield row['id'], row['cast_datetime'], samples[:, 0], samples[:, 1]
+                    continue
+
+                valid = self._unpack_column(row['flag'], row['num_samples']) == Dicts.flags['valid']
+                yield row['id'], row['cast_datetime'], \
+                    self._unpack_column(row['depth'], row['num_samples'])[valid], \
+                    self._unpack_column(row['speed'], row['num_samples'])[valid]
+
+        except sqlite3.Error as e:
+            logger.error("streaming proc samples, %s: %s" % (type(e), e))
+            return
+
     def profile_by_pk(self, pk: int) -> ProfileList | None:
         if not self.conn:
             logger.error("missing db connection")
             return None
+        conn = self._reader()
 
         # logger.info("retrieve profile with pk: %s" % pk)
 
+        if self.use_profile_cache:
+            ssp = profile_cache.get(db_path=self.db_path, pk=pk)
+            if ssp is not None:
+                return ssp
+
         ssp = ProfileList()
         ssp.append()
 
         try:
             # ssp spatial timestamp
             # noinspection SqlResolve
-            ssp_idx = self.conn.execute("SELECT * FROM ssp_pk WHERE id=?", (pk,)).fetchone()
+            ssp_idx = conn.execute("SELECT * FROM ssp_pk WHERE id=?", (pk,)).fetchone()
 
             ssp.cur.meta.utc_time = ssp_idx['cast_datetime']
             ssp.cur.meta.longitude = ssp_idx['cast_position'].x
@@ -988,7 +1545,7 @@ class ProjectDb:
         try:
             # ssp metadata
             # noinspection SqlResolve
-            ssp_meta = self.conn.execute("SELECT * FROM ssp WHERE pk=?", (pk,)).fetchone()
+            ssp_meta = conn.execute("SELECT * FROM ssp WHERE pk=?", (pk,)).fetchone()
 
             # special handling in case of unknown future sensor type
             ssp.cur.meta.sensor_type = ssp_meta['sensor_type']
@@ -1021,76 +1578,33 @@ class ProjectDb:
             logger.error("ssp meta for %s pk > %s: %s" % (pk, type(e), e))
             return None
 
-        # raw data
-        try:
-            # noinspection SqlResolve
-            ssp_samples = self.conn.execute("SELECT * FROM data WHERE ssp_pk=?", (pk,)).fetchall()
-            num_samples = len(ssp_samples)
-            ssp.cur.init_data(num_samples)
-            # logger.debug("raw data samples: %s" % num_samples)
-            for i in range(num_samples):
-                # print(ssp_samples[i])
-
-                ssp.cur.data.pressure[i] = ssp_samples[i]['pressure']
-                ssp.cur.data.depth[i] = ssp_samples[i]['depth']
-                ssp.cur.data.speed[i] = ssp_samples[i]['speed']
-                ssp.cur.data.temp[i] = ssp_samples[i]['temperature']
-                ssp.cur.data.conductivity[i] = ssp_samples[i]['conductivity']
-                ssp.cur.data.sal[i] = ssp_samples[i]['salinity']
-                ssp.cur.data.source[i] = ssp_samples[i]['source']
-                ssp.cur.data.flag[i] = ssp_samples[i]['flag']
-
-        except sqlite3.Error as e:
-            logger.error("reading raw samples for %s pk, %s: %s" % (pk, type(e), e))
-            return None
-
-        # proc data
-        try:
-            # noinspection SqlResolve
-            ssp_samples = self.conn.execute("SELECT * FROM proc WHERE ssp_pk=?", (pk,)).fetchall()
-            num_samples = len(ssp_samples)
-            ssp.cur.init_proc(num_samples)
-            # logger.debug("proc data samples: %s" % num_samples)
-            for i in range(num_samples):
-                # print(ssp_samples[i])
-                ssp.cur.proc.pressure[i] = ssp_samples[i]['pressure']
-                ssp.cur.proc.depth[i] = ssp_samples[i]['depth']
-                ssp.cur.proc.speed[i] = ssp_samples[i]['speed']
-                ssp.cur.proc.temp[i] = ssp_samples[i]['temperature']
-                ssp.cur.proc.conductivity[i] = ssp_samples[i]['conductivity']
-                ssp.cur.proc.sal[i] = ssp_samples[i]['salinity']
-                ssp.cur.proc.source[i] = ssp_samples[i]['source']
-                ssp.cur.proc.flag[i] = ssp_samples[i]['flag']
-
-        except sqlite3.Error as e:
-            logger.error("reading raw samples for %s pk, %s: %s" % (pk, type(e), e))
-            return None
+        # raw, proc and sis data
+        for stage, init_samples, label in ((self.sample_stages[0], ssp.cur.init_data, "raw"),
+                                           (self.sample_stages[1], ssp.cur.init_proc, "proc"),
+                                           (self.sample_stages[2], ssp.cur.init_sis, "sis")):
+            try:
+                arrays = self._read_samples(conn=conn, pk=pk, stage=stage)
 
-        # sis data
-        try:
-            # noinspection SqlResolve
-            ssp_samples = self.conn.execute("SELECT * FROM sis WHERE ssp_pk=?", (pk,)).fetchall()
-            num_samples = len(ssp_samples)
-            ssp.cur.init_sis(num_samples)
-            # logger.debug("sis data samples: %s" % num_samples)
-            for i in range(num_samples):
-                # print(ssp_samples[i])
-                ssp.cur.sis.pressure[i] = ssp_samples[i]['depth']
-                ssp.cur.sis.depth[i] = ssp_samples[i]['depth']
-                ssp.cur.sis.speed[i] = ssp_samples[i]['speed']
-                ssp.cur.sis.temp[i] = ssp_samples[i]['temperature']
-                ssp.cur.sis.conductivity[i] = ssp_samples[i]['conductivity']
-                ssp.cur.sis.sal[i] = ssp_samples[i]['salinity']
-                ssp.cur.sis.source[i] = ssp_samples[i]['source']
-                ssp.cur.sis.flag[i] = ssp_samples[i]['flag']
+            except sqlite3.Error as e:
+                logger.error("reading %s samples for %s pk, %s: %s" % (label, pk, type(e), e))
+                return None
 
-        except sqlite3.Error as e:
-            logger.error("reading sis samples for %s pk, %s: %s" % (pk, type(e), e))
-            return None
+            num_samples = len(arrays['depth'])
+            init_samples(num_samples)
+            # logger.debug("%s data samples: %s" % (label, num_samples))
+            if num_samples == 0:
+                continue
+            samples = getattr(ssp.cur, stage)
+            for attribute, values in arrays.items():
+                # the compressed columns are read-only views, while the profile samples may be edited
+                setattr(samples, attribute, values if values.flags.writeable else values.copy())
 
         # This is the only way for the library to load a profile from the project database
         ssp.loaded_from_db = True
 
+        if self.use_profile_cache:
+            profile_cache.put(db_path=self.db_path, pk=pk, ssp=ssp)
+
         return ssp
 
     def delete_profile_by_pk(self, pk: int) -> bool:
@@ -1104,10 +1618,78 @@ class ProjectDb:
             raise RuntimeError("missing db connection")
 
         self.conn.commit()
+        profile_cache.invalidate(db_path=self.db_path, pk=pk)
 
         self.tmp_ssp_pk = None
         return True
 
+    def convert_to_columnar_samples(self) -> str | None:
+        """Move the per-sample rows of the profiles to compressed columns, after a backup of the db file
+
+        The converted db is smaller and faster to read, but the older versions of the library see its profiles
+        without samples (they can still delete them, or store them again with per-sample rows). The backup (with
+        the per-sample rows) is a copy of the db file with a '.bak' extension.
+        Return the path of the backup, or None in case of failure.
+        """
+        if not self.conn:
+            logger.error("missing db connection")
+            return None
+
+        backup_path = "%s.%s.bak" % (self.db_path, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        try:
+            self.conn.commit()
+            backup_conn = sqlite3.connect(backup_path)
+            try:
+                self.conn.backup(backup_conn)
+            finally:
+                backup_conn.close()
+
+        except sqlite3.Error as e:
+            logger.error("unable to back up the db to %s, %s: %s" % (backup_path, type(e), e))
+            return None
+
+        try:
+            columns = ", ".join(column for column, _ in self.sample_columns)
+            for stage in self.sample_stages:
+                # noinspection SqlResolve
+                rows = self.conn.execute("""SELECT ssp_pk, %s
+                                            FROM %s
+                                            ORDER BY ssp_pk, rowid""" % (columns, stage))
+                nr_profiles = 0
+                for pk, pk_rows in itertools.groupby(rows, key=lambda r: r[0]):
+                    values = np.array([tuple(r)[1:] for r in pk_rows], dtype=np.float64)
+                    # noinspection SqlResolve
+                    self.conn.execute("""
+                                      INSERT OR REPLACE INTO samples
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                      """, [pk, stage, values.shape[0]] +
+                                      [self._pack_column(values[:, i]) for i in range(len(self.sample_columns))])
+                    nr_profiles += 1
+                logger.debug("moved the %s samples of %d profiles to compressed columns" % (stage, nr_profiles))
+
+            for stage in self.sample_stages:
+                # noinspection SqlResolve
+                self.conn.execute("""DELETE FROM %s""" % stage)
+
+            self.conn.commit()
+
+        except (sqlite3.Error, ValueError) as e:
+            self.conn.rollback()
+            logger.error("unable to convert to compressed columns, %s: %s" % (type(e), e))
+            return None
+
+        try:
+            # release the space of the deleted rows
+            self.conn.execute("VACUUM")
+
+        except sqlite3.Error as e:
+            logger.warning("unable to vacuum the db, %s: %s" % (type(e), e))
+
+        self.columnar_samples = True
+        profile_cache.invalidate(db_path=self.db_path)
+        logger.info("converted to compressed columns (backup: %s)" % backup_path)
+        return backup_path
+
     def _updates_to_version_3_no_commit(self, old_version: int) -> None:
         if self.conn is None:
             raise RuntimeError("missing db connection")
@@ -1133,6 +1715,72 @@ class ProjectDb:
                           """, (self.cur_version, "%s v.%s" % (pkg_info.name, pkg_info.version),
                                 datetime.datetime.now(datetime.UTC),))
 
+    def _updates_to_version_4_no_commit(self, old_version: int) -> None:
+        if self.conn is None:
+            raise RuntimeError("missing db connection")
+
+        # - 'samples' table: created empty, the per-sample rows are moved only by 'convert_to_columnar_samples'
+        #   (the converted db would show casts without samples to the older versions of the library)
+
+        # - 'library' table
+        # noinspection SqlResolve
+        self.conn.execute("""DELETE
+                             FROM library""")
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          INSERT INTO library
+                          VALUES (?, ?, ?)
+                          """, (self.cur_version, "%s v.%s" % (pkg_info.name, pkg_info.version),
+                                datetime.datetime.now(datetime.UTC),))
+
+    def _updates_to_version_5_no_commit(self, old_version: int) -> None:
+        if self.conn is None:
+            raise RuntimeError("missing db connection")
+
+        # - 'profile_stats' table: one-time calculation of the statistics of the stored profiles
+        # noinspection SqlResolve
+        pks = [row[0] for row in self.conn.execute("""SELECT pk
+                                                      FROM ssp
+                                                      WHERE pk NOT IN (SELECT ssp_pk FROM profile_stats)""")]
+        for self.tmp_ssp_pk in pks:
+            ssp = self.profile_by_pk(self.tmp_ssp_pk)
+            if ssp is None:
+                logger.warning("unable to load profile %s for statistics" % self.tmp_ssp_pk)
+                continue
+            if not self._add_stats_no_commit(profile=ssp.cur):
+                raise sqlite3.Error("unable to add ssp statistics")
+        self.tmp_ssp_pk = None
+        logger.debug("calculated the statistics of %d profiles" % len(pks))
+
+        # - 'library' table
+        # noinspection SqlResolve
+        self.conn.execute("""DELETE
+                             FROM library""")
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          INSERT INTO library
+                          VALUES (?, ?, ?)
+                          """, (self.cur_version, "%s v.%s" % (pkg_info.name, pkg_info.version),
+                                datetime.datetime.now(datetime.UTC),))
+
+    def _updates_to_version_6_no_commit(self, old_version: int) -> None:
+        if self.conn is None:
+            raise RuntimeError("missing db connection")
+
+        # - 'ssp_index' table: filled with the stored casts (by '_index_casts_no_commit')
+        self._index_casts_no_commit()
+
+        # - 'library' table
+        # noinspection SqlResolve
+        self.conn.execute("""DELETE
+                             FROM library""")
+        # noinspection SqlResolve
+        self.conn.execute("""
+                          INSERT INTO library
+                          VALUES (?, ?, ?)
+                          """, (self.cur_version, "%s v.%s" % (pkg_info.name, pkg_info.version),
+                                datetime.datetime.now(datetime.UTC),))
+
     def __repr__(self) -> str:
         msg = "<%s>\n" % self.__class__.__name__
 
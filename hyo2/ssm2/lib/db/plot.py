@@ -1,3 +1,4 @@
+import datetime
 import logging
 import os
 
@@ -142,16 +143,19 @@ class PlotDb:
 
     class AvgSsp:
         def __init__(self):
-            # create and populate list used in the calculations
-            self.limits = list()  # bin limits
+            # bin limits: each sample goes in the first bin with the limit deeper than its depth
+            self.limits = np.arange(10, 781, 10, dtype=np.float64)
             self.depths = list()  # avg depth for each bin
-            self.bins = list()  # a list of list with all the value within a bin
 
-            # populating
-            for i, z in enumerate(range(10, 781, 10)):
-                self.limits.append(z)
-                # self.depths.append(z + 5.)
-                self.bins.append(list())
+            # running statistics for each bin, so that the samples do not need to be kept
+            self.counts = np.zeros(len(self.limits), dtype=np.int64)
+            self.means = np.zeros(len(self.limits), dtype=np.float64)
+            self.m2s = np.zeros(len(self.limits), dtype=np.float64)  # sum of the squared deviations from the mean
+
+            # number of samples for each cell of the plotted depth/value grid (the samples are not kept for plotting)
+            self.grid_depths = np.arange(0., 781., 2.)
+            self.grid_values = np.arange(1440., 1581., 1.)
+            self.grid_counts = np.zeros((len(self.grid_depths) - 1, len(self.grid_values) - 1), dtype=np.int64)
 
             # output lists
             self.min_2std = list()
@@ -159,39 +163,47 @@ class PlotDb:
             self.mean = list()
 
         def add_samples(self, depths, values):
-
-            for i, d in enumerate(depths):
-
-                for j, lim in enumerate(self.limits):
-
-                    if d < lim:
-                        self.bins[j].append(values[i])
-                        break
+            depths = np.asarray(depths, dtype=np.float64)
+            values = np.asarray(values, dtype=np.float64)
+
+            grid_counts = np.histogram2d(depths, values, bins=(self.grid_depths, self.grid_values))[0]
+            self.grid_counts += grid_counts.astype(np.int64)
+
+            idx = np.digitize(depths, self.limits)  # the samples deeper than the last limit (or NaN) get len(limits)
+            in_bins = idx < len(self.limits)
+            idx = idx[in_bins]
+            values = values[in_bins]
+            if idx.size == 0:
+                return
+
+            # statistics of the new samples, then merged with the running ones (Chan et al.)
+            counts = np.bincount(idx, minlength=len(self.limits))
+            filled = counts > 0
+            means = np.zeros(len(self.limits), dtype=np.float64)
+            means[filled] = np.bincount(idx, weights=values, minlength=len(self.limits))[filled] / counts[filled]
+            m2s = np.bincount(idx, weights=(values - means[idx]) ** 2, minlength=len(self.limits))
+
+            total = self.counts + counts
+            delta = means - self.means
+            self.m2s[filled] += m2s[filled] + delta[filled] ** 2 * self.counts[filled] * counts[filled] / total[filled]
+            self.means[filled] += delta[filled] * counts[filled] / total[filled]
+            self.counts = total
 
         def calc_avg(self):
 
-            skip_counter = 0
-
-            for i, i_bin in enumerate(self.bins):
-
-                # to avoid unstable statistics
-                if len(i_bin) < 3:
-                    # logger.debug("[%d] too few samples: %s -> skip" % (i, i_bin))
-                    skip_counter += 1
-                    continue
+            # to avoid unstable statistics
+            valid = self.counts >= 3
+            skip_counter = np.count_nonzero(~valid)
 
-                if i == 0:
-                    self.depths.append(0.)
-                elif i == (len(self.bins) - 1):
-                    self.depths.append(780.)
-                else:
-                    self.depths.append(self.limits[i] - 5.)
+            depths = self.limits - 5.
+            depths[0] = 0.
+            depths[-1] = 780.
+            std = np.sqrt(self.m2s[valid] / self.counts[valid])
 
-                avg = np.mean(i_bin)
-                std = np.std(i_bin)
-                self.mean.append(avg)
-                self.min_2std.append(avg - 2 * std)
-                self.max_2std.append(avg + 2 * std)
+            self.depths = depths[valid].tolist()
+            self.mean = self.means[valid].tolist()
+            self.min_2std = (self.means[valid] - 2 * std).tolist()
+            self.max_2std = (self.means[valid] + 2 * std).tolist()
 
             if skip_counter > 0:
                 logger.debug("skipped depth bins: %d" % skip_counter)
@@ -202,13 +214,17 @@ class PlotDb:
         if not save_fig:
             plt.ion()
 
-        ts_list = self.db.list_profiles()
+        ts_list = self.db.timestamp_list()
 
         if ts_list is None:
             raise RuntimeError("Unable to retrieve the day list > Empty database?")
         if len(ts_list) == 0:
             raise RuntimeError("Unable to retrieve the day list > Empty database?")
 
+        # the dates are inclusive: from the start of the first day to the end of the last one
+        start = datetime.datetime.combine(dates[0], datetime.time.min)
+        end = datetime.datetime.combine(dates[1] + datetime.timedelta(days=1), datetime.time.min)
+
         # start a new figure
         plt.close("Aggregate Plot")
         fig, ax = plt.subplots(num="Aggregate Plot")
@@ -223,27 +239,16 @@ class PlotDb:
         avg_ssp = PlotDb.AvgSsp()
 
         ssp_count = 0
-        for ts_pk in ts_list:
-
-            tmp_date = ts_pk[1].date()
-            logger.debug("profile date: %s" % tmp_date)
-
-            if (tmp_date < dates[0]) or (tmp_date > dates[1]):
-                logger.debug("skip for date")
-                continue
+        for pk, cast_datetime, depths, speeds in self.db.proc_samples_between(start=start, end=end):
+            logger.debug("profile date: %s" % cast_datetime)
 
             ssp_count += 1
-            # print(ts_pk[1], ts_pk[0])
-            tmp_ssp = self.db.profile_by_pk(ts_pk[0])
-            # print(tmp_ssp)
-            ax.plot(tmp_ssp.cur.proc.speed[tmp_ssp.cur.proc_valid], tmp_ssp.cur.proc.depth[tmp_ssp.cur.proc_valid], '.',
-                    color=(0.85, 0.85, 0.85), markersize=2
-                    # label='%s [%04d] ' % (ts_pk[0].time(), ts_pk[1])
-                    )
-
-            avg_ssp.add_samples(tmp_ssp.cur.proc.depth[tmp_ssp.cur.proc_valid],
-                                tmp_ssp.cur.proc.speed[tmp_ssp.cur.proc_valid])
+            avg_ssp.add_samples(depths, speeds)
 
+        # the samples of all the casts, as (light grey) density of the gridded counts
+        if avg_ssp.grid_counts.any():
+            ax.pcolormesh(avg_ssp.grid_values, avg_ssp.grid_depths, np.ma.masked_equal(avg_ssp.grid_counts, 0),
+                          cmap='Greys', vmin=-avg_ssp.grid_counts.max() / 2, alpha=0.4)
         avg_ssp.calc_avg()
         ax.plot(avg_ssp.mean, avg_ssp.depths, '-b', linewidth=2)
         ax.plot(avg_ssp.min_2std, avg_ssp.depths, '--b', linewidth=1)
@@ -0,0 +1,98 @@
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from hyo2.ssm2.lib.profile.profilelist import ProfileList
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """Least-recently-used cache of the profiles decoded from the project databases, bounded by their sample size
+
+    The entries are keyed by db path and profile pk. Each caller gets its own copy of the cached profiles, so that
+    they can be freely edited without corrupting the cache."""
+
+    def __init__(self, max_size_mb: float = 64.0) -> None:
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def entry_size(cls, ssp: ProfileList) -> int:
+        size = 0
+        for profile in ssp.l:
+            for samples in (profile.data, profile.proc, profile.sis, profile.more):
+                if samples is None:
+                    continue
+                size += sum(value.nbytes for value in vars(samples).values() if isinstance(value, np.ndarray))
+        return size
+
+    def get(self, db_path: str, pk: int) -> ProfileList | None:
+        key = (os.path.abspath(db_path), pk)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return copy.deepcopy(entry[0])
+
+    def put(self, db_path: str, pk: int, ssp: ProfileList) -> None:
+        size = self.entry_size(ssp)
+        if size > self.max_size:
+            logger.debug("skipping too large profile: %.1f MB" % (size / (1024 * 1024)))
+            return
+
+        key = (os.path.abspath(db_path), pk)
+        ssp = copy.deepcopy(ssp)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (ssp, size)
+            self._size += size
+
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def invalidate(self, db_path: str, pk: int | None = None) -> None:
+        """Remove a profile (or all the profiles of a db, if no pk is passed)"""
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            for key in [key for key in self._entries if (key[0] == db_path) and ((pk is None) or (key[1] == pk))]:
+                self._size -= self._entries.pop(key)[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size_mb(self) -> float:
+        return self._size / (1024 * 1024)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        msg = "<%s>\n" % self.__class__.__name__
+
+        msg += "  <entries: %d>\n" % len(self)
+        msg += "  <size: %.1f/%.1f MB>\n" % (self.size_mb, self.max_size / (1024 * 1024))
+        msg += "  <hits: %d, misses: %d>\n" % (self.hits, self.misses)
+
+        return msg
+
+
+profile_cache = ProfileCache()
@@ -146,13 +146,16 @@ class Oceanography:
     # ### SPEED METHODS ###
 
     @classmethod
-    def speed(cls, d, t, s, lat=30):
+    def speed(cls, d: float | np.ndarray, t: float | np.ndarray, s: float | np.ndarray, lat: float = 30.0) \
+            -> float | np.ndarray:
         """ Calculate sound speed from depth, temperature, and salinity
 
         validity: 0 - 40 deg C, 0 - 40 ppt, 0 - 1000 bars (~1000m)
 
         ref: Wong and Zhu(1995), Chen and Millero(1977)
 
+        The computation is element-wise, so whole profiles can be passed as numpy arrays in a single call.
+
         Args:
             d: depth in meter
             t: temp in degrees celsius
@@ -227,9 +230,13 @@ class Oceanography:
         return cwtp + atp * s + btp * s ** 1.5 + dtp * s ** 2
 
     @classmethod
-    def sal(cls, d, speed, t, lat=30):
+    def sal(cls, d: float | np.ndarray, speed: float | np.ndarray, t: float | np.ndarray, lat: float = 30.0) \
+            -> float | np.ndarray:
         """Iteratively calculate the salinity based on the speed() method
 
+        The bisection is run for all the passed samples at once, with each sample leaving the iterations
+        as soon as its calculated speed is within tolerance.
+
         Args:
             d: depth in meter
             speed: sound speed in m/sec
@@ -239,31 +246,43 @@ class Oceanography:
         Returns:  Salinity in PSU (ppt)
 
         """
-        high_value = 50.0
-        low_value = 0.0
+        is_scalar = (np.ndim(d) == 0) and (np.ndim(speed) == 0) and (np.ndim(t) == 0)
+        d, speed, t = np.broadcast_arrays(np.asarray(d, dtype=np.float64),
+                                          np.asarray(speed, dtype=np.float64),
+                                          np.asarray(t, dtype=np.float64))
+
+        tolerance = 0.0005
+        high_value = np.full(d.shape, 50.0)
+        low_value = np.zeros(d.shape)
         num_iterations = 0
         max_iterations = 1e6
-        salinity = 0
-        speed_calc = 0
-
-        while np.abs(speed_calc - speed) > 0.0005:
-
-            if high_value == low_value:  # unstable sound speed measurement
-                logger.warning("found unstable salinity value")
-                break
+        salinity = np.zeros(d.shape)
+        speed_calc = np.zeros(d.shape)
+
+        active = np.abs(speed_calc - speed) > tolerance
+        while active.any():
+
+            unstable = np.logical_and(active, high_value == low_value)
+            if unstable.any():  # unstable sound speed measurement
+                logger.warning("found %d unstable salinity values" % np.count_nonzero(unstable))
+                active[unstable] = False
+                if not active.any():
+                    break
             if num_iterations > max_iterations:
-                logger.warning("too many iterations to obtain the salinity value")
+                logger.warning("too many iterations to obtain %d salinity values" % np.count_nonzero(active))
                 break
 
-            salinity = (high_value + low_value) / 2.0
-            speed_calc = cls.speed(d, t, salinity, lat)
-            if speed_calc > speed:
-                high_value = salinity
-            else:
-                low_value = salinity
+            salinity[active] = (high_value[active] + low_value[active]) / 2.0
+            speed_calc[active] = cls.speed(d[active], t[active], salinity[active], lat)
+            too_high = speed_calc > speed
+            high_value = np.where(np.logical_and(active, too_high), salinity, high_value)
+            low_value = np.where(np.logical_and(active, ~too_high), salinity, low_value)
 
             num_iterations += 1
+            active = np.logical_and(active, np.abs(speed_calc - speed) > tolerance)
 
+        if is_scalar:
+            return float(salinity)
         return salinity
 
     @classmethod
@@ -320,29 +339,34 @@ class Oceanography:
         Returns: theta, potential temperature in deg C
 
         """
+        # the inputs are never modified in place, so that arrays can be safely passed
         h = pr - p
         xk = h * cls.atg(s=s, t=t, p=p)
 
-        t += + 0.5 * xk
+        t = t + 0.5 * xk
         q = xk
-        p += 0.5 * h
+        p = p + 0.5 * h
         xk = h * cls.atg(s=s, t=t, p=p)
 
-        t += 0.29289322 * (xk - q)
+        t = t + 0.29289322 * (xk - q)
         q = 0.58578644 * xk + 0.121320344 * q
         xk = h * cls.atg(s=s, t=t, p=p)
 
-        t += 1.707106781 * (xk - q)
+        t = t + 1.707106781 * (xk - q)
         q = 3.414213562 * xk - 4.121320344 * q
-        p += 0.5 * h
+        p = p + 0.5 * h
         xk = h * cls.atg(s=s, t=t, p=p)
 
         return t + (xk - 2.0 * q) / 6.0
 
     @classmethod
-    def in_situ_temp(cls, s, t, p, pr):
+    def in_situ_temp(cls, s: float | np.ndarray, t: float | np.ndarray, p: float | np.ndarray,
+                     pr: float | np.ndarray) -> float | np.ndarray:
         """Compute in-situ temperature at pressure
 
+        The in-situ temperature is the root of pot_temp(in_situ) - t, found with the secant method.
+        The inputs are broadcast together, so whole depth columns (or batches of them) can be passed at once.
+
         Args:
             s: salinity in PSU ppt
             t: temperature
@@ -351,28 +375,41 @@ class Oceanography:
 
         Returns: in-situ temperature in deg C
         """
+        is_scalar = (np.ndim(s) == 0) and (np.ndim(t) == 0) and (np.ndim(p) == 0) and (np.ndim(pr) == 0)
+        s, t, p, pr = np.broadcast_arrays(np.asarray(s, dtype=np.float64), np.asarray(t, dtype=np.float64),
+                                          np.asarray(p, dtype=np.float64), np.asarray(pr, dtype=np.float64))
 
-        if p == pr:
-            return t
+        tolerance = 1e-6
+        max_iterations = 50
 
-        temp = t
-        new_pot_t = cls.pot_temp(s=s, t=temp, p=p, pr=pr)
-        # logger.debug("p: %s, pr: %s" % (p, pr))
-        if new_pot_t < t:
-            sign = 1
-        else:
-            sign = -1
+        temp_prev = t.copy()
+        f_prev = cls.pot_temp(s=s, t=temp_prev, p=p, pr=pr) - t
+        active = np.logical_and(p != pr, np.abs(f_prev) > tolerance)
+
+        # the potential temperature varies almost 1:1 with the in-situ one, thus a unit slope is used for the first step
+        temp = np.where(active, temp_prev - f_prev, temp_prev)
+
+        num_iterations = 0
+        while active.any():
+            if num_iterations > max_iterations:
+                logger.warning("too many iterations to obtain %d in-situ temperature values"
+                               % np.count_nonzero(active))
+                break
 
-        dt = new_pot_t - t
-        new_dt = new_pot_t - t
+            f = cls.pot_temp(s=s, t=temp, p=p, pr=pr) - t
+            df = f - f_prev
+            active = np.logical_and(active, np.abs(f) > tolerance)
+            active = np.logical_and(active, df != 0.0)  # stalled
 
-        while abs(new_dt) > 0.001:
-            if abs(new_dt) > abs(dt):
-                sign = -sign
-            temp += sign * 0.001
-            new_pot_t = cls.pot_temp(s=s, t=temp, p=p, pr=pr)
-            new_dt = new_pot_t - t
+            step = np.zeros_like(temp)
+            step[active] = f[active] * (temp[active] - temp_prev[active]) / df[active]
+            temp_prev, f_prev = temp, f
+            temp = temp - step
+
+            num_iterations += 1
 
+        if is_scalar:
+            return float(temp)
         return temp
 
     @classmethod
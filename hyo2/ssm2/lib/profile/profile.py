@@ -1,3 +1,4 @@
+import heapq
 import logging
 import math
 import os
@@ -11,6 +12,7 @@ from hyo2.ssm2.lib.profile.dicts import Dicts
 from hyo2.ssm2.lib.profile.metadata import Metadata
 from hyo2.ssm2.lib.profile.more import More
 from hyo2.ssm2.lib.profile.oceanography import Oceanography as Oc
+from hyo2.ssm2.lib.profile.ray_tracing.ray_cache import ray_cache
 from hyo2.ssm2.lib.profile.ray_tracing.ray_path import RayPath
 from hyo2.ssm2.lib.profile.ray_tracing.ray_tracing import RayTracing
 from hyo2.ssm2.lib.profile.ray_tracing.tracedprofile import TracedProfile
@@ -25,6 +27,9 @@ logger = logging.getLogger(__name__)
 class Profile:
     """"A sound speed profile with 3 sections: metadata, data specific to the task, and additional data"""
 
+    MAX_SIS_SAMPLES = 999  # Kongsberg SIS rejects profiles with 1000 or more samples
+    DQA_MAX_PCT_DEPTH_DIFF = 0.25  # recommended limit for the percent depth difference between two casts
+
     def __init__(self):
         self.meta = Metadata()  # metadata
         self.data = Samples()  # raw data
@@ -351,60 +356,41 @@ class Profile:
 
         # Calculate local mean and std dev for each sample, use 2 neighbors on either sides.
         # Endpoints treated separately. Target: single point fliers
-        for i in range(2, nr_samples - 2):
-            speed_sum = 0
-            speed_sum_sq = 0
-            for k in range(-2, 3):
-                if k == 0:  # skip itself
-                    continue
-                speed_sum += speed[i + k]
-                speed_sum_sq += speed[i + k] * speed[i + k]
-
-            variance = ((4 * speed_sum_sq) - speed_sum * speed_sum) / (4 * 3)  # unbiased variance
-            speed_mean[i] = speed_sum / 4
-            if variance < 0:
-                variance = 0
-            sigma[i] = np.sqrt(variance)  # Local standard deviation
-            if sigma[i] < sigma_min_th:
-                sigma[i] = sigma_min_th
+        speed_sq = speed * speed
+        speed_sum = speed[:-4] + speed[1:-3] + speed[3:-1] + speed[4:]  # skip itself
+        speed_sum_sq = speed_sq[:-4] + speed_sq[1:-3] + speed_sq[3:-1] + speed_sq[4:]
+        variance = ((4 * speed_sum_sq) - speed_sum * speed_sum) / (4 * 3)  # unbiased variance
+        speed_mean[2:nr_samples - 2] = speed_sum / 4
+        variance[variance < 0] = 0
+        sigma[2:nr_samples - 2] = np.maximum(np.sqrt(variance), sigma_min_th)  # Local standard deviation
 
         # Endpoints (use only three neighboring points). Relax tolerance.
         c_end = 1.3  # Relaxed tolerance factor at endpoints.
         ends_i = [0, 1, nr_samples - 2, nr_samples - 1]
         index = [(1, 2, 3), (0, 2, 3), (nr_samples - 4, nr_samples - 3, nr_samples - 1),
                  (nr_samples - 4, nr_samples - 3, nr_samples - 2)]
-        for k in range(4):
-            speed_sum = 0
-            speed_sum_sq = 0
-            i = ends_i[k]  # Point number
-            for j in range(3):
-                ind_kj = index[k][j]
-                speed_sum += speed[ind_kj]
-                speed_sum_sq += speed[ind_kj] * speed[ind_kj]
-
-            variance = ((3 * speed_sum_sq) - speed_sum * speed_sum) / (3 * 2)  # unbiased variance
-            speed_mean[i] = speed_sum / 3
-            if variance < 0:
-                variance = 0
-            sigma[i] = np.sqrt(variance)
-            if sigma[i] < sigma_min_th:
-                sigma[i] = sigma_min_th
+        ends_speed = speed[np.array(index)]
+        ends_speed_sq = speed_sq[np.array(index)]
+        speed_sum = ends_speed[:, 0] + ends_speed[:, 1] + ends_speed[:, 2]
+        speed_sum_sq = ends_speed_sq[:, 0] + ends_speed_sq[:, 1] + ends_speed_sq[:, 2]
+        variance = ((3 * speed_sum_sq) - speed_sum * speed_sum) / (3 * 2)  # unbiased variance
+        variance[variance < 0] = 0
+        for k, i in enumerate(ends_i):
+            speed_mean[i] = speed_sum[k] / 3
+            sigma[i] = max(np.sqrt(variance[k]), sigma_min_th)
             sigma[i] *= c_end  # Relax tolerance for end pts
 
         # identify the sample to filter
         nr_std_dev = 2  # number of standard deviations to use for error band.
         tolerance_factor = 1.3  # Tolerance factor.
         depth_th = 33.0  # Depth at which to relax error band.
-        factor = tolerance_factor
-        stat_filtered = np.zeros(nr_samples, dtype=bool)
-        for i in range(nr_samples):
-            if depth[i] > depth_th:
-                factor = 1.0
-            th = factor * nr_std_dev * sigma[i]
-            if np.absolute(speed[i] - speed_mean[i]) > th:
-                logger.debug("statistical filtering for sample #%d (%.2f, %.2f, th: %.2f)"
-                             % (i, speed[i], speed_mean[i], th))
-                stat_filtered[i] = True
+        # once the depth threshold is passed, the error band stays relaxed for all the following samples
+        factor = np.where(np.logical_or.accumulate(depth > depth_th), 1.0, tolerance_factor)
+        th = factor * nr_std_dev * sigma
+        stat_filtered = np.absolute(speed - speed_mean) > th
+        for i in np.flatnonzero(stat_filtered):
+            logger.debug("statistical filtering for sample #%d (%.2f, %.2f, th: %.2f)"
+                         % (i, speed[i], speed_mean[i], th[i]))
 
         # finally apply the statistical filtering
         filtered_ii = np.zeros(len(self.proc_valid), dtype=bool)
@@ -459,35 +445,28 @@ class Profile:
             logger.debug("cosine avg -> storage: rows %s, columns %s" % (storage.shape[0], storage.shape[1]))
 
         # populate bin values (row #0)
-        for i in range(storage.shape[1]):
-            storage[0][i] = z_min + (- bin_width + i) * bin_size
+        storage[0] = z_min + (- bin_width + np.arange(storage.shape[1])) * bin_size
         if verbose:
             logger.debug("cosine avg -> storage bin values: %s" % (storage[0],))
 
         # populate weights
-        for i, z in enumerate(zs):
-
-            # calculate the index of the central bin value
-            center_idx = int((z - z_min) / bin_size + .5) + bin_width
-            # if debug:
-            #     logger.debug("cosine avg -> z: %s, center index: %s" % (z, center_idx))
+        # - for each z, the indices of the bins in the averaging windows (around the central bin value)
+        center_idx = ((zs - z_min) / bin_size + .5).astype(int) + bin_width
+        bin_idx = center_idx[:, np.newaxis] + np.arange(-bin_width, bin_width + 1)
 
-            # calculate the differences from the current z values in the averaging windows
-            z_diff = z - storage[0][center_idx - bin_width:center_idx + bin_width + 1]
-            # if debug:
-            #     logger.debug("cosine avg -> z: %s, z diff: %s" % (z, z_diff))
+        # calculate the differences from the current z values in the averaging windows
+        z_diff = zs[:, np.newaxis] - storage[0][bin_idx]
 
-            # Insure that weight will be .1 at a window width from point I
-            bin_weights = 1.0 + np.cos(2.69 * z_diff / window_width[i])
-            bin_weights *= np.absolute(z_diff) < window_width[i]  # set to 0 when outside the window width
-            # if debug:
-            #     logger.debug("cosine avg -> z: %s, bin weights: %s" % (z, bin_weights))
+        # Insure that weight will be .1 at a window width from point I
+        bin_weights = 1.0 + np.cos(2.69 * z_diff / window_width[:, np.newaxis])
+        bin_weights *= np.absolute(z_diff) < window_width[:, np.newaxis]  # set to 0 when outside the window width
 
-            for j, name in enumerate(names):
-                # summing up for all the types, row is j + 1 since the first row is for bin values
-                storage[1 + j][center_idx - bin_width:center_idx + bin_width + 1] += records[name][i] * bin_weights
-
-            storage[-1][center_idx - bin_width:center_idx + bin_width + 1] += bin_weights
+        # summing up for all the types, row is j + 1 since the first row is for bin values
+        bin_idx = bin_idx.ravel()
+        for j, name in enumerate(names):
+            storage[1 + j] += np.bincount(bin_idx, weights=(records[name][:, np.newaxis] * bin_weights).ravel(),
+                                          minlength=storage.shape[1])
+        storage[-1] += np.bincount(bin_idx, weights=bin_weights.ravel(), minlength=storage.shape[1])
 
         if verbose:
             logger.debug("cosine avg -> storage weights: %s" % (storage[-1],))
@@ -510,28 +489,19 @@ class Profile:
 
         # logger.debug(self.proc.depth)
 
-        # insert created data into the self.proc arrays
-        last_depth = 0.0
-        for row in storage.T:
+        # skip smoothed samples above the surface
+        storage = np.compress(storage[0] >= 0.0, storage, axis=1)
 
-            # index of where the storage record falls
-            d_th = float(row[0])
-            if d_th < last_depth:
-                continue
-            last_depth = d_th
-            try:
-                z_bools = np.logical_and(self.proc_valid, self.proc.depth > d_th)
-                i = np.argwhere(z_bools)[0]
-            except IndexError:
-                i = zs.size
-
-            self.proc.depth = np.insert(self.proc.depth, i, d_th)
-            self.proc.source = np.insert(self.proc.source, i, Dicts.sources['smoothing'])
-            self.proc.flag = np.insert(self.proc.flag, i, Dicts.flags['valid'])
-            for j, name in enumerate(names):
-                setattr(self.proc, name, np.insert(getattr(self.proc, name), i, row[j + 1]))
+        # merge the created data into the self.proc arrays in a single pass:
+        # each smoothed sample goes before the first valid sample that is deeper (or at the end, if none)
+        valid_depth = np.where(self.proc_valid, self.proc.depth, -np.inf)
+        merge_idx = np.searchsorted(np.maximum.accumulate(valid_depth), storage[0], side='right')
 
-            # logger.debug(self.proc.depth)
+        self.proc.depth = np.insert(self.proc.depth, merge_idx, storage[0])
+        self.proc.source = np.insert(self.proc.source, merge_idx, Dicts.sources['smoothing'])
+        self.proc.flag = np.insert(self.proc.flag, merge_idx, Dicts.flags['valid'])
+        for j, name in enumerate(names):
+            setattr(self.proc, name, np.insert(getattr(self.proc, name), merge_idx, storage[j + 1]))
 
         # since we inserted new samples
         self.proc.num_samples = self.proc.depth.size
@@ -637,9 +607,9 @@ class Profile:
         else:
             latitude = self.meta.latitude
 
-        for count in range(self.data.num_samples):
-            self.data.sal[count] = Oc.sal(d=self.data.depth[count], speed=self.data.speed[count],
-                                          t=self.data.temp[count], lat=latitude)
+        self.data.sal[:self.data.num_samples] = Oc.sal(d=self.data.depth[:self.data.num_samples],
+                                                       speed=self.data.speed[:self.data.num_samples],
+                                                       t=self.data.temp[:self.data.num_samples], lat=latitude)
         self.modify_proc_info(Dicts.proc_import_infos['CALC_SAL'])
 
     def calc_dyn_height(self):
@@ -707,11 +677,10 @@ class Profile:
         else:
             latitude = self.meta.latitude
 
-        for count in range(self.data.num_samples):
-            self.data.speed[count] = Oc.speed(self.data.depth[count],
-                                              self.data.temp[count],
-                                              self.data.sal[count],
-                                              latitude)
+        self.data.speed[:self.data.num_samples] = Oc.speed(self.data.depth[:self.data.num_samples],
+                                                           self.data.temp[:self.data.num_samples],
+                                                           self.data.sal[:self.data.num_samples],
+                                                           latitude)
         self.modify_proc_info(Dicts.proc_import_infos['CALC_SPD'])
 
     def calc_proc_speed(self):
@@ -723,11 +692,10 @@ class Profile:
         else:
             latitude = self.meta.latitude
 
-        for count in range(self.proc.num_samples):
-            self.proc.speed[count] = Oc.speed(self.proc.depth[count],
-                                              self.proc.temp[count],
-                                              self.proc.sal[count],
-                                              latitude)
+        self.proc.speed[:self.proc.num_samples] = Oc.speed(self.proc.depth[:self.proc.num_samples],
+                                                           self.proc.temp[:self.proc.num_samples],
+                                                           self.proc.sal[:self.proc.num_samples],
+                                                           latitude)
         self.modify_proc_info(Dicts.proc_user_infos['RECALC_SPD'])
 
     def calc_attenuation(self, frequency, ph):
@@ -1219,8 +1187,12 @@ class Profile:
 
     # - thinning
 
-    def thin(self, tolerance):
-        """Thin the sis data"""
+    def thin(self, tolerance, max_samples: int | None = None):
+        """Thin the sis data
+
+        If max_samples is passed, the most significant samples are retained first, up to that number.
+        In such a case, the tolerance is only used as a lower bound for the retained deviations.
+        """
         # logger.info("thinning the sis samples")
 
         # if the profile is too short, we just pass it back
@@ -1239,43 +1211,81 @@ class Profile:
         #              % (self.sis.depth[self.sis_valid][idx_start],
         #                 self.sis.depth[self.sis_valid][idx_end],
         #                 self.sis.flag[self.sis_valid][idx_end]))
-        self.douglas_peucker_1d(idx_start, idx_end, tolerance=tolerance, data=flagged)
+        if max_samples is None:
+            self.douglas_peucker_1d(depth=self.sis.depth[self.sis_valid], speed=self.sis.speed[self.sis_valid],
+                                    start=idx_start, end=idx_end, tolerance=tolerance, data=flagged)
+        else:
+            self.douglas_peucker_1d_max_samples(depth=self.sis.depth[self.sis_valid],
+                                                speed=self.sis.speed[self.sis_valid],
+                                                start=idx_start, end=idx_end, tolerance=tolerance,
+                                                max_samples=max_samples, data=flagged)
         self.sis.flag[self.sis_valid] = flagged[:]
 
         # logger.info("thinned: %s" % self.sis.flag[self.sis_thinned].size)
         return True
 
-    def douglas_peucker_1d(self, start, end, tolerance, data):
-        """ Recursive implementation """
-        # logger.debug("dp: %s, %s" % (start, end))
+    @classmethod
+    def _max_deviation(cls, depth, speed, start, end) -> tuple[float, int]:
+        """Return the max deviation from the start-end segment and its index"""
+        if end - start < 2:
+            return 0.0, start
+
+        slope = (speed[end] - speed[start]) / (depth[end] - depth[start])
+
+        dist = np.abs(speed[start] + slope * (depth[start + 1:end] - depth[start]) - speed[start + 1:end])
+        dist[np.isnan(dist)] = 0.0
+        max_ind = int(np.argmax(dist))
+
+        return dist[max_ind], max_ind + start + 1
+
+    @classmethod
+    def douglas_peucker_1d(cls, depth, speed, start, end, tolerance, data):
+        """ Iterative implementation, using an explicit stack of segments to process """
+        stack = [(start, end)]
+        while stack:
+            start, end = stack.pop()
+            # logger.debug("dp: %s, %s" % (start, end))
+
+            # We always keep end points
+            data[start] = Dicts.flags['thin']
+            data[end] = Dicts.flags['thin']
+
+            max_dist, max_ind = cls._max_deviation(depth=depth, speed=speed, start=start, end=end)
+            if max_dist <= tolerance:
+                continue
+
+            data[max_ind] = Dicts.flags['thin']
+            # print(max_ind, max_dist, data[max_ind])
+            stack.append((max_ind, end))
+            stack.append((start, max_ind))
 
+    @classmethod
+    def douglas_peucker_1d_max_samples(cls, depth, speed, start, end, tolerance, max_samples, data):
+        """ Priority-queue implementation, splitting first the segments with the largest deviation
+
+        The outcome is the same as douglas_peucker_1d() when the thinned samples are fewer than max_samples.
+        """
         # We always keep end points
         data[start] = Dicts.flags['thin']
         data[end] = Dicts.flags['thin']
+        nr_samples = 2
 
-        slope = (self.sis.speed[self.sis_valid][end] - self.sis.speed[self.sis_valid][start]) / \
-                (self.sis.depth[self.sis_valid][end] - self.sis.depth[self.sis_valid][start])
+        queue = list()
 
-        max_dist = 0
-        max_ind = 0
-        for ind in range(start + 1, end):
-            dist = abs(self.sis.speed[self.sis_valid][start] +
-                       slope * (self.sis.depth[self.sis_valid][ind] - self.sis.depth[self.sis_valid][start]) -
-                       self.sis.speed[self.sis_valid][ind])
+        def push_segment(seg_start, seg_end):
+            seg_max_dist, seg_max_ind = cls._max_deviation(depth=depth, speed=speed, start=seg_start, end=seg_end)
+            if seg_max_dist > tolerance:
+                heapq.heappush(queue, (-seg_max_dist, seg_start, seg_end, seg_max_ind))
 
-            if dist > max_dist:
-                max_dist = dist
-                max_ind = ind
+        push_segment(start, end)
+        while queue and (nr_samples < max_samples):
+            _, start, end, max_ind = heapq.heappop(queue)
 
-        if max_dist <= tolerance:
-            return
-
-        else:
             data[max_ind] = Dicts.flags['thin']
-            # print(max_ind, max_dist, data[max_ind])
-            self.douglas_peucker_1d(start, max_ind, tolerance, data=data)
-            self.douglas_peucker_1d(max_ind, end, tolerance, data=data)
-            return
+            nr_samples += 1
+
+            push_segment(start, max_ind)
+            push_segment(max_ind, end)
 
     # - debugging
 
@@ -1364,7 +1374,7 @@ class Profile:
 
         return cast_speed
 
-    def compute_ray_paths(self, draft, thetas_deg, travel_times=None, res=.005, b_project=False):
+    def compute_ray_paths(self, draft, thetas_deg, travel_times=None, res=.005, b_project=False, use_cache=True):
         """Returns a RayPath object for each launch angle."""
         if not draft or draft == 'Unknown':
             draft = 0.0
@@ -1373,42 +1383,50 @@ class Profile:
 
         depths = self.proc.depth[self.proc_dqa_valid] - draft
         speeds = self.proc.speed[self.proc_dqa_valid]
+        if travel_times is not None:
+            travel_times = np.array(travel_times)
 
         ray_paths = []
         for launch in thetas_deg:
 
-            params = RayTracing.get_svp_layer_parameters(np.deg2rad(launch), depths, speeds)
-            if travel_times is None:
-                tt = np.arange(res, params[-2][-1], res)  # make travel_times to reach end of profile
-            else:
-                tt = np.array(travel_times)
+            # retrieve the ray path if this profile was already traced with the same parameters
+            data = None
+            if use_cache:
+                key = ray_cache.make_key(depths, speeds, draft=draft, launch=float(launch), travel_times=travel_times,
+                                         res=res, b_project=b_project)
+                data = ray_cache.get(key)
+
+            if data is None:
+                params = RayTracing.get_svp_layer_parameters(np.deg2rad(launch), depths, speeds)
+                if travel_times is None:
+                    tt = np.arange(res, params[-2][-1], res)  # make travel_times to reach end of profile
+                else:
+                    tt = travel_times
 
-            rays = RayTracing.ray_trace(tt, depths, speeds, params, b_project=b_project)
-            rays[:, 0] += draft
+                rays = RayTracing.ray_trace(tt, depths, speeds, params, b_project=b_project)
+                rays[:, 0] += draft
 
-            ray_paths.append(RayPath(np.vstack((tt, rays.transpose())).transpose()))
+                data = np.vstack((tt, rays.transpose())).transpose()
+                if use_cache:
+                    ray_cache.put(key, data)
 
-        return ray_paths
+            ray_paths.append(RayPath(data.copy()))
 
-    def compare_profile(self, profile, angle):
+        return ray_paths
 
-        dep_max = min(self.proc.depth[self.proc_dqa_valid].max(), profile.proc.depth[profile.proc_dqa_valid].max())
+    @classmethod
+    def dqa_travel_time_increment(cls, dep_max: float) -> float:
+        """Travel time increment in seconds used to compare two casts down to the passed depth"""
         if dep_max <= 400:
-            tt_inc = 0.002  # Travel time increment in seconds.
+            return 0.002
         elif dep_max <= 800:
-            tt_inc = 0.005
+            return 0.005
         else:
-            tt_inc = 0.01
-
-        # TODO: Retrieve drafts
-        draft1 = 0.0
-        draft2 = 0.0
-        draft = max(draft1, draft2)
-
-        # Generate the travel timetable for the two profiles.
-        ray1 = self.compute_ray_paths(draft, [angle], res=tt_inc)[0]
-        ray2 = profile.compute_ray_paths(draft, [angle], res=tt_inc)[0]
+            return 0.01
 
+    @classmethod
+    def dqa_depth_diff(cls, ray1: RayPath, ray2: RayPath) -> dict:
+        """Percentage depth differences between two ray paths at the same travel times"""
         nr_points = min(len(ray1.data), len(ray2.data))
         if nr_points == 0:
             raise RuntimeError("One of the two profiles is too shallow!")
@@ -1420,9 +1438,58 @@ class Profile:
         pct_diff = np.absolute(delta_depth / larger_depths) * 100.0
         # noinspection PyUnresolvedReferences
         max_diff_index = pct_diff.argmax()
-        # noinspection PyUnresolvedReferences
-        max_diff = pct_diff[max_diff_index]
-        max_diff_depth = larger_depths[max_diff_index]
+
+        return {
+            'nr_points': nr_points,
+            'delta_depth': delta_depth,
+            'larger_depths': larger_depths,
+            'pct_diff': pct_diff,
+            'max_diff_index': max_diff_index,
+            'max_diff': pct_diff[max_diff_index],
+            'max_diff_depth': larger_depths[max_diff_index],
+        }
+
+    @classmethod
+    def dqa_compare_with_ray(cls, profile: 'Profile', ref_ray: RayPath, angle: float, draft: float,
+                             tt_inc: float) -> dict:
+        """Compare a profile with the ray path already traced for the reference cast
+
+        Used by the batch DQA (also from worker processes): return the scalar results or the error message."""
+        try:
+            ray = profile.compute_ray_paths(draft, [angle], res=tt_inc)[0]
+            diff = cls.dqa_depth_diff(ref_ray, ray)
+
+        except (RuntimeError, ValueError) as e:
+            return {'max_diff': np.nan, 'max_diff_depth': np.nan, 'passed': False, 'error': "%s" % e}
+
+        return {
+            'max_diff': float(diff['max_diff']),
+            'max_diff_depth': float(diff['max_diff_depth']),
+            'passed': bool(diff['max_diff'] <= cls.DQA_MAX_PCT_DEPTH_DIFF),
+            'error': None
+        }
+
+    def compare_profile(self, profile, angle):
+
+        dep_max = min(self.proc.depth[self.proc_dqa_valid].max(), profile.proc.depth[profile.proc_dqa_valid].max())
+        tt_inc = self.dqa_travel_time_increment(dep_max)  # Travel time increment in seconds.
+
+        # TODO: Retrieve drafts
+        draft1 = 0.0
+        draft2 = 0.0
+        draft = max(draft1, draft2)
+
+        # Generate the travel timetable for the two profiles.
+        ray1 = self.compute_ray_paths(draft, [angle], res=tt_inc)[0]
+        ray2 = profile.compute_ray_paths(draft, [angle], res=tt_inc)[0]
+
+        diff = self.dqa_depth_diff(ray1, ray2)
+        nr_points = diff['nr_points']
+        delta_depth = diff['delta_depth']
+        pct_diff = diff['pct_diff']
+        max_diff_index = diff['max_diff_index']
+        max_diff = diff['max_diff']
+        max_diff_depth = diff['max_diff_depth']
 
         # create output message
 
@@ -1471,7 +1538,7 @@ class Profile:
 
         msg += '<br>%s%s%s<br>' % (p1, time.ctime(), p2)
 
-        if max_diff > 0.25:
+        if max_diff > self.DQA_MAX_PCT_DEPTH_DIFF:
             msg += "%s<b>RESULTS INDICATE PROBLEM.</b>%s" % (p1, p2)
             msg += "%sThe absolute value of percent depth difference exceeds the recommended amount (.25).%s" % (p1, p2)
             msg += "%sIf test was conducted to compare 2 casts for possible grouping into one representative%s" \
@@ -26,93 +26,53 @@ class DiffTracedProfiles:
         if self.new_tp is None:
             raise RuntimeError("first set the new traced profile")
 
-        for ang in range(len(self.new_tp.rays)):
-            # logger.info("[angle: %d]" % ang)
-            ray_new = self.new_tp.rays[ang]
-            ray_old = self.old_tp.rays[ang]
-
-            new_t = list()
-            new_x = list()
-            new_z = list()
-
-            old_t = list()
-            old_x = list()
-            old_z = list()
-
-            init_done = False
-            init_new_t = None
-            init_new_x = None
-            init_new_z = None
-            init_old_t = None
-            init_old_x = None
-            init_old_z = None
-
-            # first retrieve common areas for both profiles (and reset the 0 values)
-            for idx in range(len(ray_new[0])):
-
-                if np.isnan(ray_new[0][idx]):
-                    continue
-                if np.isnan(ray_old[0][idx]):
-                    continue
-
-                if not init_done:
-                    # logger.debug("begin z: %s/%s" % (ray_new[2][idx], ray_old[2][idx]))
-                    init_new_t = ray_new[0][idx]
-                    init_new_x = ray_new[1][idx]
-                    init_new_z = ray_new[2][idx]
-                    init_old_t = ray_old[0][idx]
-                    init_old_x = ray_old[1][idx]
-                    init_old_z = ray_old[2][idx]
-                    init_done = True
-
-                new_t.append(ray_new[0][idx] - init_new_t)
-                new_x.append(ray_new[1][idx] - init_new_x)
-                new_z.append(ray_new[2][idx] - init_new_z)
-
-                old_t.append(ray_old[0][idx] - init_old_t)
-                old_x.append(ray_old[1][idx] - init_old_x)
-                old_z.append(ray_old[2][idx] - init_old_z)
-
-            # logger.debug("end z: %s/%s" % (new_z[-1], old_z[-1]))
-
-            if (len(new_t) == 0) or (len(old_t) == 0):
-                self.new_rays.append(np.array([list(), list(), list()]))
-                self.old_rays.append(np.array([list(), list(), list()]))
-                return
-
-            new_is_longer = False
-            min_time = new_t[-1]
-            if new_t[-1] > old_t[-1]:
-                min_time = old_t[-1]
-                new_is_longer = True
-            # logger.debug("new is longer: %s" % new_is_longer)
-            # logger.debug("min time: %s" % min_time)
-
-            n_t = list()
-            n_x = list()
-            n_z = list()
-
-            # stop to the minimum common time
-            for idx in range(len(new_t)):
-                if new_t[idx] > min_time:
-                    break
-
-                n_t.append(new_t[idx])
-                n_x.append(new_x[idx])
-                n_z.append(new_z[idx])
-
-            o_t = list()
-            o_x = list()
-            o_z = list()
-
-            # stop to the minimum common time
-            for idx in range(len(old_t)):
-                if old_t[idx] > min_time:
-                    break
-
-                o_t.append(old_t[idx])
-                o_x.append(old_x[idx])
-                o_z.append(old_z[idx])
-
-            self.new_rays.append(np.array([n_t, n_x, n_z]))
-            self.old_rays.append(np.array([o_t, o_x, o_z]))
+        self.new_rays = list()
+        self.old_rays = list()
+        nr_rays = min(self.new_tp.nr_rays, self.old_tp.nr_rays)
+
+        # retrieve the grid samples covered by both the traced profiles
+        if not np.array_equal(self.new_tp.ray_grid, self.old_tp.ray_grid):
+            raise RuntimeError("the traced profiles have different interpolation grids")
+        new_slice = self.new_tp.ray_slice
+        old_slice = self.old_tp.ray_slice
+        start = max(new_slice.start, old_slice.start)
+        stop = min(new_slice.stop, old_slice.stop)
+        if stop <= start:
+            for _ in range(nr_rays):
+                self.new_rays.append(np.empty((3, 0)))
+                self.old_rays.append(np.empty((3, 0)))
+            return
+
+        z = self.new_tp.ray_grid[start:stop]
+        new_t = self.new_tp.ray_t[:nr_rays, start - new_slice.start:stop - new_slice.start].astype(np.float64)
+        new_x = self.new_tp.ray_x[:nr_rays, start - new_slice.start:stop - new_slice.start].astype(np.float64)
+        old_t = self.old_tp.ray_t[:nr_rays, start - old_slice.start:stop - old_slice.start].astype(np.float64)
+        old_x = self.old_tp.ray_x[:nr_rays, start - old_slice.start:stop - old_slice.start].astype(np.float64)
+
+        # first retrieve common areas for both profiles (and reset the 0 values)
+        common = ~np.isnan(new_t) & ~np.isnan(old_t)
+        has_common = np.any(common, axis=1)
+        rays_idx = np.arange(nr_rays)
+        first = np.argmax(common, axis=1)
+        last = common.shape[1] - 1 - np.argmax(common[:, ::-1], axis=1)
+        new_t -= new_t[rays_idx, first][:, np.newaxis]
+        new_x -= new_x[rays_idx, first][:, np.newaxis]
+        old_t -= old_t[rays_idx, first][:, np.newaxis]
+        old_x -= old_x[rays_idx, first][:, np.newaxis]
+
+        # stop to the minimum common time
+        min_time = np.minimum(new_t[rays_idx, last], old_t[rays_idx, last])[:, np.newaxis]
+        new_kept = common & ~np.logical_or.accumulate(common & (new_t > min_time), axis=1)
+        old_kept = common & ~np.logical_or.accumulate(common & (old_t > min_time), axis=1)
+
+        for ang in range(nr_rays):
+            if not has_common[ang]:
+                self.new_rays.append(np.empty((3, 0)))
+                self.old_rays.append(np.empty((3, 0)))
+                continue
+
+            rel_z = z - z[first[ang]]
+            self.new_rays.append(np.array([new_t[ang, new_kept[ang]], new_x[ang, new_kept[ang]],
+                                           rel_z[new_kept[ang]]]))
+            self.old_rays.append(np.array([old_t[ang, old_kept[ang]], old_x[ang, old_kept[ang]],
+                                           rel_z[old_kept[ang]]]))
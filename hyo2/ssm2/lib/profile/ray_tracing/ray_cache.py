@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RayCache:
+    """Least-recently-used cache of ray-tracing results, bounded by the size of the stored arrays
+
+    The entries are keyed by a hash of the traced depth/speed arrays and of the tracing parameters, so that
+    the same cast traced again (e.g., by repeated DQA checks) is retrieved without tracing it.
+    The stored arrays are made read-only, since they are shared by all the callers."""
+
+    def __init__(self, max_size_mb: float = 128.0) -> None:
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def make_key(cls, depths: np.ndarray, speeds: np.ndarray, **params: Any) -> str:
+        """Hash the content of the passed arrays and parameters"""
+        h = hashlib.blake2b(digest_size=20)
+        for values in (depths, speeds):
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            h.update(("%s;" % (values.shape, )).encode())
+            h.update(values.tobytes())
+        for name in sorted(params):
+            value = params[name]
+            if isinstance(value, np.ndarray):
+                value = hashlib.blake2b(np.ascontiguousarray(value).tobytes(), digest_size=20).hexdigest()
+            h.update(("%s=%r;" % (name, value)).encode())
+        return h.hexdigest()
+
+    @classmethod
+    def entry_size(cls, entry: Any) -> int:
+        if isinstance(entry, np.ndarray):
+            return entry.nbytes
+        if isinstance(entry, dict):
+            return sum(cls.entry_size(value) for value in entry.values())
+        if isinstance(entry, (list, tuple)):
+            return sum(cls.entry_size(value) for value in entry)
+        return 64
+
+    @classmethod
+    def _set_read_only(cls, entry: Any) -> None:
+        if isinstance(entry, np.ndarray):
+            entry.flags.writeable = False
+        elif isinstance(entry, dict):
+            for value in entry.values():
+                cls._set_read_only(value)
+        elif isinstance(entry, (list, tuple)):
+            for value in entry:
+                cls._set_read_only(value)
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, entry: Any) -> None:
+        size = self.entry_size(entry)
+        if size > self.max_size:
+            logger.debug("skipping too large entry: %.1f MB" % (size / (1024 * 1024)))
+            return
+
+        self._set_read_only(entry)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (entry, size)
+            self._size += size
+
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size_mb(self) -> float:
+        return self._size / (1024 * 1024)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        msg = "<%s>\n" % self.__class__.__name__
+
+        msg += "  <entries: %d>\n" % len(self)
+        msg += "  <size: %.1f/%.1f MB>\n" % (self.size_mb, self.max_size / (1024 * 1024))
+        msg += "  <hits: %d, misses: %d>\n" % (self.hits, self.misses)
+
+        return msg
+
+
+ray_cache = RayCache()
@@ -9,7 +9,56 @@ class RayTracing:
 
     @classmethod
     def get_svp_layer_parameters(cls, launch_angle_radians, depths, speeds):
-        return cls.get_svp_layer_parameters_slow(launch_angle_radians, depths, speeds)
+        return cls.get_svp_layer_parameters_fast(launch_angle_radians, depths, speeds)
+
+    @classmethod
+    def get_svp_layer_parameters_fast(cls, launch_angle_radians, depths, speeds):
+        """Vectorized version of get_svp_layer_parameters_slow()"""
+
+        speed = np.array(speeds, np.float64).ravel()  # need double precision for this computation
+        depth = np.array(depths, np.float64).ravel()
+
+        depth[0] = 0.0  # assume zero for top layer
+
+        radius = np.zeros(depth.shape, np.float64)
+        total_time = np.zeros(depth.shape, np.float64)
+        total_range = np.zeros(depth.shape, np.float64)
+
+        delta_depth = np.diff(depth)
+        gradient = np.diff(speed) / delta_depth
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            # Snell's law: sin(gamma) / speed is constant along the ray
+            gamma = arcsin(sin(launch_angle_radians) * speed / speed[0])
+            gamma[0] = launch_angle_radians
+            gamma[np.logical_or.accumulate(np.isnan(gamma))] = np.nan  # beyond the critical angle
+
+            gamma_top = gamma[:-1]
+            gamma_bottom = gamma[1:]
+            speed_top = speed[:-1]
+            speed_bottom = speed[1:]
+
+            is_nadir = gamma_top == 0  # nadir beam (could cause division by zero errors below)
+            is_straight = np.logical_and(~is_nadir, gradient == 0)
+            is_curved = np.logical_and(~is_nadir, ~is_straight)
+
+            layer_radius = np.where(is_curved, speed_top / (gradient * sin(gamma_top)), 0.0)
+            layer_time = np.where(is_nadir, delta_depth / ((speed_bottom + speed_top) / 2.0),
+                                  np.where(is_straight, delta_depth / (speed_top * cos(gamma_top)),
+                                           log(tan(gamma_bottom / 2.0) / tan(gamma_top / 2.0)) / gradient))
+            layer_range = np.where(is_nadir, 0.0,
+                                   np.where(is_straight, delta_depth * tan(gamma_top),
+                                            layer_radius * (cos(gamma_top) - cos(gamma_bottom))))
+
+        radius[:-1] = layer_radius
+        total_time[1:] = np.cumsum(layer_time)
+        total_range[1:] = np.cumsum(layer_range)
+
+        # Note the last radius doesn't get computed but that isn't important
+        # we always want to be in the last layer, so we use the computations at the next to last layer
+        # and interpolate to the depth/time which is before the end of the last layer
+        return gradient, gamma, radius, total_time, total_range
 
     @classmethod
     def get_svp_layer_parameters_slow(cls, launch_angle_radians, depths, speeds):
@@ -54,6 +103,76 @@ class RayTracing:
 
     @classmethod
     def ray_trace(cls, travel_times, depths, speeds, params, b_project=False):
+        return cls.ray_trace_fast(travel_times, depths, speeds, params, b_project=b_project)
+
+    @classmethod
+    def ray_trace_fast(cls, travel_times, depths, speeds, params, b_project=False):
+        """Vectorized version of ray_trace_slow(), all the travel times are traced at once"""
+
+        nr_layers = len(depths) - 1
+
+        speed = np.array(speeds, np.float64).ravel()
+        depth = np.array(depths, np.float64).ravel()
+        depth[0] = 0.0  # assume zero for top layer
+
+        gradient, gamma, radius, total_time, total_range = params
+        travel_times = np.atleast_1d(np.asarray(travel_times, np.float64))
+
+        ret = np.zeros([len(travel_times), 2]) - 1.0  # create an array where -1 denotes out of range
+
+        nr_end_layers = total_time.searchsorted(travel_times) - 1
+        nr_end_layers[nr_end_layers == -1] = 0
+        if b_project:
+            in_range = np.ones(len(travel_times), dtype=bool)
+        else:
+            in_range = nr_end_layers < nr_layers  # SVP deep enough
+
+        end_layer = nr_end_layers[in_range]
+        tt = travel_times[in_range]
+        tau = tt - total_time[end_layer]
+
+        final_depth = np.zeros(len(tt))
+        final_range = np.zeros(len(tt))
+
+        # straight rays (nadir or zero gradient): use the average speed in the layer
+        is_straight = radius[end_layer] == 0
+        straight_layer = end_layer[is_straight]
+        end_speed = speed[straight_layer].copy()  # projecting the last speed to infinite depth
+        is_inner = straight_layer < nr_layers
+        if is_inner.any():
+            inner_layer = straight_layer[is_inner]
+            inner_tt = tt[is_straight][is_inner]
+            a1 = total_time[inner_layer]
+            a2 = total_time[inner_layer + 1]
+            a3 = speed[inner_layer]
+            a4 = speed[inner_layer + 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inner_speed = (a4 - a3) / (a2 - a1) * (inner_tt - a1) + a3
+            inner_speed = np.where(inner_tt <= a1, a3, inner_speed)
+            inner_speed = np.where(inner_tt >= a2, a4, inner_speed)
+            end_speed[is_inner] = inner_speed
+        avg_speed = (speed[straight_layer] + end_speed) / 2.0
+        straight_tau = tau[is_straight]
+        final_depth[is_straight] = avg_speed * straight_tau * cos(gamma[straight_layer]) + depth[straight_layer]
+        final_range[is_straight] = avg_speed * straight_tau * sin(gamma[straight_layer]) + total_range[straight_layer]
+
+        # curved rays
+        is_curved = ~is_straight
+        curved_layer = end_layer[is_curved]
+        curved_radius = radius[curved_layer]
+        curved_gamma = gamma[curved_layer]
+        end_gamma = 2 * arctan(tan(curved_gamma / 2.0) * exp(gradient[curved_layer] * tau[is_curved]))
+        final_depth[is_curved] = curved_radius * (sin(end_gamma) - sin(curved_gamma)) + depth[curved_layer]
+        final_range[is_curved] = curved_radius * (-cos(end_gamma) + cos(curved_gamma)) + total_range[curved_layer]
+
+        # this would translate to across-track, along-track components if we passed in pitch, roll, launch angle
+        ret[in_range, 0] = final_depth
+        ret[in_range, 1] = final_range
+
+        return ret
+
+    @classmethod
+    def ray_trace_slow(cls, travel_times, depths, speeds, params, b_project=False):
 
         nr_layers = len(depths) - 1
 
@@ -5,6 +5,8 @@ from typing import TYPE_CHECKING
 import numpy as np
 from scipy.interpolate import interp1d
 
+from hyo2.ssm2.lib.profile.ray_tracing.ray_cache import ray_cache
+
 if TYPE_CHECKING:
     from hyo2.ssm2.lib.profile.profile import Profile
 
@@ -13,176 +15,210 @@ logger = logging.getLogger(__name__)
 
 class TracedProfile:
 
+    decimetric_grid = np.linspace(0, 5000, num=25001, endpoint=True)
+
     def __init__(self, ssp: 'Profile', half_swath: float = 65.0, avg_depth: float = 10000.0,
-                 tss_depth: float | None = None, tss_value: float | None = None, verbose: bool = False) -> None:
+                 tss_depth: float | None = None, tss_value: float | None = None, verbose: bool = False,
+                 interp_z: np.ndarray | None = None, use_cache: bool = True) -> None:
 
         self.avg_depth = avg_depth
         self.half_swath = half_swath
 
         # select samples for the ray tracing (must be deeper than the transducer depth)
-        depths = list()
-        speeds = list()
-        if (tss_depth is not None) and (tss_value is not None):
-            depths.append(tss_depth)
-            speeds.append(tss_value)
-
         vi = ssp.proc_valid
+        depths = ssp.proc.depth[vi]
+        speeds = ssp.proc.speed[vi]
 
-        for z_idx in range(0, len(ssp.proc.depth[vi])):
-
-            # skip samples at depth less than the draft
-            if tss_depth is not None:
-                if ssp.proc.depth[vi][z_idx] <= tss_depth:
-                    # logger.debug("skipping sample at depth: %.1f" % ssp.proc.depth[z_idx])
-                    continue
+        # skip samples at depth less than the draft
+        if tss_depth is not None:
+            deeper = depths > tss_depth
+            depths = depths[deeper]
+            speeds = speeds[deeper]
 
-            depths.append(ssp.proc.depth[vi][z_idx])
-            speeds.append(ssp.proc.speed[vi][z_idx])
+        # stop after the first sample deeper than the avg depth (safer)
+        too_deep = np.nonzero(depths > self.avg_depth)[0]
+        if too_deep.size > 0:
+            depths = depths[:too_deep[0] + 1]
+            speeds = speeds[:too_deep[0] + 1]
 
-            # stop after the first sample deeper than the avg depth (safer)
-            if ssp.proc.depth[vi][z_idx] > self.avg_depth:
-                break
+        if (tss_depth is not None) and (tss_value is not None):
+            depths = np.concatenate(([tss_depth], depths))
+            speeds = np.concatenate(([tss_value], speeds))
 
         # remove extension value (if any)
         if len(depths) > 3:
             if (depths[-1] - depths[-2]) > 1000:
                 logger.info("removed latest extension depth: %s" % depths[-1])
-                del depths[-1]
+                depths = depths[:-1]
+                speeds = speeds[:-1]
+
+        if len(depths) == 0:
+            raise RuntimeError("invalid profile with zero valid depth values")
 
         if verbose:
             logger.info("profile timestamp: %s" % ssp.meta.utc_time)
             logger.debug("valid samples: %d" % (len(depths)), )
             logger.debug("depth: min %.2f, max %.2f" % (depths[0], depths[-1]))
-            # logger.debug("depths: %s" % depth)
-            # logger.debug("speeds: %s" % speed)
-
-        # ray-trace a few angles (ref: Lurton, An Introduction to UA, p.50-52)
-        self.rays = list()
-        self.harmonic_means = list()
-        for angle in np.arange(0, int(math.ceil(self.half_swath + 1))):
-
-            # ray angles
-            beta = list()
-            beta.append(math.radians(90.0 - angle))
-            total_z = list()
-            total_z.append(depths[0])
-            total_x = list()
-            total_x.append(0)
-            total_t = list()  # total travel time
-            total_t.append(0)
-
-            # logger.debug("angle %d: beta0 %s" % (angle, math.degrees(beta[0])))
-
-            for idx in range(len(depths) - 1):
-
-                # calculate delta (next - current)
-                dz = depths[idx + 1] - depths[idx]
-                dc = speeds[idx + 1] - speeds[idx]
-                # logger.debug("%s: dy %s, dc %s" % (x, dy, dc))
-
-                if dc == 0:  # "constant speed" case: no curvature
-
-                    if dz == 0:  # if (dc == 0) and (dy == 0):
-
-                        # logger.debug("duplicated point: #%d" % idx)
-                        beta.append(beta[idx])  # beta does not change
-                        continue
-
-                    # gradient = dc/dy
-                    beta.append(beta[idx])  # beta does not change
-                    dx = dz / (math.tan(beta[idx + 1]))  # no curvature!
-                    dt = (((dx ** 2) + (dz ** 2)) ** .5) / speeds[idx + 1]
-
-                elif dz == 0:  # "same depth" case: just adjust the ray angle
-
-                    beta.append(math.acos((speeds[idx + 1] / speeds[idx]) * (math.cos(beta[idx]))))
-                    continue
-
-                else:  # if (dc != 0) and (dz != 0):
-
-                    gradient = dc / dz  # Lurton, (2.64)
-                    if math.cos(beta[idx]) == 0:
-                        curve = 0
-                    else:  # if math.cos(beta[x]) != 0:
-                        curve = speeds[idx] / (gradient * math.cos(beta[idx]))  # Lurton, (2.66)
-
-                    beta_cos = speeds[idx + 1] * (math.cos(beta[idx])) / speeds[idx]
-                    if beta_cos > 1.0:
-                        logger.warning("angle %d, sample %d -> invalid beta cos: %s" %
-                                       (angle, idx, beta_cos))
-                        beta_cos = 1.0
-                    if beta_cos < -1.0:
-                        logger.warning("angle %d, sample %d -> invalid beta cos: %s" %
-                                       (angle, idx, beta_cos))
-                        beta_cos = -1.0
-
-                    beta.append(math.acos(beta_cos))  # Derived from Lurton, (2.65)
-
-                    dx = curve * ((math.sin(beta[idx])) - (math.sin(beta[idx + 1])))  # Lurton, (2.67)
-                    dt = abs((1 / gradient) *
-                             math.log(
-                                 (speeds[idx + 1] / speeds[idx]) *
-                                 (abs((1 + math.sin(beta[idx])) / (1 + math.sin(beta[idx + 1]))))))  # Lurton, (2.70)
-
-                total_z.append(total_z[-1] + dz)
-                total_x.append(total_x[-1] + dx)
-                total_t.append(total_t[-1] + dt)
-
-            # logger.debug("z:\n%s" % total_z)
-            # logger.debug("x:\n%s" % total_x)
-            # logger.debug("t:\n%s" % total_t)
-
-            if len(depths) > 1:
-                harm_mean = (total_z[-1] - total_z[0]) / (total_t[-1] - total_t[0])
-            elif len(depths) == 1:
-                harm_mean = speeds[0]
-            else:
-                raise RuntimeError("invalid profile with zero valid depth values")
-            self.harmonic_means.append(harm_mean)
-
-            # interpolate between 0 and 5000 meters with decimetric resolution
-            if len(depths) > 1:
-                interp_z = np.linspace(0, 5000, num=25001, endpoint=True)
-                fx = interp1d(total_z, total_x, kind='cubic', bounds_error=False, fill_value=np.nan)
-                interp_x = fx(interp_z)
-                ft = interp1d(total_z, total_t, kind='cubic', bounds_error=False, fill_value=np.nan)
-                interp_t = ft(interp_z)
-            elif len(depths) == 1:
-                interp_z = total_z
-                interp_x = total_x
-                interp_t = total_t
-            else:
-                raise RuntimeError("invalid profile with zero valid depth values")
 
-            self.rays.append(np.array([interp_t, interp_x, interp_z]))
+        # ray-trace a few angles (ref: Lurton, An Introduction to UA, p.50-52), unless already traced
+        angles = np.arange(0, int(math.ceil(self.half_swath + 1)))
+        if interp_z is None:
+            interp_z = self.decimetric_grid
+        else:
+            interp_z = np.array(interp_z, dtype=np.float64)
+        traced = None
+        if use_cache:
+            key = ray_cache.make_key(depths, speeds, angles=angles, interp_z=interp_z)
+            traced = ray_cache.get(key)
+        if traced is None:
+            traced = self.trace_rays(depths=depths, speeds=speeds, angles=angles, interp_z=interp_z)
+            if use_cache:
+                ray_cache.put(key, traced)
+
+        self.harmonic_means = list(traced['harmonic_means'])
+        # compact storage of the rays: float32 values, limited to the depths covered by the profile
+        self.ray_grid = traced['ray_grid']
+        self.ray_slice = slice(traced['start'], traced['stop'])
+        self.ray_t = traced['ray_t']
+        self.ray_x = traced['ray_x']
 
         if verbose:
-            logger.debug("rays: %d (%d samples per-ray)" % (len(self.rays), len(self.rays[0][0])))
+            logger.debug("rays: %d (%d valid samples per-ray)" % (self.nr_rays, self.ray_t.shape[1]))
         self.date_time = ssp.meta.utc_time
         self.latitude = ssp.meta.latitude
         self.longitude = ssp.meta.longitude
         self.data = [depths, speeds]
 
+    @property
+    def nr_rays(self) -> int:
+        return self.ray_t.shape[0]
+
+    def ray(self, ray_idx: int) -> np.ndarray:
+        """Resample a ray onto the whole interpolation grid, as a [t, x, z] array (NaN where not covered)"""
+        interp_t = np.full(len(self.ray_grid), np.nan)
+        interp_t[self.ray_slice] = self.ray_t[ray_idx]
+        interp_x = np.full(len(self.ray_grid), np.nan)
+        interp_x[self.ray_slice] = self.ray_x[ray_idx]
+        return np.array([interp_t, interp_x, self.ray_grid])
+
+    @property
+    def rays(self) -> list[np.ndarray]:
+        """All the rays resampled onto the whole interpolation grid (created at each call)"""
+        return [self.ray(ray_idx) for ray_idx in range(self.nr_rays)]
+
+    @classmethod
+    def trace_rays(cls, depths: np.ndarray, speeds: np.ndarray, angles: np.ndarray, interp_z: np.ndarray) -> dict:
+        """Trace the passed launch angles, and interpolate the rays on the depths of the passed grid"""
+        total_z, total_x, total_t = cls.trace_angles(depths=depths, speeds=speeds, angles=angles)
+
+        if len(depths) > 1:
+            harmonic_means = (total_z[-1] - total_z[0]) / (total_t[:, -1] - total_t[:, 0])
+
+            # only the depths covered by the profile are interpolated, since all the others are out of bounds
+            start = int(np.searchsorted(interp_z, total_z.min(), side='left'))
+            stop = int(np.searchsorted(interp_z, total_z.max(), side='right'))
+            if stop > start:
+                fx = interp1d(total_z, total_x, kind='cubic', axis=1, bounds_error=False, fill_value=np.nan)
+                interp_x = fx(interp_z[start:stop])
+                ft = interp1d(total_z, total_t, kind='cubic', axis=1, bounds_error=False, fill_value=np.nan)
+                interp_t = ft(interp_z[start:stop])
+            else:
+                interp_x = np.empty((len(angles), 0))
+                interp_t = np.empty((len(angles), 0))
+
+        else:
+            harmonic_means = np.full(len(angles), speeds[0])
+            interp_z = total_z
+            start = 0
+            stop = 1
+            interp_x = total_x
+            interp_t = total_t
+
+        return {
+            'harmonic_means': harmonic_means,
+            'ray_grid': interp_z,
+            'start': start,
+            'stop': stop,
+            'ray_t': interp_t.astype(np.float32),
+            'ray_x': interp_x.astype(np.float32),
+        }
+
+    @classmethod
+    def trace_angles(cls, depths: np.ndarray, speeds: np.ndarray, angles: np.ndarray) \
+            -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Trace all the launch angles (in degrees from nadir) at once through the passed layers
+
+        Return the depths of the layer boundaries, and the cumulated horizontal distances and travel times
+        as (angle x boundary) arrays. Duplicated and same-depth samples only adjust the ray angle."""
+        depths = np.asarray(depths, dtype=float)
+        speeds = np.asarray(speeds, dtype=float)
+        angles = np.atleast_1d(np.asarray(angles, dtype=float))
+
+        # ray angles with Snell's law: the cosine is clipped at 1.0 (horizontal ray) and the ray restarts from
+        # there, so the scale is given by the largest unclipped value met up to each sample
+        beta_cos = np.cos(np.radians(90.0 - angles))[:, np.newaxis] * (speeds / speeds[0])[np.newaxis, :]
+        scale = np.maximum.accumulate(np.maximum(beta_cos, 1.0), axis=1)
+        nr_clipped = np.count_nonzero(np.diff(scale, axis=1) > 0.0, axis=1)
+        for angle_idx in np.nonzero(nr_clipped)[0]:
+            logger.warning("angle %d -> invalid beta cos: %d samples" % (angles[angle_idx], nr_clipped[angle_idx]))
+        beta = np.arccos(beta_cos / scale)  # Derived from Lurton, (2.65)
+        sin_beta = np.sin(beta)
+
+        # calculate delta (next - current)
+        dz = np.diff(depths)
+        dc = np.diff(speeds)
+        dx = np.zeros((len(angles), len(dz)))
+        dt = np.zeros((len(angles), len(dz)))
+
+        # "constant speed" case: no curvature
+        straight = (dc == 0) & (dz != 0)
+        if np.any(straight):
+            dx_s = dz[straight] / np.tan(beta[:, 1:][:, straight])
+            dx[:, straight] = dx_s
+            dt[:, straight] = np.sqrt(dx_s ** 2 + dz[straight] ** 2) / speeds[1:][straight]
+
+        curved = (dc != 0) & (dz != 0)
+        if np.any(curved):
+            gradient = dc[curved] / dz[curved]  # Lurton, (2.64)
+            c0 = speeds[:-1][curved]
+            c1 = speeds[1:][curved]
+            cos_b0 = beta_cos[:, :-1][:, curved] / scale[:, :-1][:, curved]
+            sin_b0 = sin_beta[:, :-1][:, curved]
+            sin_b1 = sin_beta[:, 1:][:, curved]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                curve = np.where(cos_b0 == 0, 0.0, c0 / (gradient * cos_b0))  # Lurton, (2.66)
+            dx[:, curved] = curve * (sin_b0 - sin_b1)  # Lurton, (2.67)
+            dt[:, curved] = np.abs((1 / gradient) *
+                                   np.log((c1 / c0) * np.abs((1 + sin_b0) / (1 + sin_b1))))  # Lurton, (2.70)
+
+        # same-depth samples do not add a point to the rays
+        layer = dz != 0
+        total_z = np.cumsum(np.concatenate(([depths[0]], dz[layer])))
+        total_x = np.concatenate((np.zeros((len(angles), 1)), np.cumsum(dx[:, layer], axis=1)), axis=1)
+        total_t = np.concatenate((np.zeros((len(angles), 1)), np.cumsum(dt[:, layer], axis=1)), axis=1)
+
+        return total_z, total_x, total_t
+
     def debug_rays(self, ray_idx: int = 0) -> None:
-        nr_rays = len(self.rays)
+        nr_rays = self.nr_rays
         if (ray_idx < 0) or (ray_idx >= nr_rays):
             logger.warning("invalid ray index: %d (total rays: %d)" % (ray_idx, nr_rays))
             return
 
+        ray = self.ray(ray_idx)
         logger.debug("[%d]" % ray_idx)
         logger.debug("t      | x      | z     |")
-        for idx in range(len(self.rays[ray_idx][0])):
-            logger.debug("%10.4f %10.3f %10.2f" % (
-                float(self.rays[ray_idx][0][idx]),
-                float(self.rays[ray_idx][1][idx]),
-                float(self.rays[ray_idx][2][idx])))
+        for idx in range(len(ray[0])):
+            logger.debug("%10.4f %10.3f %10.2f" % (float(ray[0][idx]), float(ray[1][idx]), float(ray[2][idx])))
 
     def debug_plot(self, ray_idx: int = 0) -> None:
-        nr_rays = len(self.rays)
+        nr_rays = self.nr_rays
         if (ray_idx < 0) or (ray_idx >= nr_rays):
             logger.warning("invalid ray index: %d (total rays: %d)" % (ray_idx, nr_rays))
             return
 
+        ray = self.ray(ray_idx)
+
         from matplotlib import pyplot as plt
 
         plt.figure("Traced Profile", dpi=120)
@@ -194,13 +230,13 @@ class TracedProfile:
         plt.title('profile')
 
         plt.subplot(132)  # time
-        plt.plot(self.rays[ray_idx][0], self.rays[ray_idx][2])
+        plt.plot(ray[0], ray[2])
         plt.gca().invert_yaxis()
         plt.grid(True)
         plt.title('z vs. time')
 
         plt.subplot(133)  # x
-        plt.plot(self.rays[ray_idx][1], self.rays[ray_idx][2])
+        plt.plot(ray[1], ray[2])
         plt.gca().invert_yaxis()
         plt.grid(True)
         plt.title('z vs. x')
@@ -214,7 +250,7 @@ class TracedProfile:
         msg += "  <avg depth: %.3f>\n" % self.avg_depth
         msg += "  <half swatch: %.1f>\n" % self.half_swath
         msg += "  <profile valid samples: %d>\n" % len(self.data[0])
-        msg += "  <rays: %d>\n" % len(self.rays)
-        msg += "  <samples per ray: %d>\n" % len(self.rays[0][0])
+        msg += "  <rays: %d>\n" % self.nr_rays
+        msg += "  <samples per ray: %d (valid: %d)>\n" % (len(self.ray_grid), self.ray_t.shape[1])
 
         return msg
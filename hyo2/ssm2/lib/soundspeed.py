@@ -2,12 +2,14 @@ import copy
 import logging
 import os
 import re
-import shutil
+import tempfile
 import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import cast, TYPE_CHECKING
 
+import numpy as np
 from appdirs import user_data_dir
 
 # noinspection PyUnresolvedReferences
@@ -33,6 +35,8 @@ from hyo2.ssm2.lib.base.setup import Setup
 # noinspection PyUnresolvedReferences
 from hyo2.ssm2.lib.base.setup_db import SetupDb
 # noinspection PyUnresolvedReferences
+from hyo2.ssm2.lib.db.connection_manager import connection_manager
+# noinspection PyUnresolvedReferences
 from hyo2.ssm2.lib.db.db import ProjectDb
 # noinspection PyUnresolvedReferences
 from hyo2.ssm2.lib.db.export import ExportDbFields
@@ -565,41 +569,40 @@ class SoundSpeedLibrary:
         if self.ssp is None:
             raise RuntimeError("No ssp list set")
 
-        for pr in self.ssp.l:
-
-            if self.use_woa09() and self.has_woa09():
-                pr.woa09 = self.atlases.woa09.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                    datestamp=pr.meta.utc_time)
-
-            if self.use_woa13() and self.has_woa13():
-                pr.woa13 = self.atlases.woa13.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                    datestamp=pr.meta.utc_time)
-
-            if self.use_woa18() and self.has_woa18():
-                pr.woa18 = self.atlases.woa18.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                    datestamp=pr.meta.utc_time)
-
-            if self.use_woa23() and self.has_woa23():
-                pr.woa23 = self.atlases.woa23.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                    datestamp=pr.meta.utc_time)
-
-            if self.use_rtofs():
-                # noinspection PyBroadException
-                try:
-                    pr.rtofs = self.atlases.rtofs.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                        datestamp=pr.meta.utc_time)
-                except Exception:
-                    pr.rtofs = None
-                    logger.warning("unable to retrieve RTOFS data")
-
-            if self.use_gomofs():
-                # noinspection PyBroadException
-                try:
-                    pr.gomofs = self.atlases.gomofs.query(lat=pr.meta.latitude, lon=pr.meta.longitude,
-                                                          datestamp=pr.meta.utc_time)
-                except Exception:
-                    pr.gomofs = None
-                    logger.warning("unable to retrieve GOMOFS data")
+        # a single batch query for each atlas, so that the nearby casts share the data reads
+        lats = [pr.meta.latitude for pr in self.ssp.l]
+        lons = [pr.meta.longitude for pr in self.ssp.l]
+        datestamps = [pr.meta.utc_time for pr in self.ssp.l]
+
+        if self.use_woa09() and self.has_woa09():
+            for pr, woa09 in zip(self.ssp.l, self.atlases.woa09.query_many(lats=lats, lons=lons,
+                                                                            datestamps=datestamps)):
+                pr.woa09 = woa09
+
+        if self.use_woa13() and self.has_woa13():
+            for pr, woa13 in zip(self.ssp.l, self.atlases.woa13.query_many(lats=lats, lons=lons,
+                                                                            datestamps=datestamps)):
+                pr.woa13 = woa13
+
+        if self.use_woa18() and self.has_woa18():
+            for pr, woa18 in zip(self.ssp.l, self.atlases.woa18.query_many(lats=lats, lons=lons,
+                                                                            datestamps=datestamps)):
+                pr.woa18 = woa18
+
+        if self.use_woa23() and self.has_woa23():
+            for pr, woa23 in zip(self.ssp.l, self.atlases.woa23.query_many(lats=lats, lons=lons,
+                                                                            datestamps=datestamps)):
+                pr.woa23 = woa23
+
+        if self.use_rtofs():
+            for pr, rtofs in zip(self.ssp.l, self.atlases.rtofs.query_many(lats=lats, lons=lons,
+                                                                            datestamps=datestamps)):
+                pr.rtofs = rtofs
+
+        if self.use_gomofs():
+            for pr, gomofs in zip(self.ssp.l, self.atlases.gomofs.query_many(lats=lats, lons=lons,
+                                                                              datestamps=datestamps)):
+                pr.gomofs = gomofs
 
     # --- receive data
 
@@ -1128,24 +1131,16 @@ class SoundSpeedLibrary:
             # special case for Kongsberg asvp/ssp format
             if name == 'asvp/ssp':
 
-                tolerances = [0.01, 0.03, 0.06, 0.1, 0.5]
-                for tolerance in tolerances:
-
-                    if not self.prepare_sis(thin_tolerance=tolerance):
-                        logger.warning("issue in preparing the data for SIS")
-                        return None
-
-                    if self.cur is None:
-                        raise RuntimeError("cur not set")
-                    cur = cast(Profile, self.cur)
+                if not self.prepare_sis(thin_max_samples=Profile.MAX_SIS_SAMPLES):
+                    logger.warning("issue in preparing the data for SIS")
+                    return None
 
-                    si = cur.sis_thinned
-                    thin_profile_length = cur.sis.flag[si].size
-                    logger.debug("thin profile size: %d (with tolerance: %.3f)" % (thin_profile_length, tolerance))
-                    if thin_profile_length < 1000:
-                        break
+                if self.cur is None:
+                    raise RuntimeError("cur not set")
+                cur = cast(Profile, self.cur)
 
-                    logger.info("too many samples, attempting with a lower tolerance")
+                si = cur.sis_thinned
+                logger.debug("thin profile size: %d" % cur.sis.flag[si].size)
 
             # special case (currently only used for Fugro ISS)
             if name == 'ncei':
@@ -1216,7 +1211,9 @@ class SoundSpeedLibrary:
         if os.path.exists(new_db_path):
             raise RuntimeError("the project already exists: %s" % new_db_path)
 
-        shutil.copy(old_db_path, new_db_path)
+        # copied with the sqlite backup API, so that the content still in the WAL file of any open connection is kept
+        connection_manager.close(old_db_path)
+        ProjectDb.copy_db_file(db_path=old_db_path, copy_path=new_db_path)
         if not os.path.exists(new_db_path):
             raise RuntimeError("unable to copy the project db: %s" % new_db_path)
 
@@ -1224,6 +1221,7 @@ class SoundSpeedLibrary:
         self.save_settings_to_db()
         self.reload_settings_from_db()
 
+        connection_manager.close(old_db_path)
         os.remove(old_db_path)
 
     def remove_project(self, name: str) -> None:
@@ -1234,6 +1232,7 @@ class SoundSpeedLibrary:
         if not os.path.exists(db_path):
             raise RuntimeError("unable to locate the project to delete: %s" % db_path)
 
+        connection_manager.close(db_path)
         os.remove(db_path)
 
     def list_projects(self) -> list:
@@ -1336,63 +1335,88 @@ class SoundSpeedLibrary:
         return ssp
 
     def db_import_data_from_db(self, input_db_path: str) -> tuple:
-        """Import profiles from another db"""
-        in_projects_folder = os.path.dirname(input_db_path)
+        """Import profiles from another db, without modifying it"""
         in_project_name = os.path.splitext(os.path.basename(input_db_path))[0]
-        logger.debug('input: folder: %s, db: %s' % (in_projects_folder, in_project_name))
-
-        in_db = ProjectDb(projects_folder=in_projects_folder, project_name=in_project_name)
-
-        db_version = in_db.get_db_version()
-        if db_version is None:
-            raise RuntimeError("unretrievable db version")
-        if db_version > 3:
-            raise RuntimeError("unsupported db version: %s" % in_db.get_db_version())
-        logger.debug('input project db version: %s' % db_version)
-
-        cur_db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
-
-        in_lst = in_db.list_profiles()
-        cur_lst = cur_db.list_profiles()
-        logger.debug('profiles to import: %s' % len(in_lst))
-        logger.debug('current profiles: %s' % len(cur_lst))
-
-        # create list of current pks
-        cur_pks = list()  # type: list[str]
-        for cur_ssp in cur_lst:
-            cur_key = "%s;%s" % (cur_ssp[1], cur_ssp[2])
-            cur_pks.append(cur_key)
-        # print(cur_pks)
-
-        # copy after having checked that the profile is not already there
-        pk_issues = list()
-        pk_done = list()
-
-        for in_ssp in in_lst:
-
-            in_key = "%s;%s" % (in_ssp[1], in_ssp[2])
-            # print(in_key)
-            if in_key in cur_pks:
-                pk_issues.append(in_ssp[0])
-                continue
-
-            ssp = in_db.profile_by_pk(pk=in_ssp[0])
-            if ssp is None:
-                pk_issues.append(in_ssp[0])
-                continue
+        logger.debug('input: folder: %s, db: %s' % (os.path.dirname(input_db_path), in_project_name))
+
+        # the input db is read from a temporary copy, so that it is not upgraded to the current db version
+        with tempfile.TemporaryDirectory() as in_projects_folder:
+            ProjectDb.copy_db_file(db_path=input_db_path,
+                                   copy_path=os.path.join(in_projects_folder,
+                                                          ProjectDb.clean_project_name(in_project_name) + ".db"))
+            in_db = ProjectDb(projects_folder=in_projects_folder, project_name=in_project_name)
+            in_db.use_profile_cache = False
+            cur_db = None
+            try:
+                db_version = in_db.get_db_version()
+                if db_version is None:
+                    raise RuntimeError("unretrievable db version")
+                if db_version > 6:
+                    raise RuntimeError("unsupported db version: %s" % db_version)
+                logger.debug('input project db version: %s' % db_version)
+
+                cur_db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
+
+                in_lst = in_db.list_profiles()
+                cur_lst = cur_db.list_profiles()
+                logger.debug('profiles to import: %s' % len(in_lst))
+                logger.debug('current profiles: %s' % len(cur_lst))
+
+                # create list of current pks
+                cur_pks = list()  # type: list[str]
+                for cur_ssp in cur_lst:
+                    cur_key = "%s;%s" % (cur_ssp[1], cur_ssp[2])
+                    cur_pks.append(cur_key)
+                # print(cur_pks)
+
+                # copy after having checked that the profile is not already there
+                pk_issues = list()
+                pk_done = list()
+
+                for in_ssp in in_lst:
+
+                    in_key = "%s;%s" % (in_ssp[1], in_ssp[2])
+                    # print(in_key)
+                    if in_key in cur_pks:
+                        pk_issues.append(in_ssp[0])
+                        continue
+
+                    ssp = in_db.profile_by_pk(pk=in_ssp[0])
+                    if ssp is None:
+                        pk_issues.append(in_ssp[0])
+                        continue
+
+                    success = cur_db.add_casts(ssp)
+                    if success:
+                        pk_done.append(in_ssp[0])
+
+                    else:
+                        pk_issues.append(in_ssp[0])
 
-            success = cur_db.add_casts(ssp)
-            if success:
-                pk_done.append(in_ssp[0])
+                    continue
 
-            else:
-                pk_issues.append(in_ssp[0])
+            finally:
+                if cur_db is not None:
+                    cur_db.disconnect()
+                in_db.disconnect()
+                # the kept connections to the temporary copy are closed before its removal
+                connection_manager.close(in_db.db_path)
 
-            continue
+        return pk_issues, pk_done
 
-        in_db.disconnect()
+    def db_has_columnar_samples(self) -> bool:
+        """Check whether the current project db stores the samples as compressed columns"""
+        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
+        columnar_samples = db.columnar_samples
+        db.disconnect()
+        return columnar_samples
 
-        return pk_issues, pk_done
+    def db_convert_to_columnar_samples(self) -> str | None:
+        """Convert the current project db to compressed columns (not readable by older versions), after a backup"""
+        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
+        backup_path = db.convert_to_columnar_samples()
+        db.disconnect()
+        return backup_path
 
     def db_timestamp_list(self) -> list[datetime | int] | None:
         """Retrieve a list with the timestamp of all the profiles"""
@@ -1408,6 +1432,21 @@ class SoundSpeedLibrary:
         db.disconnect()
         return pk
 
+    def db_profiles_within(self, lat: float, lon: float, radius_km: float, start: datetime | None = None,
+                           end: datetime | None = None) -> list[tuple[int, datetime, float]] | None:
+        """Retrieve the profiles within a distance from a position, as (pk, datetime, distance in km)"""
+        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
+        profiles = db.profiles_within(lat=lat, lon=lon, radius_km=radius_km, start=start, end=end)
+        db.disconnect()
+        return profiles
+
+    def db_nearest_profile_key(self, dt: datetime | None = None, lat: float | None = None, lon: float | None = None,
+                               max_age: timedelta | None = None, max_distance_km: float | None = None) -> int | None:
+        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
+        pk = db.nearest_profile_key(dt=dt, lat=lat, lon=lon, max_age=max_age, max_distance_km=max_distance_km)
+        db.disconnect()
+        return pk
+
     def profile_stats(self) -> str:
         if self.cur is None:
             raise RuntimeError("No profile set")
@@ -1669,6 +1708,85 @@ class SoundSpeedLibrary:
 
         return ref_profile.compare_profile(profile, angle)
 
+    def dqa_full_profile_batch(self, pk_ref: int, pks: list[int] | None = None, start: datetime | None = None,
+                               end: datetime | None = None, angle: float = 60.0,
+                               max_workers: int | None = None) -> list[dict]:
+        """Compare a reference cast with many candidate casts from the project db
+
+        The candidates are the passed pks or, if not passed, the casts between the start and the end datetimes.
+        The reference is traced once, while the candidates are traced in a process pool (in this process,
+        if max_workers is 1). Return a row for each candidate with the maximum percentage depth difference."""
+        db = ProjectDb(projects_folder=self.projects_folder, project_name=self.current_project)
+        try:
+            if pks is None:
+                pks = db.profile_keys_between(start=start, end=end)
+                if pks is None:
+                    raise RuntimeError("unable to retrieve the cast timestamps")
+            pks = [pk for pk in pks if pk != pk_ref]
+
+            ref_pl = db.profile_by_pk(pk=pk_ref)
+            if ref_pl is None:
+                raise RuntimeError("No reference profile list")
+            ref_profile = ref_pl.cur
+
+            candidates = list()
+            for pk in pks:
+                pl = db.profile_by_pk(pk=pk)
+                if pl is None:
+                    logger.warning("unable to retrieve profile #%s" % pk)
+                    continue
+                candidates.append((pk, pl.cur))
+        finally:
+            db.disconnect()
+
+        draft = 0.0
+        table = list()
+        if ref_profile.proc.depth[ref_profile.proc_dqa_valid].size == 0:
+            logger.warning("DQA reference #%s: no valid samples" % pk_ref)
+            for pk, _ in candidates:
+                table.append({'pk': pk, 'pk_ref': pk_ref, 'angle': angle, 'max_common_depth': np.nan,
+                              'max_diff': np.nan, 'max_diff_depth': np.nan, 'passed': False,
+                              'error': "no valid samples in the reference profile"})
+            return table
+        ref_max_depth = ref_profile.proc.depth[ref_profile.proc_dqa_valid].max()
+
+        # trace the reference once for each travel time increment required by the candidates
+        ref_rays = dict()
+        jobs = list()
+        for pk, profile in candidates:
+            if profile.proc.depth[profile.proc_dqa_valid].size == 0:
+                table.append({'pk': pk, 'pk_ref': pk_ref, 'angle': angle, 'max_common_depth': np.nan,
+                              'max_diff': np.nan, 'max_diff_depth': np.nan, 'passed': False,
+                              'error': "no valid samples"})
+                continue
+            dep_max = min(ref_max_depth, profile.proc.depth[profile.proc_dqa_valid].max())
+            tt_inc = Profile.dqa_travel_time_increment(dep_max)
+            if tt_inc not in ref_rays:
+                ref_rays[tt_inc] = ref_profile.compute_ray_paths(draft, [angle], res=tt_inc)[0]
+            jobs.append((pk, profile, ref_rays[tt_inc], tt_inc, dep_max))
+
+        if (max_workers == 1) or (len(jobs) < 2):
+            results = [Profile.dqa_compare_with_ray(profile, ref_ray, angle, draft, tt_inc)
+                       for _, profile, ref_ray, tt_inc, _ in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(Profile.dqa_compare_with_ray, profile, ref_ray, angle, draft, tt_inc)
+                           for _, profile, ref_ray, tt_inc, _ in jobs]
+                results = [future.result() for future in futures]
+
+        for (pk, _, _, _, dep_max), result in zip(jobs, results):
+            row = {'pk': pk, 'pk_ref': pk_ref, 'angle': angle, 'max_common_depth': float(dep_max)}
+            row.update(result)
+            table.append(row)
+
+        for row in table:
+            if row['error'] is not None:
+                logger.warning("DQA #%s vs. #%s: %s" % (row['pk'], pk_ref, row['error']))
+
+        positions = {pk: i for i, pk in enumerate(pks)}
+        table.sort(key=lambda r: positions[r['pk']])
+        return table
+
     # plotting
 
     def raise_plot_window(self) -> None:
@@ -1994,7 +2112,12 @@ class SoundSpeedLibrary:
         return True
 
     def prepare_sis(self, apply_thin: bool = True, apply_12k: bool = True,
-                    thin_tolerance: float = 0.01) -> bool:
+                    thin_tolerance: float = 0.01, thin_max_samples: int | None = None) -> bool:
+        """Prepare the sis samples of the current profile
+
+        If thin_max_samples is passed, the thinning retains the most significant samples so that the resulting
+        profile (including the samples added at 0 and 12000 m) does not exceed that number.
+        """
         if not self.has_ssp() or self.cur is None:
             logger.warning("no profile!")
             return False
@@ -2002,7 +2125,10 @@ class SoundSpeedLibrary:
         self.cur.clone_proc_to_sis()
 
         if apply_thin:
-            if not self.cur.thin(tolerance=thin_tolerance):
+            max_samples = None
+            if thin_max_samples is not None:
+                max_samples = thin_max_samples - 2  # room for the samples added at 0 and 12000 m
+            if not self.cur.thin(tolerance=thin_tolerance, max_samples=max_samples):
                 logger.warning("thinning issue")
                 return False
         else:
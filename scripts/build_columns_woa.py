@@ -0,0 +1,26 @@
+import logging
+import os
+
+from hyo2.ssm2.lib.atlas.woa09 import Woa09
+from hyo2.ssm2.lib.atlas.woa13 import Woa13
+from hyo2.ssm2.lib.atlas.woa18 import Woa18
+from hyo2.ssm2.lib.atlas.woa23 import Woa23
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+atlases_path = r"C:\Users\gmasetti\AppData\Local\HydrOffice\Sound Speed\atlases"
+
+#  """ USED TO BUILD THE OPTIONAL COLUMN STORES OF THE (REDUCED) DATABASES, FOR FAST POINT QUERIES """
+#  """ The WOA13/18/23 stores take several GB of disk space each """
+
+for atlas_class, folder in [(Woa09, "woa09"), (Woa13, "woa13"), (Woa18, "woa18"), (Woa23, "woa23")]:
+    data_folder = os.path.join(atlases_path, folder)
+    if not os.path.exists(data_folder):
+        logger.info("skipping %s" % data_folder)
+        continue
+
+    atlas = atlas_class(data_folder=data_folder, prj=None)
+    if not atlas.build_columns():
+        raise RuntimeError("Unable to build the column store for %s" % data_folder)
+    logger.info("%s -> %s" % (atlas.name, atlas.columns_path))
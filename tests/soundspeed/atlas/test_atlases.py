@@ -3,6 +3,7 @@ import os
 import shutil
 
 from hyo2.ssm2.lib.atlas import atlases
+from hyo2.ssm2.lib.atlas.abstract import AbstractAtlas
 from hyo2.ssm2.lib.soundspeed import SoundSpeedLibrary
 
 
@@ -31,6 +32,17 @@ class TestSoundSpeedAtlasAtlases(unittest.TestCase):
 
         lib.close()
 
+    def test_batch_clusters(self):
+        boxes = [(10, 14, 20, 24), (0, 4, 0, 4), (11, 15, 21, 25), (2, 6, 1, 5), (50, 54, 50, 54)]
+
+        clusters = AbstractAtlas.batch_clusters(boxes=boxes, max_nodes=64)
+
+        self.assertEqual(clusters, [[1, 3], [0, 2], [4]])
+        self.assertEqual(AbstractAtlas.batch_clusters(boxes=boxes[:1], max_nodes=1), [[0]])
+
+        with self.assertRaises(RuntimeError):
+            AbstractAtlas.check_batch(lats=[1.0, 2.0], lons=[1.0], datestamps=[None, None])
+
 
 def suite():
     s = unittest.TestSuite()
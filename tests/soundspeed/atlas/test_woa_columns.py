@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from hyo2.ssm2.lib.atlas.woa_columns import WoaColumns
+
+
+class TestSoundSpeedAtlasWoaColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "columns")
+        self.source = os.path.join(self.folder, "source.nc")
+        with open(self.source, "w") as fod:
+            fod.write("source")
+
+        # (time, depth, lat, lon): 2 months with 2 levels, 1 season with 3 levels
+        rng = np.random.default_rng(1)
+        self.month = rng.uniform(0.0, 30.0, (2, 2, 3, 4)).astype(np.float32)
+        self.season = rng.uniform(0.0, 30.0, (1, 3, 3, 4)).astype(np.float32)
+        self.month[1, 1, 2, 3] = np.nan
+        self.season[0, 2, 0, 0] = np.nan
+        self.landsea = np.zeros((3, 4))
+        self.landsea[1, 1] = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _read_slab(self, var_name, time_idx, seasonal, lat_0, lat_1):
+        values = self.season if seasonal else self.month
+        return WoaColumns.read_slab(values + WoaColumns.var_names.index(var_name), time_idx, lat_0, lat_1)
+
+    def test_build_and_read(self):
+        self.assertIsNone(WoaColumns.load(path=self.path, sources=[self.source]))
+        self.assertTrue(WoaColumns.build(path=self.path, sources=[self.source], keys=[(0, 0), (1, 0)],
+                                         landsea=self.landsea, num_levels=3, read_slab=self._read_slab, band_size=8))
+
+        columns = WoaColumns.load(path=self.path, sources=[self.source])
+        self.assertIsNotNone(columns)
+        self.assertIsNone(columns.read_nodes(5, 0, np.array([0]), np.array([0])))
+
+        lat_idx = np.array([0, 1, 2])
+        lon_idx = np.array([0, 1, 3])
+        t, s, t_sd, s_sd = columns.read_nodes(1, 0, lat_idx, lon_idx)
+        expected = self.season[0, :, lat_idx, lon_idx].T.copy()
+        expected[:2] = self.month[1, :, lat_idx, lon_idx].T
+        expected[:, 1] = np.nan  # land node
+        np.testing.assert_array_equal(t, expected)
+        np.testing.assert_array_equal(s_sd, expected + 3)
+        self.assertTrue(np.isnan(t[2, 0]))
+        del columns
+
+    def test_outdated(self):
+        WoaColumns.build(path=self.path, sources=[self.source], keys=[(0, 0)], landsea=self.landsea, num_levels=3,
+                         read_slab=self._read_slab)
+
+        with open(self.source, "a") as fod:
+            fod.write("modified")
+        self.assertIsNone(WoaColumns.load(path=self.path, sources=[self.source]))
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedAtlasWoaColumns))
+    return s
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from netCDF4 import Dataset
+
+from hyo2.ssm2.lib.atlas.woa_datasets import WoaDatasets
+
+
+class TestSoundSpeedAtlasWoaDatasets(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.paths = list()
+        for i in range(4):
+            path = os.path.join(self.folder, "ds%02d.nc" % i)
+            with Dataset(path, "w") as ds:
+                ds.idx = i
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lazy_open(self):
+        datasets = WoaDatasets(self.paths, max_open=2)
+        self.assertEqual(datasets.nr_open, 0)
+
+        self.assertEqual(datasets[1].idx, 1)
+        self.assertEqual(datasets[2].idx, 2)
+        self.assertEqual(datasets[1].idx, 1)
+        self.assertEqual(datasets[3].idx, 3)
+
+        # the least recently used dataset has been closed
+        self.assertEqual(datasets.nr_open, 2)
+        self.assertTrue(datasets.is_open(1))
+        self.assertFalse(datasets.is_open(2))
+
+        datasets.close()
+        self.assertEqual(datasets.nr_open, 0)
+
+    def test_preload(self):
+        datasets = WoaDatasets(self.paths, max_open=2)
+        datasets.preload([0, 1, 2])
+
+        self.assertEqual(datasets.nr_open, 2)
+        self.assertTrue(datasets.is_open(1))
+        self.assertTrue(datasets.is_open(2))
+        datasets.close()
+
+    def test_missing(self):
+        datasets = WoaDatasets(self.paths + [os.path.join(self.folder, "missing.nc")])
+        self.assertEqual(len(datasets.missing()), 1)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedAtlasWoaDatasets))
+    return s
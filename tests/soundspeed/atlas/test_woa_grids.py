@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from hyo2.ssm2.lib.atlas.woa_grids import WoaGrids
+
+
+class TestSoundSpeedAtlasWoaGrids(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.msk_path = os.path.join(self.folder, "landsea.msk")
+        with open(self.msk_path, "w") as fod:
+            fod.write("1, 1, 1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_round_trip(self):
+        landsea = np.arange(6, dtype=np.float64).reshape((2, 3))
+        lat = np.array([-0.5, 0.5])
+
+        self.assertIsNone(WoaGrids.load(msk_path=self.msk_path, sources=[self.msk_path]))
+        self.assertTrue(WoaGrids.save(msk_path=self.msk_path, sources=[self.msk_path], landsea=landsea, lat=lat))
+
+        grids = WoaGrids.load(msk_path=self.msk_path, sources=[self.msk_path])
+        self.assertIsNotNone(grids)
+        np.testing.assert_array_equal(grids['landsea'], landsea)
+        np.testing.assert_array_equal(grids['lat'], lat)
+        del grids
+
+    def test_outdated(self):
+        WoaGrids.save(msk_path=self.msk_path, sources=[self.msk_path], landsea=np.zeros((2, 3)))
+
+        # a modified source file invalidates the cache
+        with open(self.msk_path, "a") as fod:
+            fod.write("0, 0, 0\n")
+        self.assertIsNone(WoaGrids.load(msk_path=self.msk_path, sources=[self.msk_path]))
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedAtlasWoaGrids))
+    return s
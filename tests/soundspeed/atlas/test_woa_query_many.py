@@ -0,0 +1,72 @@
+import tempfile
+import unittest
+from datetime import datetime as dt
+
+import numpy as np
+
+from hyo2.ssm2.lib.atlas.woa23 import Woa23
+
+
+class _Dataset:
+    """In-memory stand-in of a netCDF dataset"""
+
+    def __init__(self, variables: dict) -> None:
+        self.variables = variables
+
+
+class TestSoundSpeedAtlasWoaQueryMany(unittest.TestCase):
+
+    def setUp(self):
+        # a small regional grid, with 12 monthly (5 levels) and 4 seasonal (8 levels) datasets for each variable
+        rng = np.random.default_rng(3)
+        self.woa = Woa23(data_folder=tempfile.gettempdir(), prj=None)
+        self.woa.lat = np.arange(30.125, 35.0, 0.25)
+        self.woa.lon = np.arange(-74.875, -70.0, 0.25)
+        self.woa.depth = np.arange(8, dtype=np.float32) * 10.0
+        self.woa.num_levels = 8
+        self.woa.landsea = (rng.uniform(size=(self.woa.lat.size, self.woa.lon.size)) < 0.2).astype(int)
+
+        def datasets(var_name, low, high):
+            items = list()
+            for num_levels in [5] * 12 + [8] * 4:
+                shape = (1, num_levels, self.woa.lat.size, self.woa.lon.size)
+                missing = rng.uniform(size=shape) < 0.1
+                items.append(_Dataset({
+                    "%s_an" % var_name: np.ma.masked_array(rng.uniform(low, high, shape), mask=missing),
+                    "%s_sd" % var_name: np.ma.masked_array(rng.uniform(0.1, 1.0, shape), mask=missing)}))
+            return items
+
+        self.woa.t = datasets("t", 5.0, 25.0)
+        self.woa.s = datasets("s", 30.0, 37.0)
+        self.woa.has_data_loaded = True
+
+    def test_query_many_equals_query(self):
+        rng = np.random.default_rng(4)
+        lats = list(rng.uniform(30.6, 34.4, 40))
+        lons = list(rng.uniform(-74.4, -70.6, 40))
+        datestamps = [dt(2020, int(month), 15, 12) for month in rng.integers(1, 13, 40)]
+        lats[5] = None
+
+        many = self.woa.query_many(lats=lats, lons=lons, datestamps=datestamps)
+        self.assertEqual(len(many), len(lats))
+        self.assertIsNone(many[5])
+
+        for i, (lat, lon, datestamp) in enumerate(zip(lats, lons, datestamps)):
+            single = self.woa.query(lat=lat, lon=lon, datestamp=datestamp)
+            if single is None:
+                self.assertIsNone(many[i])
+                continue
+
+            self.assertEqual(len(many[i].l), len(single.l))
+            for ssp_many, ssp_single in zip(many[i].l, single.l):
+                self.assertEqual(ssp_many.meta.original_path, ssp_single.meta.original_path)
+                np.testing.assert_array_equal(ssp_many.data.depth, ssp_single.data.depth)
+                np.testing.assert_array_equal(ssp_many.data.temp, ssp_single.data.temp)
+                np.testing.assert_array_equal(ssp_many.data.sal, ssp_single.data.sal)
+                np.testing.assert_array_equal(ssp_many.data.speed, ssp_single.data.speed)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedAtlasWoaQueryMany))
+    return s
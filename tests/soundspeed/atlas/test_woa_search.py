@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from hyo2.ssm2.lib.atlas.woa_search import WoaSearch
+
+
+class TestSoundSpeedAtlasWoaSearch(unittest.TestCase):
+
+    def test_window_nodes(self):
+        landsea = np.zeros((10, 20))
+        landsea[5, 0] = 1
+
+        lat_idx, lon_idx = WoaSearch.window_nodes(landsea=landsea, lat_base_idx=5, lon_base_idx=19, radius=1)
+
+        # the window wraps around the antimeridian and skips the land node
+        self.assertEqual(list(zip(lat_idx, lon_idx)), [(4, 18), (4, 19), (4, 0), (5, 18), (5, 19),
+                                                       (6, 18), (6, 19), (6, 0)])
+
+        lat_idx, _ = WoaSearch.window_nodes(landsea=landsea, lat_base_idx=9, lon_base_idx=10, radius=2)
+        self.assertEqual(sorted(set(lat_idx)), [7, 8, 9])
+
+    def test_read_nodes(self):
+        values = np.ma.masked_array(np.arange(2 * 3 * 4 * 5, dtype=np.float32).reshape((2, 3, 4, 5)))
+        values[1, 2, 1, 4] = np.ma.masked
+        lat_idx = np.array([1, 1, 2])
+        lon_idx = np.array([4, 0, 1])
+
+        nodes = WoaSearch.read_nodes(values, 1, lat_idx, lon_idx)
+
+        self.assertEqual(nodes.shape, (3, 3))
+        np.testing.assert_array_equal(nodes[:2], values[1, :2, lat_idx, lon_idx].T)
+        self.assertTrue(np.isnan(nodes[2, 0]))
+
+    def test_union_nodes(self):
+        windows = [(np.array([1, 1, 2]), np.array([4, 0, 1])), (np.array([2, 3]), np.array([1, 0]))]
+
+        lat_idx, lon_idx, positions = WoaSearch.union_nodes(windows=windows, n_lon=5)
+
+        self.assertEqual(list(zip(lat_idx, lon_idx)), [(1, 0), (1, 4), (2, 1), (3, 0)])
+        for (w_lat_idx, w_lon_idx), w_positions in zip(windows, positions):
+            np.testing.assert_array_equal(lat_idx[w_positions], w_lat_idx)
+            np.testing.assert_array_equal(lon_idx[w_positions], w_lon_idx)
+
+    def test_closest_values(self):
+        dist = np.array([30.0, 10.0, 20.0])
+        # 2 monthly levels, 3 seasonal levels
+        t_month = np.array([[5.0, 6.0, 7.0], [5.0, -1.5, 7.0]])
+        s_month = np.full((2, 3), 35.0)
+        sd_month = np.full((2, 3), 1.0)
+        t_season = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [8.0, 99.0, 9.0]])
+        s_season = np.full((3, 3), 34.0)
+        sd_season = np.array([[1.0, 1.0, 1.0], [1.0, 1.0, 1.0], [np.nan, np.nan, np.nan]])
+
+        values = WoaSearch.closest_values(dist=dist, t_month=t_month, s_month=s_month, t_sd_month=sd_month,
+                                          s_sd_month=sd_month, t_season=t_season, s_season=s_season,
+                                          t_sd_season=sd_season, s_sd_season=sd_season)
+
+        np.testing.assert_array_equal(values['valid'], [True, True, True])
+        np.testing.assert_array_equal(values['t'], [6.0, -1.5, 9.0])
+        np.testing.assert_array_equal(values['s'], [35.0, 35.0, 34.0])
+        np.testing.assert_array_equal(values['valid_t_sd'], [True, True, False])
+        np.testing.assert_array_equal(values['t_min'], [5.0, -2.0, 0.0])
+        np.testing.assert_array_equal(values['s_max'], [36.0, 36.0, 0.0])
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedAtlasWoaSearch))
+    return s
@@ -0,0 +1,82 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from hyo2.ssm2.lib.base.callbacks.fake_callbacks import FakeCallbacks
+from hyo2.ssm2.lib.client.client import Client
+from hyo2.ssm2.lib.profile.profile import Profile
+from hyo2.ssm2.lib.profile.profilelist import ProfileList
+from hyo2.ssm2.lib.soundspeed import SoundSpeedLibrary
+
+
+class TestSoundSpeedClient(unittest.TestCase):
+
+    def setUp(self):
+        # a long and noisy cast, with much more samples than what SIS accepts after a fine thinning
+        nr_samples = 20000
+        rng = np.random.default_rng(0)
+
+        self.lib = SoundSpeedLibrary(callbacks=FakeCallbacks())
+        self.lib.ssp = ProfileList()
+        self.lib.ssp.append()
+        self.lib.cur.meta.latitude = 43.0
+        self.lib.cur.meta.longitude = -70.0
+        self.lib.cur.meta.utc_time = datetime(2024, 1, 1)
+        self.lib.cur.init_data(nr_samples)
+        self.lib.cur.data.depth[:] = np.linspace(1.0, 2000.0, nr_samples)
+        self.lib.cur.data.speed[:] = 1500.0 + rng.normal(0.0, 0.5, nr_samples)
+        self.lib.cur.data.temp[:] = 10.0
+        self.lib.cur.data.sal[:] = 35.0
+        self.lib.restart_proc()
+
+    def tearDown(self):
+        self.lib.close()
+
+    def sis_depths(self):
+        return self.lib.cur.sis.depth[self.lib.cur.sis_thinned]
+
+    def test_prepare_sis_max_samples(self):
+        self.assertTrue(self.lib.prepare_sis(thin_max_samples=Profile.MAX_SIS_SAMPLES))
+
+        depths = self.sis_depths()
+        self.assertEqual(depths.size, Profile.MAX_SIS_SAMPLES)
+        self.assertEqual(depths[0], 0.0)
+        self.assertEqual(depths[-1], 12000.0)
+
+    def test_prepare_sis_pads_in_budget(self):
+        for max_samples in [10, 100]:
+            self.assertTrue(self.lib.prepare_sis(thin_max_samples=max_samples))
+
+            # the samples added at 0 and 12000 m are counted in the budget
+            depths = self.sis_depths()
+            self.assertEqual(depths.size, max_samples)
+            self.assertEqual(depths[0], 0.0)
+            self.assertEqual(depths[-1], 12000.0)
+
+        self.assertTrue(self.lib.prepare_sis(thin_max_samples=100, apply_12k=False))
+        depths = self.sis_depths()
+        self.assertLessEqual(depths.size, 100)
+        self.assertEqual(depths[0], 0.0)
+        self.assertLess(depths[-1], 12000.0)
+
+    def test_send_kng_format_size(self):
+        client = Client("SIS:127.0.0.1:4001:SIS")
+        tx = list()
+        client._transmit = lambda tx_data: tx.append(tx_data) or True
+
+        # with a lower datagram limit, the sample budget is reduced until the encoded profile fits
+        for udp_data_limit in [Client.UDP_DATA_LIMIT, 8000]:
+            client.UDP_DATA_LIMIT = udp_data_limit
+            self.assertTrue(client.send_kng_format(prj=self.lib))
+
+            self.assertLess(len(tx[-1]), udp_data_limit)
+            self.assertLessEqual(self.sis_depths().size, Profile.MAX_SIS_SAMPLES)
+
+        self.assertLess(self.sis_depths().size, Profile.MAX_SIS_SAMPLES)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedClient))
+    return s
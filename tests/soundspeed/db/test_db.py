@@ -1,9 +1,15 @@
 import os
+import sqlite3
+import threading
 import unittest
-from datetime import datetime
+from datetime import datetime, timezone
 import numpy as np
 
+from hyo2.ssm2.lib.db.connection_manager import connection_manager
+from hyo2.ssm2.lib.db.db import ProjectDb
 from hyo2.ssm2.lib.soundspeed import SoundSpeedLibrary
+from hyo2.ssm2.lib.profile.dicts import Dicts
+from hyo2.ssm2.lib.profile.profile import Profile
 from hyo2.ssm2.lib.profile.profilelist import ProfileList
 
 
@@ -37,6 +43,7 @@ class TestSoundSpeedDb(unittest.TestCase):
                 add_cast(20 + i, -75)
 
     def tearDown(self):
+        connection_manager.close(self.db_path)
         if os.path.exists(self.db_path):
             os.remove(self.db_path)
 
@@ -57,6 +64,386 @@ class TestSoundSpeedDb(unittest.TestCase):
             pk = i % self.max_pk + 1
             test_pk(pk)
 
+    def test_list_profiles_with_stats(self):
+        lst = self.lib.db_list_profiles(with_stats=True)
+        self.assertEqual(len(lst), self.max_pk)
+
+        for row in lst:
+            ssp = self.lib.db_retrieve_profile(row[0])
+            self.assertEqual(row[20], '%0.2f' % ssp.cur.proc_speed_at_min_depth)
+            self.assertEqual(row[21], '%0.2f' % ssp.cur.proc_depth_min)
+            self.assertEqual(row[22], '%0.2f' % ssp.cur.proc_speed_mean)
+            self.assertEqual(row[23], '%0.2f' % ssp.cur.proc_depth_max)
+            self.assertEqual(row[24], '%0.2f' % ssp.cur.data_depth_max)
+
+    def test_older_version_deletes_profile_with_stats(self):
+        # as a db created before the cascade deletions
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("ALTER TABLE profile_stats RENAME TO profile_stats_old")
+        conn.execute("""CREATE TABLE profile_stats(ssp_pk integer PRIMARY KEY NOT NULL, ss_at_min_depth real,
+                        min_depth real, mean_ss real, max_depth real, max_raw_depth real,
+                        FOREIGN KEY (ssp_pk) REFERENCES ssp (pk))""")
+        conn.execute("INSERT INTO profile_stats SELECT * FROM profile_stats_old")
+        conn.execute("DROP TABLE profile_stats_old")
+        conn.commit()
+        conn.close()
+        connection_manager.close(self.db_path)
+
+        db = ProjectDb(projects_folder=os.path.dirname(self.db_path), project_name='unittest')
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM profile_stats").fetchone()[0], self.max_pk)
+        db.disconnect()
+        connection_manager.close(self.db_path)
+
+        # as an older version, unaware of the statistics table
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA foreign_keys=ON")
+        for table in ('data', 'proc', 'sis'):
+            conn.execute("DELETE FROM %s WHERE ssp_pk = 1" % table)
+        conn.execute("DELETE FROM ssp WHERE pk = 1")
+        conn.commit()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM profile_stats WHERE ssp_pk = 1").fetchone()[0], 0)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM profile_stats").fetchone()[0], self.max_pk - 1)
+        conn.close()
+
+    def test_upgrade_keeps_sample_rows(self):
+        projects_folder = os.path.dirname(self.db_path)
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        self.assertFalse(db.columnar_samples)
+        ssp = db.profile_by_pk(1)
+        nr_rows = db.conn.execute("SELECT COUNT(*) FROM proc").fetchone()[0]
+
+        # as a version 3 db
+        db.conn.execute("UPDATE library SET version = 3")
+        db.conn.execute("DELETE FROM profile_stats WHERE ssp_pk = 1")
+        db.conn.commit()
+        db.disconnect()
+        connection_manager.close(self.db_path)
+
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        self.assertEqual(db.get_db_version(), db.cur_version)
+        self.assertFalse(db.columnar_samples)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM proc").fetchone()[0], nr_rows)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0], 0)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM profile_stats").fetchone()[0], self.max_pk)
+        upgraded_ssp = db.profile_by_pk(1)
+        db.disconnect()
+
+        self.assertTrue(np.array_equal(upgraded_ssp.cur.data.depth, ssp.cur.data.depth))
+        self.assertTrue(np.array_equal(upgraded_ssp.cur.proc.speed, ssp.cur.proc.speed))
+
+    def test_convert_to_columnar_samples(self):
+        projects_folder = os.path.dirname(self.db_path)
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        db.use_profile_cache = False
+        ssp = db.profile_by_pk(1)
+        nr_rows = db.conn.execute("SELECT COUNT(*) FROM proc").fetchone()[0]
+
+        backup_path = db.convert_to_columnar_samples()
+        self.assertIsNotNone(backup_path)
+        self.assertTrue(db.columnar_samples)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM proc").fetchone()[0], 0)
+        converted_ssp = db.profile_by_pk(1)
+        db.disconnect()
+
+        self.assertTrue(np.array_equal(converted_ssp.cur.data.depth, ssp.cur.data.depth))
+        self.assertTrue(np.array_equal(converted_ssp.cur.proc.speed, ssp.cur.proc.speed))
+        self.assertTrue(np.array_equal(converted_ssp.cur.proc.flag, ssp.cur.proc.flag))
+        # the loaded samples can be edited
+        converted_ssp.cur.proc.flag[0] = Dicts.flags['user']
+
+        # the backup keeps the per-sample rows
+        backup_conn = sqlite3.connect(backup_path)
+        self.assertEqual(backup_conn.execute("SELECT COUNT(*) FROM proc").fetchone()[0], nr_rows)
+        self.assertEqual(backup_conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0], 0)
+        backup_conn.close()
+        os.remove(backup_path)
+
+        # the following casts are stored as compressed columns
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        self.assertTrue(db.columnar_samples)
+        ssp.cur.meta.latitude = 10.0
+        self.assertTrue(db.add_casts(ssp))
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM proc").fetchone()[0], 0)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM samples WHERE ssp_pk = ?",
+                                         (db.tmp_ssp_pk,)).fetchone()[0], 2)
+        db.disconnect()
+
+    def test_older_version_deletes_converted_profile(self):
+        projects_folder = os.path.dirname(self.db_path)
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        os.remove(db.convert_to_columnar_samples())
+        db.disconnect()
+        connection_manager.close(self.db_path)
+
+        # as a db converted before the cascade deletions
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("ALTER TABLE samples RENAME TO samples_old")
+        conn.execute("""CREATE TABLE samples(ssp_pk integer NOT NULL, stage text NOT NULL, num_samples int NOT NULL,
+                        pressure blob NOT NULL, depth blob NOT NULL, speed blob NOT NULL, temperature blob NOT NULL,
+                        conductivity blob NOT NULL, salinity blob NOT NULL, source blob NOT NULL,
+                        flag blob NOT NULL, PRIMARY KEY (ssp_pk, stage), FOREIGN KEY (ssp_pk) REFERENCES ssp (pk))""")
+        conn.execute("INSERT INTO samples SELECT * FROM samples_old")
+        conn.execute("DROP TABLE samples_old")
+        conn.commit()
+        conn.close()
+
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        self.assertTrue(db.columnar_samples)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0], self.max_pk * 2)
+        db.disconnect()
+        connection_manager.close(self.db_path)
+
+        # as an older version, that only deletes the per-sample rows before the profile
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA foreign_keys=ON")
+        for table in ('data', 'proc', 'sis'):
+            conn.execute("DELETE FROM %s WHERE ssp_pk = 1" % table)
+        conn.execute("DELETE FROM ssp WHERE pk = 1")
+        conn.commit()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM samples WHERE ssp_pk = 1").fetchone()[0], 0)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0], (self.max_pk - 1) * 2)
+        conn.close()
+
+    def test_import_data_from_db(self):
+        # an input db with an older version, that is not upgraded by the import
+        input_db_path = os.path.join(os.path.dirname(self.db_path), 'unittest_input.db')
+        ProjectDb.copy_db_file(db_path=self.db_path, copy_path=input_db_path)
+        conn = sqlite3.connect(input_db_path)
+        conn.execute("UPDATE library SET version = 5")
+        conn.commit()
+        conn.close()
+        with open(input_db_path, 'rb') as fid:
+            input_content = fid.read()
+
+        self.lib.current_project = 'unittest_output'
+        output_db_path = os.path.join(os.path.dirname(self.db_path), 'unittest_output.db')
+        try:
+            pk_issues, pk_done = self.lib.db_import_data_from_db(input_db_path)
+            self.assertEqual(len(pk_issues), 0)
+            self.assertEqual(len(pk_done), self.max_pk)
+            self.assertEqual(len(self.lib.db_list_profiles()), self.max_pk)
+
+            with open(input_db_path, 'rb') as fid:
+                self.assertEqual(fid.read(), input_content)
+
+        finally:
+            connection_manager.close(output_db_path)
+            for path in (input_db_path, output_db_path):
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+
+    def test_bulk_insert_fallback(self):
+        db = ProjectDb(projects_folder=os.path.dirname(self.db_path), project_name='unittest')
+        db.columnar_samples = False
+
+        # a duplicated depth (accepted) and a missing depth (rejected by the NOT NULL constraint)
+        ssp = ProfileList()
+        ssp.append()
+        ssp.cur.meta.latitude = 10.0
+        ssp.cur.meta.longitude = -75.0
+        ssp.cur.meta.utc_time = datetime(2020, 1, 1)
+        ssp.cur.init_data(6)
+        ssp.cur.data.depth[:] = [0.0, 1.0, 1.0, np.nan, 3.0, 4.0]
+        ssp.cur.data.speed[:] = 1500.0
+        ssp.cur.clone_data_to_proc()
+        ssp.cur.init_sis()
+        self.assertTrue(db.add_casts(ssp))
+        self.assertFalse(db.conn.in_transaction)
+
+        # the bulk insert was rolled back to the savepoint, then the valid rows were inserted one by one
+        for table in ['data', 'proc']:
+            depths = [row[0] for row in db.conn.execute("SELECT depth FROM %s WHERE ssp_pk = ? ORDER BY rowid"
+                                                        % table, (db.tmp_ssp_pk,)).fetchall()]
+            self.assertEqual(depths, [0.0, 1.0, 1.0, 3.0, 4.0], table)
+
+        # the following casts are still stored with the bulk insert
+        ssp.cur.meta.utc_time = datetime(2020, 1, 2)
+        ssp.cur.data.depth[3] = 2.0
+        ssp.cur.clone_data_to_proc()
+        self.assertTrue(db.add_casts(ssp))
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM proc WHERE ssp_pk = ?",
+                                         (db.tmp_ssp_pk,)).fetchone()[0], 6)
+        db.disconnect()
+
+    def test_dqa_full_profile_batch(self):
+        pks = list(range(2, self.max_pk + 1))
+        for max_workers in (1, 2):
+            table = self.lib.dqa_full_profile_batch(pk_ref=1, pks=pks, angle=45.0, max_workers=max_workers)
+
+            self.assertEqual([row['pk'] for row in table], pks)
+            for row in table:
+                self.assertIsNone(row['error'])
+                self.assertTrue(row['passed'])
+                self.assertAlmostEqual(row['max_diff'], 0.0)
+
+        table = self.lib.dqa_full_profile_batch(pk_ref=1, max_workers=1)
+        self.assertEqual([row['pk'] for row in table], pks)
+
+        # the time range accepts timezone-aware datetimes
+        table = self.lib.dqa_full_profile_batch(pk_ref=1, start=datetime(2000, 1, 1, tzinfo=timezone.utc),
+                                                max_workers=1)
+        self.assertEqual([row['pk'] for row in table], pks)
+        table = self.lib.dqa_full_profile_batch(pk_ref=1, end=datetime(2000, 1, 1, tzinfo=timezone.utc),
+                                                max_workers=1)
+        self.assertEqual(table, [])
+
+    def test_dqa_full_profile_batch_differences(self):
+        # a cast with much faster sound speeds, and a cast without valid samples
+        self.lib.ssp = ProfileList()
+        self.lib.ssp.append()
+        self.lib.ssp.cur.meta.latitude = 30.0
+        self.lib.ssp.cur.meta.longitude = -75.0
+        self.lib.ssp.cur.meta.utc_time = datetime.now()
+        self.lib.ssp.cur.init_data(self.levels)
+        self.lib.ssp.cur.data.depth[:self.levels] = self.depth
+        self.lib.ssp.cur.data.speed[:self.levels] = 1500.0 + self.depth
+        self.lib.restart_proc()
+        self.assertTrue(self.lib.store_data())
+        pk_fast = self.max_pk + 1
+
+        self.lib.ssp.cur.meta.utc_time = datetime.now()
+        self.lib.ssp.cur.proc.flag[:] = Dicts.flags['user']
+        self.lib.ssp.cur.meta.latitude = 31.0
+        self.assertTrue(self.lib.store_data())
+        pk_empty = self.max_pk + 2
+
+        table = self.lib.dqa_full_profile_batch(pk_ref=1, pks=[2, pk_fast, pk_empty], angle=45.0, max_workers=1)
+        self.assertEqual([row['pk'] for row in table], [2, pk_fast, pk_empty])
+        self.assertTrue(table[0]['passed'])
+        self.assertIsNone(table[1]['error'])
+        self.assertFalse(table[1]['passed'])
+        self.assertGreater(table[1]['max_diff'], Profile.DQA_MAX_PCT_DEPTH_DIFF)
+        self.assertFalse(table[2]['passed'])
+        self.assertEqual(table[2]['error'], "no valid samples")
+
+        table = self.lib.dqa_full_profile_batch(pk_ref=pk_empty, pks=[1, pk_fast], max_workers=1)
+        self.assertEqual([row['pk'] for row in table], [1, pk_fast])
+        for row in table:
+            self.assertFalse(row['passed'])
+            self.assertEqual(row['error'], "no valid samples in the reference profile")
+
+    def test_spatial_temporal_queries(self):
+        profiles = self.lib.db_profiles_within(lat=22.0, lon=-75.0, radius_km=120.0)
+        self.assertEqual(sorted(p[0] for p in profiles), [2, 3, 4])
+        self.assertEqual(profiles[0][0], 3)
+        self.assertAlmostEqual(profiles[0][2], 0.0)
+        self.assertEqual(len(self.lib.db_profiles_within(lat=22.0, lon=-75.0, radius_km=120.0,
+                                                         end=datetime(2000, 1, 1))), 0)
+
+        self.assertEqual(self.lib.db_nearest_profile_key(lat=23.9, lon=-75.0), 5)
+        self.assertIsNone(self.lib.db_nearest_profile_key(lat=0.0, lon=0.0, max_distance_km=100.0))
+        self.assertEqual(self.lib.db_nearest_profile_key(dt=datetime.now()), self.max_pk)
+        self.assertEqual(self.lib.db_nearest_profile_key(dt=datetime(2000, 1, 1)), 1)
+
+    def test_older_version_adds_casts(self):
+        projects_folder = os.path.dirname(self.db_path)
+        # as a version 5 db, without the cast index
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE library SET version = 5")
+        conn.execute("DROP TABLE ssp_index")
+        conn.commit()
+        conn.close()
+        connection_manager.close(self.db_path)
+
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        self.assertEqual(db.get_db_version(), db.cur_version)
+        self.assertEqual([p[0] for p in db.profiles_within(lat=22.0, lon=-75.0, radius_km=1.0)], [3])
+        db.disconnect()
+        connection_manager.close(self.db_path)
+
+        # as an older version, that inserts into 'ssp_pk' by position
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA foreign_keys=ON")
+        pk = conn.execute("INSERT INTO ssp_pk VALUES (NULL, ?, ?)",
+                          ("2001-01-01 00:00:00", "-60.000000;10.000000")).lastrowid
+        conn.execute("INSERT INTO ssp (pk, sensor_type, probe_type) VALUES (?, 0, 0)", (pk,))
+        conn.commit()
+        conn.close()
+
+        # the cast is indexed at the next opening
+        db = ProjectDb(projects_folder=projects_folder, project_name='unittest')
+        self.assertEqual([p[0] for p in db.profiles_within(lat=10.0, lon=-60.0, radius_km=1.0)], [pk])
+        self.assertEqual(db.nearest_profile_key(dt=datetime(2000, 1, 1)), pk)
+        db.disconnect()
+
+    def test_proc_samples_between(self):
+        db = ProjectDb(projects_folder=os.path.dirname(self.db_path), project_name='unittest')
+        streamed = list(db.proc_samples_between(start=datetime(2000, 1, 1)))
+        self.assertEqual([pk for pk, _, _, _ in streamed], list(range(1, self.max_pk + 1)))
+        for pk, _, depths, speeds in streamed:
+            ssp = db.profile_by_pk(pk)
+            self.assertTrue(np.array_equal(depths, ssp.cur.proc.depth[ssp.cur.proc_valid]))
+            self.assertTrue(np.array_equal(speeds, ssp.cur.proc.speed[ssp.cur.proc_valid]))
+        self.assertEqual(len(list(db.proc_samples_between(end=datetime(2000, 1, 1)))), 0)
+        db.disconnect()
+
+    def test_kept_connections(self):
+        db = ProjectDb(projects_folder=os.path.dirname(self.db_path), project_name='unittest')
+        self.assertEqual(db.conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        conn = db.conn
+        db.conn.execute("DELETE FROM library")
+        db.disconnect()
+
+        # the same connection is reused, without the uncommitted changes
+        db = ProjectDb(projects_folder=os.path.dirname(self.db_path), project_name='unittest')
+        self.assertIs(db.conn, conn)
+        self.assertEqual(db.get_db_version(), db.cur_version)
+
+        cursor = db.read_only_cursor()
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM ssp").fetchone()[0], self.max_pk)
+        with self.assertRaises(sqlite3.OperationalError):
+            cursor.execute("DELETE FROM library")
+        # the queries use the read-only connection
+        self.assertEqual(len(db.list_profiles()), self.max_pk)
+        self.assertIs(db._reader(), cursor.connection)
+        db.disconnect()
+
+    def test_close_connections_of_other_threads(self):
+        conns = dict()
+
+        def connect(name):
+            conns[name] = connection_manager.connect(self.db_path)[0]
+
+        # a thread that keeps running while the main thread closes the connections
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def worker():
+            connect('first')
+            started.set()
+            proceed.wait()
+            conns['first'].execute("SELECT COUNT(*) FROM ssp").fetchone()
+            connect('second')
+            connection_manager.close(self.db_path)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        started.wait()
+        connection_manager.close(self.db_path)
+
+        # the connection of the other thread is still usable, and it is reopened at its next connect
+        proceed.set()
+        thread.join()
+        self.assertIsNot(conns['second'], conns['first'])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conns['first'].execute("SELECT COUNT(*) FROM ssp")
+
+    def test_profile_cache(self):
+        db = ProjectDb(projects_folder=os.path.dirname(self.db_path), project_name='unittest')
+        ssp = db.profile_by_pk(1)
+        ssp.cur.proc.speed[:] = 1500.0
+
+        # the cached profile is not modified by the callers
+        cached_ssp = db.profile_by_pk(1)
+        self.assertIsNot(cached_ssp, ssp)
+        self.assertTrue(np.all(cached_ssp.cur.proc.speed == 1415))
+
+        # the stored profile replaces the cached one
+        self.assertTrue(db.add_casts(ssp))
+        self.assertTrue(np.all(db.profile_by_pk(1).cur.proc.speed == 1500.0))
+        db.disconnect()
+
 
 def suite():
     s = unittest.TestSuite()
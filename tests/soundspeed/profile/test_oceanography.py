@@ -62,6 +62,17 @@ class TestSoundSpeedOceanography(unittest.TestCase):
 
         self.assertAlmostEqual(calc_vs, trusted_fof_vs, places=1)
 
+    def test_speed_array(self):
+        d = np.array([0.0, 10.0, 250.0, 1000.0, 9712.653])
+        t = np.array([25.0, 22.0, 12.0, 4.0, 20.0])
+        s = np.array([34.0, 34.5, 35.0, 34.9, 35.0])
+
+        calc_vs = Oc.speed(d=d, t=t, s=s, lat=30.0)
+
+        self.assertEqual(calc_vs.shape, d.shape)
+        for i in range(len(d)):
+            self.assertAlmostEqual(calc_vs[i], Oc.speed(d=d[i], t=t[i], s=s[i], lat=30.0), places=9)
+
     def test_sal(self):
         # check values from Fofonoff and Millard(1983)
         trusted_fof_d = 9712.653  # m
@@ -76,6 +87,19 @@ class TestSoundSpeedOceanography(unittest.TestCase):
 
         self.assertAlmostEqual(calc_s, trusted_fof_s, places=1)
 
+    def test_sal_array(self):
+        d = np.array([0.0, 10.0, 250.0, 1000.0, 9712.653])
+        t = np.array([25.0, 22.0, 12.0, 4.0, 20.0])
+        s = np.array([34.0, 30.5, 35.0, 12.9, 35.0])
+        vs = Oc.speed(d=d, t=t, s=s, lat=30.0)
+
+        calc_s = Oc.sal(d=d, speed=vs, t=t, lat=30.0)
+
+        self.assertEqual(calc_s.shape, d.shape)
+        for i in range(len(d)):
+            self.assertAlmostEqual(calc_s[i], s[i], places=1)
+            self.assertEqual(calc_s[i], Oc.sal(d=d[i], speed=vs[i], t=t[i], lat=30.0))
+
     def test_atg(self):
         # check values from Fofonoff and Millard(1983)
         atg_ck = 3.255976e-4
@@ -102,6 +126,18 @@ class TestSoundSpeedOceanography(unittest.TestCase):
 
         self.assertAlmostEqual(t0_calc, t0_ck, places=1)
 
+    def test_in_situ_temp_columns(self):
+        s = np.array([[35.0, 35.5, 34.8], [36.0, 34.7, 40.0]])
+        t = np.array([[28.0, 15.0, 4.0], [22.0, 2.0, 36.89073]])
+        p = np.array([[10.0, 500.0, 3000.0], [0.0, 5000.0, 10000.0]])
+
+        t0_calc = Oc.in_situ_temp(s=s, t=t, p=p, pr=0.0)
+
+        self.assertEqual(t0_calc.shape, s.shape)
+        theta_calc = Oc.pot_temp(s=s, t=t0_calc, p=p, pr=0.0)
+        for theta, theta_ck in zip(theta_calc.flat, t.flat):
+            self.assertAlmostEqual(theta, theta_ck, places=4)
+
     def test_cr2s(self):
         cr_ck = 1.1
         t_ck = 40.0
@@ -0,0 +1,283 @@
+import copy
+import logging
+import os
+import unittest
+
+import numpy as np
+
+from hyo2.ssm2.lib.soundspeed import SoundSpeedLibrary
+from hyo2.ssm2.lib.base.callbacks.fake_callbacks import FakeCallbacks
+from hyo2.ssm2.lib.base.testing import SoundSpeedTesting
+from hyo2.ssm2.lib.profile.dicts import Dicts
+from hyo2.ssm2.lib.profile.profile import Profile
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_statistical_filter(ssp):
+    """Loop-based statistical filter, used as reference for the vectorized implementation"""
+    speed = ssp.proc.speed[ssp.proc_valid]
+    depth = ssp.proc.depth[ssp.proc_valid]
+
+    sigma = speed * 0.0
+    speed_mean = speed * 0.0
+
+    nr_samples = len(speed)
+    sigma_min_th = 0.2
+
+    for i in range(2, nr_samples - 2):
+        speed_sum = 0
+        speed_sum_sq = 0
+        for k in range(-2, 3):
+            if k == 0:
+                continue
+            speed_sum += speed[i + k]
+            speed_sum_sq += speed[i + k] * speed[i + k]
+
+        variance = ((4 * speed_sum_sq) - speed_sum * speed_sum) / (4 * 3)
+        speed_mean[i] = speed_sum / 4
+        if variance < 0:
+            variance = 0
+        sigma[i] = np.sqrt(variance)
+        if sigma[i] < sigma_min_th:
+            sigma[i] = sigma_min_th
+
+    c_end = 1.3
+    ends_i = [0, 1, nr_samples - 2, nr_samples - 1]
+    index = [(1, 2, 3), (0, 2, 3), (nr_samples - 4, nr_samples - 3, nr_samples - 1),
+             (nr_samples - 4, nr_samples - 3, nr_samples - 2)]
+    for k in range(4):
+        speed_sum = 0
+        speed_sum_sq = 0
+        i = ends_i[k]
+        for j in range(3):
+            ind_kj = index[k][j]
+            speed_sum += speed[ind_kj]
+            speed_sum_sq += speed[ind_kj] * speed[ind_kj]
+
+        variance = ((3 * speed_sum_sq) - speed_sum * speed_sum) / (3 * 2)
+        speed_mean[i] = speed_sum / 3
+        if variance < 0:
+            variance = 0
+        sigma[i] = np.sqrt(variance)
+        if sigma[i] < sigma_min_th:
+            sigma[i] = sigma_min_th
+        sigma[i] *= c_end
+
+    nr_std_dev = 2
+    depth_th = 33.0
+    factor = 1.3
+    stat_filtered = np.zeros(nr_samples, dtype=bool)
+    for i in range(nr_samples):
+        if depth[i] > depth_th:
+            factor = 1.0
+        th = factor * nr_std_dev * sigma[i]
+        if np.absolute(speed[i] - speed_mean[i]) > th:
+            stat_filtered[i] = True
+
+    filtered_ii = np.zeros(len(ssp.proc_valid), dtype=bool)
+    filtered_ii[ssp.proc_valid] = stat_filtered
+    valid_and_filtered_ii = np.logical_and(ssp.proc_valid, filtered_ii)
+    ssp.proc.flag[valid_and_filtered_ii] = Dicts.flags['filtered']
+
+
+def legacy_cosine_smooth(ssp):
+    """Loop-based cosine smoothing, used as reference for the vectorized implementation"""
+    zs = ssp.proc.depth[ssp.proc_valid]
+
+    names = ["pressure", "speed", "temp", "conductivity", "sal"]
+    records = dict()
+    for name in names:
+        records[name] = getattr(ssp.proc, name)[ssp.proc_valid]
+
+    window_width = np.maximum(np.absolute(zs * 0.0025), 1.7)
+    z_min = zs.min()
+    z_max = zs.max()
+    bin_size = 1.0
+    bin_width = 4
+    storage = np.zeros([len(names) + 2, int(2 * (bin_width + 1) + (z_max - z_min) / bin_size)])
+
+    for i in range(storage.shape[1]):
+        storage[0][i] = z_min + (- bin_width + i) * bin_size
+
+    for i, z in enumerate(zs):
+        center_idx = int((z - z_min) / bin_size + .5) + bin_width
+        z_diff = z - storage[0][center_idx - bin_width:center_idx + bin_width + 1]
+        bin_weights = 1.0 + np.cos(2.69 * z_diff / window_width[i])
+        bin_weights *= np.absolute(z_diff) < window_width[i]
+        for j, name in enumerate(names):
+            storage[1 + j][center_idx - bin_width:center_idx + bin_width + 1] += records[name][i] * bin_weights
+        storage[-1][center_idx - bin_width:center_idx + bin_width + 1] += bin_weights
+
+    storage = storage[:, bin_width: -(bin_width + 1)]
+    storage = np.compress(storage[-1] > 0.1, storage, axis=1)
+    for i in range(len(names)):
+        storage[1 + i] /= storage[-1]
+    delta_zs = np.hstack(([1.0], np.diff(storage[0])))
+    storage = np.compress(delta_zs >= .00001, storage, axis=1)
+
+    last_depth = 0.0
+    for row in storage.T:
+        d_th = float(row[0])
+        if d_th < last_depth:
+            continue
+        last_depth = d_th
+        try:
+            z_bools = np.logical_and(ssp.proc_valid, ssp.proc.depth > d_th)
+            i = np.argwhere(z_bools)[0]
+        except IndexError:
+            i = zs.size
+
+        ssp.proc.depth = np.insert(ssp.proc.depth, i, d_th)
+        ssp.proc.source = np.insert(ssp.proc.source, i, Dicts.sources['smoothing'])
+        ssp.proc.flag = np.insert(ssp.proc.flag, i, Dicts.flags['valid'])
+        for j, name in enumerate(names):
+            setattr(ssp.proc, name, np.insert(getattr(ssp.proc, name), i, row[j + 1]))
+
+    ssp.proc.num_samples = ssp.proc.depth.size
+    ssp.proc.flag[ssp.proc.source != Dicts.sources['smoothing']] = Dicts.flags['smoothed']
+
+
+def legacy_douglas_peucker_1d(depth, speed, start, end, tolerance, data):
+    """Recursive Douglas-Peucker thinning, used as reference for the iterative implementation"""
+    data[start] = Dicts.flags['thin']
+    data[end] = Dicts.flags['thin']
+
+    slope = (speed[end] - speed[start]) / (depth[end] - depth[start])
+
+    max_dist = 0
+    max_ind = 0
+    for ind in range(start + 1, end):
+        dist = abs(speed[start] + slope * (depth[ind] - depth[start]) - speed[ind])
+        if dist > max_dist:
+            max_dist = dist
+            max_ind = ind
+
+    if max_dist <= tolerance:
+        return
+
+    data[max_ind] = Dicts.flags['thin']
+    legacy_douglas_peucker_1d(depth, speed, start, max_ind, tolerance, data=data)
+    legacy_douglas_peucker_1d(depth, speed, max_ind, end, tolerance, data=data)
+
+
+def synthetic_sis_profile(nr_samples, seed=0):
+    """A profile with noisy sis samples, long enough to be thinned"""
+    rng = np.random.default_rng(seed)
+    ssp = Profile()
+    ssp.init_sis(nr_samples)
+    ssp.sis.depth[:] = np.cumsum(rng.uniform(0.1, 1.0, nr_samples))
+    ssp.sis.speed[:] = 1500.0 + 20.0 * np.sin(ssp.sis.depth / 50.0) + rng.normal(0.0, 0.2, nr_samples)
+    ssp.sis.flag[:] = Dicts.flags['valid']
+    return ssp
+
+
+def synthetic_profile(nr_samples, seed=0):
+    """A profile with noisy, increasing depths and invalid samples interleaved with the valid ones"""
+    rng = np.random.default_rng(seed)
+    ssp = Profile()
+    ssp.init_proc(nr_samples)
+    ssp.proc.depth[:] = 0.37 + np.cumsum(rng.uniform(0.05, 0.9, nr_samples))
+    ssp.proc.pressure[:] = ssp.proc.depth * 1.01
+    ssp.proc.speed[:] = 1500.0 - 0.02 * ssp.proc.depth + rng.normal(0.0, 0.3, nr_samples)
+    ssp.proc.temp[:] = 20.0 - 0.05 * ssp.proc.depth + rng.normal(0.0, 0.1, nr_samples)
+    ssp.proc.conductivity[:] = rng.uniform(30.0, 40.0, nr_samples)
+    ssp.proc.sal[:] = 34.0 + rng.normal(0.0, 0.1, nr_samples)
+    ssp.proc.source[:] = Dicts.sources['raw']
+    ssp.proc.flag[:] = Dicts.flags['valid']
+    ssp.proc.flag[rng.uniform(size=nr_samples) < 0.2] = Dicts.flags['user']
+    return ssp
+
+
+class TestSoundSpeedProfile(unittest.TestCase):
+
+    def setUp(self):
+        data_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+        self.testing = SoundSpeedTesting(root_folder=data_folder)
+
+    def tearDown(self):
+        pass
+
+    def test_statistical_filter_regression(self):
+        lib = SoundSpeedLibrary(callbacks=FakeCallbacks())
+        tests = self.testing.input_dict_test_files(inclusive_filters=["castaway", "mvp", "seabird", "valeport"])
+
+        nr_checked = 0
+        for testfile in tests.keys():
+
+            if os.path.basename(testfile)[0] != "_":
+                continue
+
+            lib.import_data(data_path=testfile, data_format=tests[testfile].name, skip_atlas=True)
+
+            for ssp in lib.ssp.l:
+                if ssp.nr_valid_proc_samples < 4:
+                    continue
+
+                ref_ssp = copy.deepcopy(ssp)
+                legacy_statistical_filter(ref_ssp)
+                ssp.statistical_filter()
+
+                self.assertTrue(np.array_equal(ssp.proc.flag, ref_ssp.proc.flag), testfile)
+                nr_checked += 1
+
+        self.assertGreater(nr_checked, 0)
+
+    def test_douglas_peucker_regression(self):
+        for tolerance in [0.01, 0.1, 0.5]:
+            ssp = synthetic_sis_profile(nr_samples=2000, seed=3)
+            depth = ssp.sis.depth[ssp.sis_valid]
+            speed = ssp.sis.speed[ssp.sis_valid]
+            ref_flag = ssp.sis.flag[ssp.sis_valid].copy()
+            legacy_douglas_peucker_1d(depth, speed, 0, depth.size - 1, tolerance=tolerance, data=ref_flag)
+
+            flag = ssp.sis.flag[ssp.sis_valid].copy()
+            Profile.douglas_peucker_1d(depth=depth, speed=speed, start=0, end=depth.size - 1, tolerance=tolerance,
+                                       data=flag)
+            self.assertTrue(np.array_equal(flag, ref_flag), tolerance)
+
+            ssp.thin(tolerance=tolerance)
+            self.assertTrue(np.array_equal(ssp.sis.flag, ref_flag), tolerance)
+
+    def test_thin_max_samples(self):
+        tolerance = 0.1
+        ref_ssp = synthetic_sis_profile(nr_samples=2000, seed=4)
+        ref_ssp.thin(tolerance=tolerance)
+        nr_thinned = np.count_nonzero(ref_ssp.sis.flag == Dicts.flags['thin'])
+        self.assertGreater(nr_thinned, 100)
+
+        # when the budget is not binding, the outcome is the same as the tolerance-based thinning
+        for max_samples in [nr_thinned, nr_thinned + 500]:
+            ssp = synthetic_sis_profile(nr_samples=2000, seed=4)
+            ssp.thin(tolerance=tolerance, max_samples=max_samples)
+            self.assertTrue(np.array_equal(ssp.sis.flag, ref_ssp.sis.flag), max_samples)
+
+        # otherwise, the budget is respected with the end points and a subset of the tolerance-based samples
+        for max_samples in [2, 50, nr_thinned - 1]:
+            ssp = synthetic_sis_profile(nr_samples=2000, seed=4)
+            ssp.thin(tolerance=tolerance, max_samples=max_samples)
+            thinned = ssp.sis.flag == Dicts.flags['thin']
+            self.assertEqual(np.count_nonzero(thinned), max_samples)
+            self.assertTrue(thinned[0] and thinned[-1])
+            self.assertFalse(np.any(thinned & (ref_ssp.sis.flag != Dicts.flags['thin'])))
+
+    def test_cosine_smooth_regression(self):
+        for seed in range(5):
+            ssp = synthetic_profile(nr_samples=400, seed=seed)
+            # the deepest valid sample is not on a bin value, where the legacy merge used a stale index
+            zs = ssp.proc.depth[ssp.proc_valid]
+            self.assertNotAlmostEqual((zs.max() - zs.min()) % 1.0, 0.0)
+
+            ref_ssp = copy.deepcopy(ssp)
+            legacy_cosine_smooth(ref_ssp)
+            ssp.cosine_smooth()
+
+            self.assertEqual(ssp.proc.num_samples, ref_ssp.proc.num_samples)
+            for name in ["depth", "pressure", "speed", "temp", "conductivity", "sal", "source", "flag"]:
+                self.assertTrue(np.array_equal(getattr(ssp.proc, name), getattr(ref_ssp.proc, name)), name)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedProfile))
+    return s
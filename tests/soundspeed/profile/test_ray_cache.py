@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+
+from hyo2.ssm2.lib.profile.ray_tracing.ray_cache import RayCache
+
+
+class TestSoundSpeedRayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.depths = np.array([0.0, 5.0, 12.0, 30.0, 55.0])
+        self.speeds = np.array([1505.0, 1504.2, 1503.1, 1499.9, 1495.0])
+
+    def tearDown(self):
+        pass
+
+    def test_make_key(self):
+        key = RayCache.make_key(self.depths, self.speeds, draft=0.0, launch=30.0)
+
+        self.assertEqual(key, RayCache.make_key(self.depths.copy(), self.speeds.copy(), launch=30.0, draft=0.0))
+        self.assertNotEqual(key, RayCache.make_key(self.depths, self.speeds, draft=0.5, launch=30.0))
+        self.assertNotEqual(key, RayCache.make_key(self.depths, self.speeds + 0.1, draft=0.0, launch=30.0))
+        self.assertNotEqual(key, RayCache.make_key(self.depths[:-1], self.speeds[:-1], draft=0.0, launch=30.0))
+
+    def test_get_put(self):
+        cache = RayCache()
+        key = RayCache.make_key(self.depths, self.speeds)
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, {'ray_t': np.zeros(10)})
+        entry = cache.get(key)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertFalse(entry['ray_t'].flags.writeable)
+
+    def test_lru_eviction(self):
+        cache = RayCache(max_size_mb=3 * 8000 / (1024 * 1024))
+        for idx in range(3):
+            cache.put("key%d" % idx, np.zeros(1000))
+        self.assertIsNotNone(cache.get("key0"))
+
+        cache.put("key3", np.zeros(1000))
+        self.assertEqual(len(cache), 3)
+        self.assertIsNotNone(cache.get("key0"))
+        self.assertIsNone(cache.get("key1"))
+
+        cache.put("too_large", np.zeros(10000))
+        self.assertIsNone(cache.get("too_large"))
+        self.assertEqual(len(cache), 3)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedRayCache))
+    return s
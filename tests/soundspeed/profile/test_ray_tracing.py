@@ -0,0 +1,112 @@
+import unittest
+import numpy as np
+
+from hyo2.ssm2.lib.profile.profile import Profile
+from hyo2.ssm2.lib.profile.ray_tracing.diff_tracedprofiles import DiffTracedProfiles
+from hyo2.ssm2.lib.profile.ray_tracing.ray_tracing import RayTracing
+from hyo2.ssm2.lib.profile.ray_tracing.tracedprofile import TracedProfile
+
+
+class TestSoundSpeedRayTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.depths = np.array([0.0, 5.0, 12.0, 30.0, 55.0, 80.0, 150.0, 300.0, 301.0, 700.0])
+        self.speeds = np.array([1505.0, 1504.2, 1503.1, 1499.9, 1495.0, 1495.0, 1490.2, 1487.6, 1487.7, 1484.1])
+
+    def tearDown(self):
+        pass
+
+    @staticmethod
+    def make_ssp(depths, speeds):
+        ssp = Profile()
+        ssp.init_proc(depths.size)
+        ssp.proc.depth[:] = depths
+        ssp.proc.speed[:] = speeds
+        return ssp
+
+    def test_layer_parameters_fast_vs_slow(self):
+        for angle in (0.0, 15.0, 45.0, 70.0):
+            slow = RayTracing.get_svp_layer_parameters_slow(np.deg2rad(angle), self.depths, self.speeds)
+            fast = RayTracing.get_svp_layer_parameters_fast(np.deg2rad(angle), self.depths, self.speeds)
+            for slow_param, fast_param in zip(slow, fast):
+                np.testing.assert_allclose(fast_param, slow_param, rtol=1e-9, atol=1e-9)
+
+    def test_ray_trace_fast_vs_slow(self):
+        for angle in (0.0, 15.0, 45.0, 70.0):
+            params = RayTracing.get_svp_layer_parameters(np.deg2rad(angle), self.depths, self.speeds)
+            travel_times = np.arange(0.002, params[3][-1] + 0.1, 0.002)
+            for b_project in (False, True):
+                slow = RayTracing.ray_trace_slow(travel_times, self.depths, self.speeds, params, b_project=b_project)
+                fast = RayTracing.ray_trace_fast(travel_times, self.depths, self.speeds, params, b_project=b_project)
+                np.testing.assert_allclose(fast, slow, rtol=1e-9, atol=1e-9)
+
+    def test_trace_angles_constant_speed(self):
+        depths = np.array([0.0, 10.0, 10.0, 250.0, 1000.0])
+        speeds = np.full(depths.shape, 1500.0)
+        angles = np.array([0.0, 30.0, 60.0])
+
+        total_z, total_x, total_t = TracedProfile.trace_angles(depths=depths, speeds=speeds, angles=angles)
+
+        np.testing.assert_allclose(total_z, [0.0, 10.0, 250.0, 1000.0])
+        self.assertEqual(total_x.shape, (3, 4))
+        for i, angle in enumerate(np.radians(angles)):
+            np.testing.assert_allclose(total_x[i], total_z * np.tan(angle), atol=1e-9)
+            np.testing.assert_allclose(total_t[i], total_z / (1500.0 * np.cos(angle)), rtol=1e-12)
+
+    def test_trace_angles_constant_gradient(self):
+        depths = np.array([0.0, 100.0, 200.0])
+        speeds = np.array([1500.0, 1510.0, 1500.0])
+
+        total_z, total_x, total_t = TracedProfile.trace_angles(depths=depths, speeds=speeds, angles=[0.0, 20.0])
+
+        # vertical ray: t = ln(c1 / c0) / g for each layer
+        np.testing.assert_allclose(total_x[0], 0.0, atol=1e-9)
+        np.testing.assert_allclose(total_t[0], [0.0, 10.0 * np.log(1510.0 / 1500.0), 20.0 * np.log(1510.0 / 1500.0)],
+                                   rtol=1e-12)
+        # symmetric layers: the ray spends the same time and range in both of them
+        np.testing.assert_allclose(total_x[1, 2], 2.0 * total_x[1, 1], rtol=1e-9)
+        np.testing.assert_allclose(total_t[1, 2], 2.0 * total_t[1, 1], rtol=1e-9)
+
+    def test_traced_profile_compact_rays(self):
+        tp = TracedProfile(ssp=self.make_ssp(self.depths, self.speeds), half_swath=10.0)
+
+        self.assertEqual(tp.nr_rays, 11)
+        self.assertEqual(tp.ray_t.dtype, np.float32)
+        self.assertEqual(tp.ray_t.shape[1], tp.ray_slice.stop - tp.ray_slice.start)
+        self.assertLessEqual(tp.ray_grid[tp.ray_slice.stop - 1], self.depths[-1])
+        ray = tp.ray(10)
+        self.assertEqual(ray.shape, (3, len(TracedProfile.decimetric_grid)))
+        self.assertTrue(np.all(np.isnan(ray[0][tp.ray_slice.stop:])))
+        self.assertFalse(np.any(np.isnan(ray[0][tp.ray_slice])))
+
+    def test_diff_traced_profiles(self):
+        old_tp = TracedProfile(ssp=self.make_ssp(self.depths, self.speeds), half_swath=10.0)
+        new_tp = TracedProfile(ssp=self.make_ssp(self.depths[:-1], self.speeds[:-1] + 2.0), half_swath=10.0)
+
+        diff = DiffTracedProfiles(old_tp=old_tp, new_tp=new_tp)
+        diff.calc_diff()
+
+        self.assertEqual(len(diff.new_rays), 11)
+        self.assertEqual(len(diff.old_rays), 11)
+        for new_ray, old_ray in zip(diff.new_rays, diff.old_rays):
+            self.assertEqual(new_ray[0][0], 0.0)
+            self.assertEqual(old_ray[0][0], 0.0)
+            # both the rays are cut at the shorter travel time
+            self.assertLessEqual(abs(new_ray[0][-1] - old_ray[0][-1]), 1e-3)
+
+    def test_diff_traced_profiles_no_overlap(self):
+        old_tp = TracedProfile(ssp=self.make_ssp(self.depths[:5], self.speeds[:5]), half_swath=10.0)
+        new_tp = TracedProfile(ssp=self.make_ssp(self.depths[5:], self.speeds[5:]), half_swath=10.0)
+
+        diff = DiffTracedProfiles(old_tp=old_tp, new_tp=new_tp)
+        diff.calc_diff()
+
+        self.assertEqual(len(diff.new_rays), 11)
+        for new_ray in diff.new_rays:
+            self.assertEqual(new_ray.shape, (3, 0))
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSoundSpeedRayTracing))
+    return s